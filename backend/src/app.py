@@ -10,10 +10,11 @@ import logging
 import threading
 import time
 import base64  # <--- 🟢 請補上這一行！
+import queue
 from logging.handlers import RotatingFileHandler
 from datetime import datetime
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory, g
+from flask import Flask, request, jsonify, send_from_directory, g, Response
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -70,6 +71,12 @@ class UserIdFilter(logging.Filter):
 
 # ============================================
 
+def _count_rate_limited(request_limit):
+    """Rate Limiter 拒絕請求時計數 (返回 None 使用預設的 429 回應)"""
+    RATE_LIMITED.labels(endpoint=request.endpoint or "unknown").inc()
+    return None
+
+
 # 初始化 Rate Limiter (使用 Redis 作為儲存後端)
 limiter = Limiter(
     app=app,
@@ -78,7 +85,8 @@ limiter = Limiter(
     # default_limits=["100 per hour"],
     default_limits=["10000 per hour"],  # <-- 改成這樣，或者直接拿掉這行
     storage_options={"socket_connect_timeout": 30},
-    strategy="fixed-window"
+    strategy="fixed-window",
+    on_breach=_count_rate_limited
 )
 
 # 設定 CORS - 允許所有來源的跨域請求
@@ -106,15 +114,16 @@ def before_request_handler():
     else:
         ip_address = request.remote_addr or 'unknown'
     
-    # 從資料庫獲取或建立用戶 ID
-    if db_client:
-        user_id = db_client.get_or_create_user_id(ip_address)
+    # 獲取或建立用戶 ID (行程內快取，未命中才查詢資料庫)
+    if user_id_cache:
+        user_id = user_id_cache.get(ip_address)
         if user_id > 0:
             g.user_id = f"User#{user_id:03d}"
         else:
             g.user_id = "User#ERR"
     else:
         g.user_id = "User#N/A"
+    g.client_ip = ip_address
     
     # 記錄請求開始
     logger.debug(f"📨 {request.method} {request.path} - IP: {ip_address}")
@@ -143,7 +152,7 @@ def after_request(response):
     
     # 記錄請求完成 + Redis 隊列深度
     try:
-        queue_depth = redis_client.llen(REDIS_QUEUE_NAME) if redis_client else 0
+        queue_depth = scheduler.pending_count(redis_client, REDIS_QUEUE_NAME) if redis_client else 0
         logger.info(f"✓ {request.method} {request.path} - {response.status_code} | Queue: {queue_depth}")
     except Exception:
         logger.info(f"✓ {request.method} {request.path} - {response.status_code}")
@@ -164,7 +173,9 @@ from config import (
     STORAGE_OUTPUT_DIR,
     # [TEMP] Veo3 測試模式配置
     VEO3_TEST_MODE, VEO3_TEST_VIDEO_PATH,
-    PROJECT_ROOT  # 需要用於定位測試視頻文件
+    PROJECT_ROOT,  # 需要用於定位測試視頻文件
+    SSE_HEARTBEAT_SECONDS, SSE_MAX_SECONDS,
+    USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_ENTRIES, USER_ACTIVITY_FLUSH_SECONDS
 )
 REDIS_QUEUE_NAME = JOB_QUEUE
 
@@ -172,6 +183,14 @@ REDIS_QUEUE_NAME = JOB_QUEUE
 # Database Connection Setup
 # ============================================
 from shared.database import Database, User, get_db_session, init_db
+from shared.blob_store import put_base64, is_blob_ref, resolve_ref
+from shared.stage_timing import get_job_timing, get_timing_summary
+from shared.job_status import set_job_status, status_counts, TERMINAL_STATUSES
+from shared import scheduler
+from shared.metrics import (
+    JOBS_SUBMITTED, QUEUE_DEPTH, RATE_LIMITED,
+    render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+)
 from shared.config_base import (
     DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
 )
@@ -190,6 +209,18 @@ try:
 except Exception as e:
     logger.warning(f"⚠️ 資料庫連接失敗 (功能降級): {e}")
 
+# IP → 用戶 ID 快取 (before_request 使用，last_active 批次寫回)
+from user_cache import UserIdCache
+user_id_cache = None
+if db_client:
+    user_id_cache = UserIdCache(
+        db_client,
+        ttl=USER_CACHE_TTL_SECONDS,
+        max_entries=USER_CACHE_MAX_ENTRIES,
+        flush_interval=USER_ACTIVITY_FLUSH_SECONDS
+    )
+    user_id_cache.start()
+
 # ============================================
 # Flask-Login user_loader callback
 # ============================================
@@ -214,10 +245,20 @@ try:
     # 配置 Limiter 使用 Redis
     limiter.storage_uri = f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/1"
     
+    # /metrics 抓取時以 LLEN + HLEN 取得等待中任務數 (O(1))
+    QUEUE_DEPTH.set_function(lambda: scheduler.pending_count(redis_client, REDIS_QUEUE_NAME))
+    
 except Exception as e:
     logger.error(f"✗ Redis 连接失败: {e}")
     redis_client = None
 
+# 狀態事件分派 (所有 SSE 串流共用一條 Pub/Sub 連線)
+from status_events import StatusBroker, RESYNC
+status_broker = None
+if redis_client:
+    status_broker = StatusBroker(redis_client)
+    status_broker.start()
+
 # ============================================
 # 音訊上傳設定
 # ============================================
@@ -734,6 +775,36 @@ def generate():
             except Exception as e:
                 logger.error(f"❌ Base64 音訊解碼失敗: {e}")
                 return jsonify({'error': 'Invalid base64 audio data'}), 400
+        # =====================================================
+        # 上傳圖片轉存到內容定址 blob store
+        # 佇列訊息與 DB workflow_data 只保留 {"blob": sha256, "size": n} 引用，
+        # 避免數十 MB 的 base64 進入 Redis 與 MySQL
+        # =====================================================
+        images = data.get('images') or {}
+        if not isinstance(images, dict):
+            return jsonify({'error': 'images must be an object'}), 400
+        image_refs = {}
+        for field_name, image_val in images.items():
+            if not image_val:
+                continue
+            if is_blob_ref(image_val):
+                # 既有 blob 引用：驗證雜湊格式與存在性，並以實際大小重建
+                try:
+                    image_refs[field_name] = resolve_ref(image_val)
+                except (ValueError, FileNotFoundError) as e:
+                    logger.warning(f"⚠️ 圖片 {field_name} 的 blob 引用無效: {e}")
+                    return jsonify({'error': f'Invalid or expired image reference for {field_name}'}), 400
+                continue
+            if not isinstance(image_val, str):
+                return jsonify({'error': f'Invalid image data for {field_name}'}), 400
+            try:
+                image_refs[field_name] = put_base64(image_val)
+            except Exception as e:
+                logger.error(f"❌ 圖片 {field_name} 轉存失敗: {e}")
+                return jsonify({'error': f'Invalid base64 image data for {field_name}'}), 400
+        if image_refs:
+            logger.info(f"✓ 已轉存 {len(image_refs)} 張圖片到 blob store")
+        
         # 2. 生成唯一的 job_id
         job_id = str(uuid.uuid4())
         
@@ -747,7 +818,7 @@ def generate():
             'model': data.get('model', 'turbo_fp8'),
             'aspect_ratio': data.get('aspect_ratio', '1:1'),
             'batch_size': data.get('batch_size', 1),
-            'images': data.get('images', {}),  # Base64 圖片字典
+            'images': image_refs,  # 圖片 blob 引用字典 {"source": {"blob": sha256, "size": n}}
             'audio': data.get('audio', ''),  # 音訊檔名 (virtual_human 工作流使用)
             'created_at': datetime.now().isoformat()
         }
@@ -773,10 +844,8 @@ def generate():
                 test_video_filename = os.path.basename(VEO3_TEST_VIDEO_PATH)
                 test_video_url = f'/api/outputs/{test_video_filename}'
                 
-                status_key = f"job:status:{job_id}"
-                redis_client.hset(status_key, mapping={
+                set_job_status(redis_client, job_id, 'finished', {  # 前端檢查 'finished' 狀態
                     'job_id': job_id,
-                    'status': 'finished',  # 前端檢查 'finished' 狀態
                     'progress': 100,
                     'image_url': test_video_url,  # 前端讀取 'image_url' 欄位
                     'video_url': test_video_url,  # 同時設置 video_url 供未來使用
@@ -784,8 +853,7 @@ def generate():
                     'error': '',
                     'updated_at': datetime.now().isoformat(),
                     'test_mode': 'true'  # 標記為測試模式
-                })
-                redis_client.expire(status_key, 86400)
+                }, ttl=86400)
                 
                 # 將測試視頻複製到 outputs 目錄以便下載
                 import shutil
@@ -822,6 +890,13 @@ def generate():
             if current_user.is_authenticated:
                 user_id_for_job = current_user.id
             
+            # 公平排程：每個會員 (訪客依 IP) 各自一條子佇列，優先級依 workflow 類別
+            if user_id_for_job is not None:
+                queue_owner = f"user:{user_id_for_job}"
+            else:
+                queue_owner = f"ip:{g.get('client_ip', 'unknown')}"
+            priority, _ = scheduler.classify(workflow)
+            
             # 6. 建立 Job 物件並加入 Session
             from shared.database import Job
             new_job = Job(
@@ -835,6 +910,7 @@ def generate():
                 batch_size=job_data.get('batch_size', 1),
                 seed=job_data.get('seed', -1),
                 status='queued',
+                priority=priority,
                 input_audio_path=job_data.get('audio', None)
             )
             session.add(new_job)
@@ -843,31 +919,31 @@ def generate():
             session.flush()
             logger.info(f"✓ Job {job_id} 已寫入資料庫 (未提交)")
             
-            # 8. 推送到 Redis 佇列
-            redis_client.rpush(REDIS_QUEUE_NAME, json.dumps(job_data))
-            logger.info(f"✓ Job {job_id} 已推送至 Redis")
+            # 8. 推送到 Redis 排程佇列 (所屬使用者的子佇列)
+            scheduler.enqueue(redis_client, job_data, queue_owner)
+            logger.info(f"✓ Job {job_id} 已推送至 Redis ({priority}, {queue_owner})")
             
-            # 9. 初始化 Redis 狀態 Hash
-            status_key = f"job:status:{job_id}"
-            redis_client.hset(status_key, mapping={
+            # 9. 初始化 Redis 狀態 Hash (24 小時過期)
+            # Worker 可能已經取出任務並更新狀態，此時不可覆寫回 queued
+            set_job_status(redis_client, job_id, 'queued', {
                 'job_id': job_id,
-                'status': 'queued',
                 'progress': 0,
                 'image_url': '',
                 'error': '',
                 'updated_at': datetime.now().isoformat()
-            })
-            redis_client.expire(status_key, 86400)  # 24小时过期
+            }, ttl=86400, unless=('processing',) + TERMINAL_STATUSES)
             logger.info(f"✓ Job {job_id} Redis 狀態已初始化")
             
             # 10. 提交事務
             session.commit()
             logger.info(f"✓ Job {job_id} 事務已提交")
+            JOBS_SUBMITTED.labels(workflow=workflow).inc()
             
             # 11. 返回成功响应 (只有在事務提交成功後才返回)
             return jsonify({
                 'job_id': job_id,
                 'status': 'queued',
+                'priority': priority,
                 'message': '任務已成功提交'
             }), 200
             
@@ -917,7 +993,9 @@ def status(job_id):
         "status": "processing",
         "progress": 50,
         "image_url": null,
-        "error": ""
+        "error": "",
+        "queue_position": null,   // 排隊中：在排程佇列中的位置
+        "eta_seconds": 42.5       // 排隊中 / 執行中：預估完成剩餘秒數 (無歷史資料時為 null)
     }
     """
     try:
@@ -940,6 +1018,7 @@ def status(job_id):
                     'progress': int(job_status.get('progress', 0)),
                     'image_url': job_status.get('image_url', ''),
                     'error': job_status.get('error', ''),
+                    **_eta_fields(job_id, job_status),
                     'source': 'redis'  # 標記數據來源
                 }), 200
         
@@ -955,23 +1034,7 @@ def status(job_id):
                 if job:
                     # 從資料庫恢復狀態
                     logger.info(f"✓ 從資料庫恢復任務狀態: {job_id} (status={job.status})")
-                    
-                    # 處理 output_path 轉換為 image_url 格式
-                    image_url = ''
-                    if job.status == 'finished':
-                        # 從 Job ID 推導輸出檔案路徑 (根據實際儲存邏輯)
-                        # 假設格式為: {job_id}_0.png
-                        image_url = f"/outputs/{job_id}_0.png"
-                    
-                    return jsonify({
-                        'job_id': job.id,
-                        'status': job.status,
-                        'progress': 100 if job.status == 'finished' else 0,
-                        'image_url': image_url,
-                        'error': '',
-                        'source': 'database',  # 標記數據來源
-                        'created_at': job.created_at.isoformat() if job.created_at else None
-                    }), 200
+                    return jsonify(_db_status_payload(job)), 200
                     
             finally:
                 session.close()
@@ -989,16 +1052,213 @@ def status(job_id):
         return jsonify({'error': 'Internal server error'}), 500
 
 
+def _status_payload(job_id: str, job_status: dict) -> dict:
+    """狀態 Hash → 與 /api/status 相同格式的回應"""
+    return {
+        'job_id': job_status.get('job_id', job_id),
+        'status': job_status.get('status', 'unknown'),
+        'progress': int(job_status.get('progress', 0)),
+        'image_url': job_status.get('image_url', ''),
+        'error': job_status.get('error', ''),
+    }
+
+
+def _eta_fields(job_id: str, job_status: dict) -> dict:
+    """
+    排隊位置與預估剩餘時間 (依 shared.runtime_stats 學到的各 workflow 執行時間)
+    
+    - queued: 依排程佇列中排在前面的任務估計等待時間，再加上本任務的預估執行時間
+    - processing: 預估執行時間減去已執行時間 (Worker 提交到 ComfyUI 時寫入 started_at)
+    """
+    fields = {'queue_position': None, 'eta_seconds': None}
+    current_status = job_status.get('status')
+    try:
+        if current_status == 'queued':
+            position = scheduler.queue_position(redis_client, REDIS_QUEUE_NAME, job_id)
+            if position:
+                fields['queue_position'] = position['position']
+                fields['eta_seconds'] = round(position['wait_seconds'] + position['expected_seconds'], 1)
+        elif current_status == 'processing' and job_status.get('expected_seconds'):
+            started_at = float(job_status.get('started_at') or time.time())
+            remaining = float(job_status['expected_seconds']) - (time.time() - started_at)
+            fields['eta_seconds'] = round(max(0.0, remaining), 1)
+    except Exception as e:
+        logger.warning(f"⚠️ ETA 估計失敗: {e}")
+    return fields
+
+
+def _db_status_payload(job) -> dict:
+    """資料庫 Job 記錄 → /api/status 格式 (Redis 狀態已過期的歷史任務)"""
+    # 處理 output_path 轉換為 image_url 格式
+    image_url = ''
+    if job.status == 'finished':
+        # 從 Job ID 推導輸出檔案路徑 (根據實際儲存邏輯)
+        # 假設格式為: {job_id}_0.png
+        image_url = f"/outputs/{job.id}_0.png"
+    
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'progress': 100 if job.status == 'finished' else 0,
+        'image_url': image_url,
+        'error': '',
+        'source': 'database',  # 標記數據來源
+        'created_at': job.created_at.isoformat() if job.created_at else None
+    }
+
+
+# 批次查詢單次最多的任務數
+STATUS_BATCH_MAX = 100
+
+
+@app.route('/api/status/batch', methods=['POST'])
+@limiter.limit("2 per second")
+def get_status_batch():
+    """
+    POST /api/status/batch
+    一次查詢多個任務狀態 (多工具同時生成時取代逐一輪詢 /api/status/<job_id>)
+    
+    Redis 以單一 pipeline 讀取所有狀態 Hash；不在 Redis 中的任務再以一次
+    SELECT ... WHERE id IN (...) 從資料庫補齊。
+    
+    Request:
+    {
+        "job_ids": ["uuid1", "uuid2", ...]   // 最多 100 個
+    }
+    
+    Response:
+    {
+        "jobs": {
+            "uuid1": {"job_id": "uuid1", "status": "processing", "progress": 50, "image_url": "", "error": "", "source": "redis"},
+            "uuid2": {..., "source": "database"}
+        },
+        "missing": ["uuid3"]
+    }
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        job_ids = data.get('job_ids')
+        if not isinstance(job_ids, list) or not all(isinstance(j, str) for j in job_ids):
+            return jsonify({'error': 'job_ids must be a list of strings'}), 400
+        
+        job_ids = list(dict.fromkeys(job_ids))  # 去除重複並保持順序
+        if len(job_ids) > STATUS_BATCH_MAX:
+            return jsonify({'error': f'Too many job_ids (max {STATUS_BATCH_MAX})'}), 400
+        
+        jobs = {}
+        
+        # 1. Redis：一次 pipeline 讀取所有狀態
+        if redis_client and job_ids:
+            pipe = redis_client.pipeline(transaction=False)
+            for job_id in job_ids:
+                pipe.hgetall(f"job:status:{job_id}")
+            for job_id, job_status in zip(job_ids, pipe.execute()):
+                if job_status:
+                    jobs[job_id] = {**_status_payload(job_id, job_status), 'source': 'redis'}
+        
+        # 2. 資料庫：一次查詢補齊 Redis 中已過期的任務
+        pending = [job_id for job_id in job_ids if job_id not in jobs]
+        if db_client and pending:
+            session = get_db_session()
+            try:
+                from shared.database import Job
+                for job in session.query(Job).filter(Job.id.in_(pending)).all():
+                    jobs[job.id] = _db_status_payload(job)
+            finally:
+                session.close()
+        
+        missing = [job_id for job_id in job_ids if job_id not in jobs]
+        return jsonify({'jobs': jobs, 'missing': missing}), 200
+    
+    except Exception as e:
+        logger.error(f"✗ status batch 接口异常: {e}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+def _sse(event: dict) -> str:
+    return f"event: status\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/status/<job_id>/stream', methods=['GET'])
+@limiter.limit("20 per minute")
+def stream_status(job_id):
+    """
+    GET /api/status/<job_id>/stream
+    以 Server-Sent Events 推送任務狀態 (取代輪詢 /api/status)
+    
+    - 連線後先送出一次完整狀態，之後只送出變更的欄位 (status 一定包含)
+    - 任務進入終態 (finished / failed / cancelled) 後伺服器關閉串流
+    - 每 SSE_HEARTBEAT_SECONDS 送出註解心跳；超過 SSE_MAX_SECONDS 關閉，瀏覽器會自動重連
+    - Redis 中沒有此任務時返回 404，前端應改用 /api/status 輪詢 (會回退查詢資料庫)
+    
+    Event:
+        event: status
+        data: {"job_id": "...", "status": "processing", "progress": 50, ...}
+    """
+    if redis_client is None or status_broker is None:
+        return jsonify({'error': 'Redis service unavailable'}), 503
+    
+    # 先訂閱再讀取快照，避免兩者之間的事件遺失
+    status_key = f"job:status:{job_id}"
+    events = status_broker.subscribe(job_id)
+    try:
+        job_status = redis_client.hgetall(status_key)
+    except Exception:
+        status_broker.unsubscribe(job_id, events)
+        raise
+    if not job_status:
+        status_broker.unsubscribe(job_id, events)
+        return jsonify({'error': 'Job not found', 'job_id': job_id}), 404
+    
+    def generate():
+        try:
+            snapshot = _status_payload(job_id, job_status)
+            yield f"retry: 3000\n{_sse(snapshot)}"
+            if snapshot['status'] in TERMINAL_STATUSES:
+                return
+            
+            deadline = time.time() + SSE_MAX_SECONDS
+            while time.time() < deadline:
+                try:
+                    event = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                
+                # 訂閱重連期間可能遺失事件：改送完整狀態
+                if event is RESYNC:
+                    current = redis_client.hgetall(status_key)
+                    if not current:
+                        return
+                    event = _status_payload(job_id, current)
+                
+                yield _sse(event)
+                if event.get('status') in TERMINAL_STATUSES:
+                    return
+        finally:
+            status_broker.unsubscribe(job_id, events)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # 關閉 Nginx 緩衝
+    })
+
+
 @app.route('/api/cancel/<job_id>', methods=['POST'])
 def cancel_job(job_id):
     """
     POST /api/cancel/<job_id>
-    取消正在執行的任務
+    取消排隊中或正在執行的任務
+    
+    - 狀態改為 cancelled 並經 Pub/Sub (job:events:<job_id>) 推送給 Worker，
+      Worker 只移除 / 中斷該任務對應的 ComfyUI prompt
+    - 尚未被 Worker 取走的任務直接從 Redis 佇列移除
     
     Response:
     {
         "success": true,
-        "message": "Task cancelled"
+        "message": "Task cancelled",
+        "removed_from_queue": true
     }
     """
     try:
@@ -1023,15 +1283,29 @@ def cancel_job(job_id):
                 'message': f'Cannot cancel job with status: {current_status}'
             }), 400
         
-        # 將狀態設置為 cancelled
-        redis_client.hset(status_key, 'status', 'cancelled')
-        redis_client.hset(status_key, 'error', 'Task cancelled by user')
+        # 將狀態設置為 cancelled (與 Worker 的終態更新互斥，已結束的任務不會被改回取消)
+        previous = set_job_status(
+            redis_client, job_id, 'cancelled', {'error': 'Task cancelled by user'},
+            ttl=86400, unless=TERMINAL_STATUSES
+        )
+        if previous is None:
+            current_status = redis_client.hget(status_key, 'status') or 'unknown'
+            return jsonify({
+                'success': False,
+                'message': f'Cannot cancel job with status: {current_status}'
+            }), 400
         
-        logger.info(f"✓ 任務已標記為取消: job_id={job_id}")
+        # 尚未開始的任務：從佇列移除，不再交給 Worker
+        removed = 0
+        if previous in ('', 'queued'):
+            removed = scheduler.remove(redis_client, REDIS_QUEUE_NAME, job_id)
+        
+        logger.info(f"✓ 任務已標記為取消: job_id={job_id} (從佇列移除: {removed > 0})")
         
         return jsonify({
             'success': True,
-            'message': 'Task cancelled'
+            'message': 'Task cancelled',
+            'removed_from_queue': removed > 0
         }), 200
     
     except Exception as e:
@@ -1144,20 +1418,14 @@ def metrics():
             return jsonify({'error': 'Redis service unavailable'}), 503
         
         # 1. 獲取佇列長度
-        queue_length = redis_client.llen(REDIS_QUEUE_NAME)
+        queue_length = scheduler.pending_count(redis_client, REDIS_QUEUE_NAME)
         
         # 2. 檢查 Worker 心跳狀態
         worker_heartbeat = redis_client.get('worker:heartbeat')
         worker_status = 'online' if worker_heartbeat else 'offline'
         
-        # 3. 統計當前正在處理的任務（status='processing'）
-        active_jobs = 0
-        # 掃描所有 job:status:* 鍵
-        status_keys = redis_client.keys('job:status:*')
-        for key in status_keys:
-            job_status = redis_client.hget(key, 'status')
-            if job_status == 'processing':
-                active_jobs += 1
+        # 3. 當前正在處理的任務數（狀態索引，O(1)）
+        active_jobs = status_counts(redis_client, ['processing'])['processing']
         
         logger.info(f"📊 Metrics: queue={queue_length}, worker={worker_status}, active={active_jobs}")
         
@@ -1172,6 +1440,76 @@ def metrics():
         return jsonify({'error': 'Internal server error'}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def prometheus_metrics():
+    """
+    GET /metrics
+    Prometheus 文字格式指標 (任務、階段耗時、佇列長度、Redis / MySQL 延遲、限流次數)
+    所有數值皆為增量維護，抓取時不掃描 Redis key
+    """
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route('/api/timing/summary', methods=['GET'])
+@limiter.limit("2 per second")
+def timing_summary():
+    """
+    GET /api/timing/summary?workflow=text_to_image
+    各 workflow 的任務階段耗時統計 (由 Worker 累積的直方圖估算分位數)
+    
+    Response:
+    {
+        "text_to_image": {
+            "comfy_execution": {"count": 120, "mean": 8.2, "p50": 7.9, "p95": 14.1, "p99": 22.0, "buckets": {...}},
+            "queue_wait": {...},
+            ...
+        }
+    }
+    """
+    try:
+        if redis_client is None:
+            logger.error("Redis 客户端未初始化")
+            return jsonify({'error': 'Redis service unavailable'}), 503
+        
+        workflow = request.args.get('workflow') or None
+        return jsonify(get_timing_summary(redis_client, workflow)), 200
+    
+    except Exception as e:
+        logger.error(f"✗ timing summary 接口异常: {e}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@app.route('/api/timing/<job_id>', methods=['GET'])
+@limiter.limit("2 per second")
+def job_timing(job_id):
+    """
+    GET /api/timing/<job_id>
+    單一任務的各階段耗時 (秒)
+    
+    Response:
+    {
+        "job_id": "uuid",
+        "workflow": "text_to_image",
+        "status": "finished",
+        "stages": {"queue_wait": 0.8, "input_prep": 0.05, ..., "total": 12.4}
+    }
+    """
+    try:
+        if redis_client is None:
+            logger.error("Redis 客户端未初始化")
+            return jsonify({'error': 'Redis service unavailable'}), 503
+        
+        timing = get_job_timing(redis_client, job_id)
+        if timing is None:
+            return jsonify({'error': 'Timing not found'}), 404
+        return jsonify(timing), 200
+    
+    except Exception as e:
+        logger.error(f"✗ timing 接口异常: {e}", exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """健康检查接口 - 檢查 Redis 和 MySQL 狀態"""
@@ -1269,7 +1607,7 @@ def get_redis_stats() -> dict:
     
     try:
         # 隊列長度
-        stats['queue_length'] = redis_client.llen(REDIS_QUEUE_NAME) or 0
+        stats['queue_length'] = scheduler.pending_count(redis_client, REDIS_QUEUE_NAME)
         
         # Redis 記憶體使用情況
         info = redis_client.info('memory')
@@ -1306,23 +1644,13 @@ def get_task_stats() -> dict:
         return stats
     
     try:
-        # 掃描所有 job:status:* 鍵
-        all_keys = redis_client.keys('job:status:*')
-        stats['total_jobs'] = len(all_keys)
-        
-        # 按狀態統計
-        for key in all_keys:
-            status_info = redis_client.hgetall(key)
-            status = status_info.get('status', 'unknown')
-            
-            if status == 'queued':
-                stats['queued_jobs'] += 1
-            elif status == 'processing':
-                stats['processing_jobs'] += 1
-            elif status == 'finished':
-                stats['finished_jobs'] += 1
-            elif status == 'failed':
-                stats['failed_jobs'] += 1
+        # 按狀態統計 (狀態索引，每個狀態一次 ZCOUNT)
+        counts = status_counts(redis_client)
+        stats['total_jobs'] = sum(counts.values())
+        stats['queued_jobs'] = counts['queued']
+        stats['processing_jobs'] = counts['processing']
+        stats['finished_jobs'] = counts['finished']
+        stats['failed_jobs'] = counts['failed']
     except Exception as e:
         logger.warning(f"獲取任務統計資訊失敗: {e}")
     
@@ -38,6 +38,15 @@ FLASK_DEBUG = os.getenv("FLASK_DEBUG", "false").lower() == "true"
 FLASK_HOST = os.getenv("FLASK_HOST", "0.0.0.0")
 FLASK_PORT = int(os.getenv("FLASK_PORT", "5001"))
 
+# SSE 狀態串流：心跳間隔 (秒) 與單一連線最長時間 (秒，到期後由瀏覽器自動重連)
+SSE_HEARTBEAT_SECONDS = int(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_MAX_SECONDS = int(os.getenv("SSE_MAX_SECONDS", "600"))
+
+# IP → 用戶 ID 快取：存活秒數、最大筆數、last_active 批次寫回間隔 (秒)
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+USER_ACTIVITY_FLUSH_SECONDS = int(os.getenv("USER_ACTIVITY_FLUSH_SECONDS", "30"))
+
 # ComfyUI 模型路徑（模型掃描用）
 COMFYUI_CHECKPOINTS_DIR = COMFYUI_MODELS_DIR / "checkpoints"
 COMFYUI_UNET_DIR = COMFYUI_MODELS_DIR / "unet"
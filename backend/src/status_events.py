@@ -0,0 +1,100 @@
+"""
+Job Status Event Broker
+=======================
+Backend 內單一的 Redis Pub/Sub 連線 (PSUBSCRIBE job:events:*，見 shared.job_events)，
+把 Worker / Backend 透過 shared.job_status 發布的狀態變更分派給各個 SSE 串流：
+- 每個 SSE 連線只持有一個 queue.Queue，不各自開 Redis 連線
+- Pub/Sub 斷線重連後送出 RESYNC，串流端重新讀取狀態 Hash (期間的事件可能遺失)
+"""
+
+import json
+import queue
+import logging
+import threading
+
+from shared.job_events import JobEventSubscriber
+
+logger = logging.getLogger("backend")
+
+# 重連後通知訂閱者重新讀取完整狀態
+RESYNC = {"type": "resync"}
+
+
+class StatusBroker:
+    """
+    依 job_id 分派狀態事件
+
+    使用範例:
+        broker = StatusBroker(redis_client)
+        events = broker.subscribe(job_id)
+        try:
+            event = events.get(timeout=15)
+        finally:
+            broker.unsubscribe(job_id, events)
+    """
+
+    def __init__(self, redis_client, max_backoff: float = 30.0):
+        self.redis = redis_client
+        self._subscribers = {}   # job_id -> set(queue.Queue)
+        self._lock = threading.Lock()
+        self._subscriber = JobEventSubscriber(
+            redis_client, self._dispatch, lambda: self._broadcast(RESYNC),
+            name="status-broker", label="狀態事件", max_backoff=max_backoff, log=logger
+        )
+
+    # ==========================================
+    # 生命週期
+    # ==========================================
+
+    def start(self) -> None:
+        """啟動背景接收執行緒 (重複呼叫無作用)"""
+        self._subscriber.start()
+
+    def stop(self) -> None:
+        self._subscriber.stop()
+
+    # ==========================================
+    # 訂閱管理
+    # ==========================================
+
+    def subscribe(self, job_id: str) -> queue.Queue:
+        self.start()
+        events = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, job_id: str, events: queue.Queue) -> None:
+        with self._lock:
+            listeners = self._subscribers.get(job_id)
+            if listeners is None:
+                return
+            listeners.discard(events)
+            if not listeners:
+                del self._subscribers[job_id]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(listeners) for listeners in self._subscribers.values())
+
+    # ==========================================
+    # 內部：接收與分派
+    # ==========================================
+
+    def _dispatch(self, job_id: str, data: str) -> None:
+        with self._lock:
+            listeners = list(self._subscribers.get(job_id, ()))
+        if not listeners:
+            return
+        try:
+            event = json.loads(data or "{}")
+        except ValueError:
+            return
+        for events in listeners:
+            events.put(event)
+
+    def _broadcast(self, event: dict) -> None:
+        with self._lock:
+            listeners = [q for qs in self._subscribers.values() for q in qs]
+        for events in listeners:
+            events.put(event)
@@ -0,0 +1,122 @@
+"""
+IP → User ID Cache
+==================
+before_request 的 IP 對應用戶查詢快取：
+- 行程內 TTL + LRU 快取，命中時不存取 MySQL
+- last_active 改為寫回延遲 (write-behind)：記錄近期活動的 IP，
+  由背景執行緒每 flush_interval 秒以一條 UPDATE ... WHERE ip_address IN (...) 批次更新
+- 未命中才呼叫 get_or_create_user_id(touch=False)；新 IP 的 INSERT 本身即寫入 last_active
+
+last_active 最多延遲 flush_interval 秒，get_active_users_count 等統計可接受此誤差。
+"""
+
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("backend")
+
+
+class UserIdCache:
+    """
+    使用範例:
+        cache = UserIdCache(db_client, ttl=300, max_entries=10000, flush_interval=30)
+        cache.start()
+        user_id = cache.get(ip_address)
+    """
+
+    def __init__(self, db_client, ttl: float = 300, max_entries: int = 10000, flush_interval: float = 30):
+        self.db = db_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+
+        self._entries = OrderedDict()   # ip -> (user_id, expires_at)，最舊的在前
+        self._active = set()            # 待寫回 last_active 的 IP
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # 命中統計 (監控用)
+        self.hits = 0
+        self.misses = 0
+
+    # ==========================================
+    # 查詢
+    # ==========================================
+
+    def get(self, ip_address: str) -> int:
+        """
+        取得 IP 對應的用戶 ID (失敗返回 -1，不快取)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(ip_address)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(ip_address)
+                self._active.add(ip_address)
+                self.hits += 1
+                return entry[0]
+
+        # 未命中：在鎖外查詢資料庫
+        user_id = self.db.get_or_create_user_id(ip_address, touch=False)
+
+        with self._lock:
+            self.misses += 1
+            if user_id > 0:
+                self._entries[ip_address] = (user_id, now + self.ttl)
+                self._entries.move_to_end(ip_address)
+                self._active.add(ip_address)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return user_id
+
+    # ==========================================
+    # last_active 寫回
+    # ==========================================
+
+    def start(self) -> None:
+        """啟動背景寫回執行緒 (重複呼叫無作用)，並在行程結束時寫回剩餘資料"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="user-activity-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.flush()
+
+    def flush(self) -> int:
+        """寫回累積的 last_active，返回更新的 IP 數 (失敗時保留到下一輪)"""
+        with self._lock:
+            if not self._active:
+                return 0
+            pending, self._active = self._active, set()
+
+        if self.db.touch_users(sorted(pending)):
+            return len(pending)
+
+        with self._lock:
+            self._active |= pending
+        return 0
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                count = self.flush()
+                if count:
+                    logger.debug(f"✓ last_active 批次寫回: {count} 個 IP")
+            except Exception as e:
+                logger.warning(f"⚠️ last_active 寫回失敗: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "pending_touch": len(self._active),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
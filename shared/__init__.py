@@ -22,6 +22,7 @@ from .config_base import (
     STORAGE_DIR,
     STORAGE_INPUT_DIR,
     STORAGE_OUTPUT_DIR,
+    BLOB_STORE_DIR,
     WORKFLOW_DIR,
     WORKFLOW_CONFIG_PATH,
     JOB_STATUS_EXPIRE_SECONDS,
@@ -45,6 +46,7 @@ __all__ = [
     'STORAGE_DIR',
     'STORAGE_INPUT_DIR',
     'STORAGE_OUTPUT_DIR',
+    'BLOB_STORE_DIR',
     'WORKFLOW_DIR',
     'WORKFLOW_CONFIG_PATH',
     'JOB_STATUS_EXPIRE_SECONDS',
@@ -0,0 +1,157 @@
+"""
+Content-Addressed Blob Store
+============================
+本地磁碟上的內容定址 (SHA-256) 檔案儲存，供 Backend 與 Worker 共用。
+
+Backend 在提交任務時把上傳的圖片寫入 blob store，
+Redis 佇列訊息與 MySQL workflow_data 只保留引用：
+    {"blob": "<sha256>", "size": 12345}
+Worker 再依引用讀取原始位元組。相同內容只會儲存一次。
+"""
+
+import os
+import re
+import time
+import base64
+import hashlib
+import tempfile
+import logging
+from pathlib import Path
+
+from shared.config_base import BLOB_STORE_DIR
+
+logger = logging.getLogger(__name__)
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def blob_path(digest: str) -> Path:
+    """
+    取得 blob 的檔案路徑 (以前兩碼分桶，避免單一目錄檔案過多)
+
+    Raises:
+        ValueError: digest 不是合法的 SHA-256 十六進位字串
+    """
+    if not isinstance(digest, str) or not _SHA256_RE.match(digest):
+        raise ValueError(f"無效的 blob 雜湊: {digest!r}")
+    return BLOB_STORE_DIR / digest[:2] / digest
+
+
+def put_bytes(data: bytes) -> str:
+    """
+    寫入位元組並返回其 SHA-256 (內容已存在時只更新 mtime)
+
+    寫入採用「暫存檔 + os.replace」，讀取端不會看到寫到一半的檔案。
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(digest)
+
+    if path.exists():
+        # 刷新 mtime，避免仍在使用的 blob 被過期清理
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return digest
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return digest
+
+
+def put_base64(base64_data: str) -> dict:
+    """
+    解碼 base64 (可含 data:xxx;base64, 前綴) 並寫入 blob store
+
+    Returns:
+        blob 引用 {"blob": sha256, "size": bytes}
+
+    Raises:
+        ValueError: base64 解碼失敗
+    """
+    if "," in base64_data:
+        base64_data = base64_data.split(",", 1)[1]
+    try:
+        data = base64.b64decode(base64_data.strip(), validate=False)
+    except Exception as e:
+        raise ValueError(f"Base64 解碼失敗: {e}")
+    if not data:
+        raise ValueError("Base64 內容為空")
+
+    return {"blob": put_bytes(data), "size": len(data)}
+
+
+def is_blob_ref(value) -> bool:
+    """判斷值是否為 blob 引用"""
+    return isinstance(value, dict) and isinstance(value.get("blob"), str)
+
+
+def resolve_ref(ref) -> dict:
+    """
+    驗證外部傳入的 blob 引用並在伺服器端重建 (不信任傳入的 size 與其他欄位)
+
+    存在的 blob 會刷新 mtime，避免任務排隊期間被過期清理。
+
+    Returns:
+        blob 引用 {"blob": sha256, "size": 實際大小}
+
+    Raises:
+        ValueError: 不是合法的 blob 引用
+        FileNotFoundError: blob 不存在 (可能已過期清理)
+    """
+    if not is_blob_ref(ref):
+        raise ValueError("不是 blob 引用")
+    path = blob_path(ref["blob"])
+    try:
+        os.utime(path)
+        size = path.stat().st_size
+    except FileNotFoundError:
+        raise FileNotFoundError(f"找不到 blob: {ref['blob']}")
+    return {"blob": ref["blob"], "size": size}
+
+
+def read_bytes(ref) -> bytes:
+    """
+    依 blob 引用 (或純 SHA-256 字串) 讀取內容
+
+    Raises:
+        FileNotFoundError: blob 不存在 (可能已過期清理)
+    """
+    digest = ref["blob"] if is_blob_ref(ref) else ref
+    path = blob_path(digest)
+    if not path.exists():
+        raise FileNotFoundError(f"找不到 blob: {digest}")
+    return path.read_bytes()
+
+
+def cleanup_expired(max_age_hours: float) -> int:
+    """
+    刪除超過指定時間未被寫入或引用的 blob
+
+    Returns:
+        刪除的檔案數
+    """
+    if not BLOB_STORE_DIR.exists():
+        return 0
+
+    cutoff = time.time() - max_age_hours * 3600
+    deleted = 0
+    for path in BLOB_STORE_DIR.glob("*/*"):
+        try:
+            if path.is_file() and path.stat().st_mtime < cutoff:
+                path.unlink()
+                deleted += 1
+        except OSError as e:
+            logger.warning(f"⚠️ 無法刪除 blob {path}: {e}")
+    return deleted
@@ -37,9 +37,14 @@ STORAGE_DIR = PROJECT_ROOT / "storage"
 STORAGE_INPUT_DIR = STORAGE_DIR / "inputs"
 STORAGE_OUTPUT_DIR = STORAGE_DIR / "outputs"
 
+# 內容定址 blob store (上傳圖片等大型輸入，佇列與資料庫只存引用)
+BLOB_STORE_DIR = Path(os.getenv("BLOB_STORE_DIR", str(STORAGE_DIR / "blobs")))
+BLOB_MAX_AGE_HOURS = float(os.getenv("BLOB_MAX_AGE_HOURS", "48"))
+
 # 確保儲存目錄存在
 STORAGE_INPUT_DIR.mkdir(parents=True, exist_ok=True)
 STORAGE_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+BLOB_STORE_DIR.mkdir(parents=True, exist_ok=True)
 
 # ==========================================
 # Workflow 配置 (共用)
@@ -52,6 +57,19 @@ WORKFLOW_CONFIG_PATH = WORKFLOW_DIR / "config.json"
 # ==========================================
 JOB_STATUS_EXPIRE_SECONDS = int(os.getenv("JOB_STATUS_EXPIRE_SECONDS", "3600"))
 
+# 公平排程 (shared.scheduler)：每輪基本配額、優先級權重、各 workflow 類別的成本，
+# 以及視為互動式 (高優先級) 的類別
+SCHED_QUANTUM = int(os.getenv("SCHED_QUANTUM", "1"))
+SCHED_TIER_WEIGHTS = os.getenv("SCHED_TIER_WEIGHTS", "interactive:4,batch:1")
+SCHED_CATEGORY_COSTS = os.getenv("SCHED_CATEGORY_COSTS", "image:1,avatar:6,video:10")
+SCHED_INTERACTIVE_CATEGORIES = os.getenv("SCHED_INTERACTIVE_CATEGORIES", "image")
+# 成本單位 (秒)：預估執行時間每滿一單位扣一點配額
+SCHED_COST_UNIT_SECONDS = float(os.getenv("SCHED_COST_UNIT_SECONDS", "30"))
+
+# 執行時間統計 (shared.runtime_stats)：每種參數組合保留的樣本數與可用於預估的最少樣本數
+RUNTIME_SAMPLE_SIZE = int(os.getenv("RUNTIME_SAMPLE_SIZE", "100"))
+RUNTIME_MIN_SAMPLES = int(os.getenv("RUNTIME_MIN_SAMPLES", "3"))
+
 # ==========================================
 # ComfyUI 配置 (共用)
 # ==========================================
@@ -69,6 +87,7 @@ def print_base_config():
     print(f"  REDIS: {REDIS_HOST}:{REDIS_PORT}")
     print(f"  DB: {DB_HOST}:{DB_PORT}/{DB_NAME}")
     print(f"  STORAGE_DIR: {STORAGE_DIR}")
+    print(f"  BLOB_STORE_DIR: {BLOB_STORE_DIR}")
     print(f"  WORKFLOW_DIR: {WORKFLOW_DIR}")
     print("=" * 50)
 
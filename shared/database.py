@@ -24,6 +24,8 @@ from sqlalchemy.dialects.mysql import JSON
 # Flask-Login
 from flask_login import UserMixin
 
+from shared.metrics import MYSQL_QUERY_SECONDS, timed
+
 logger = logging.getLogger(__name__)
 
 # ===========================================
@@ -131,6 +133,7 @@ class Job(Base):
         batch_size: 批次大小
         seed: 隨機種子
         status: 任務狀態
+        priority: 排程優先級 (interactive/batch，見 shared.scheduler)
         input_audio_path: 輸入音訊檔名
         created_at: 建立時間
         updated_at: 更新時間
@@ -148,6 +151,7 @@ class Job(Base):
     batch_size = Column(Integer, default=1)
     seed = Column(Integer, default=-1)
     status = Column(String(20), default='queued')
+    priority = Column(String(16), default='batch')
     input_audio_path = Column(String(255), nullable=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
@@ -171,6 +175,7 @@ class Job(Base):
             "batch_size": self.batch_size,
             "seed": self.seed,
             "status": self.status,
+            "priority": self.priority,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
@@ -253,6 +258,7 @@ class Database:
             batch_size INT DEFAULT 1,
             seed INT DEFAULT -1,
             status VARCHAR(20),
+            priority VARCHAR(16) DEFAULT 'batch',
             input_audio_path VARCHAR(255) DEFAULT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
@@ -277,6 +283,11 @@ class Database:
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
         """
         
+        # 既有的 jobs 表補上後來新增的欄位
+        add_jobs_columns_sql = {
+            "priority": "ALTER TABLE jobs ADD COLUMN priority VARCHAR(16) DEFAULT 'batch' AFTER status",
+        }
+        
         try:
             conn = self.pool.get_connection()
             cursor = conn.cursor()
@@ -285,6 +296,16 @@ class Database:
             cursor.execute(create_users_table_sql)
             cursor.execute(create_jobs_table_sql)
             cursor.execute(create_user_mapping_table_sql)
+            
+            cursor.execute(
+                "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'jobs'"
+            )
+            existing_columns = {row[0] for row in cursor.fetchall()}
+            for column, alter_sql in add_jobs_columns_sql.items():
+                if column not in existing_columns:
+                    cursor.execute(alter_sql)
+                    logger.info(f"✓ jobs 表已新增欄位: {column}")
             conn.commit()
             logger.info("✓ Users, Jobs, user_mapping 表初始化成功")
         except Error as e:
@@ -294,6 +315,7 @@ class Database:
                 cursor.close()
                 conn.close()
     
+    @timed(MYSQL_QUERY_SECONDS, operation="insert_job")
     def insert_job(
         self,
         job_id: str,
@@ -306,7 +328,8 @@ class Database:
         status: str = "queued",
         input_audio_path: Optional[str] = None,
         user_id: Optional[int] = None,
-        workflow_data: Optional[dict] = None
+        workflow_data: Optional[dict] = None,
+        priority: str = "batch"
     ) -> bool:
         """
         插入新任務記錄
@@ -323,6 +346,7 @@ class Database:
             input_audio_path: 輸入音訊檔名
             user_id: 用戶 ID (Member System)
             workflow_data: 完整工作流參數 (JSON)
+            priority: 排程優先級 (interactive/batch)
         
         Returns:
             是否成功
@@ -330,8 +354,8 @@ class Database:
         import json
         
         sql = """
-        INSERT INTO jobs (id, user_id, prompt, workflow_name, workflow_data, model, aspect_ratio, batch_size, seed, status, input_audio_path)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        INSERT INTO jobs (id, user_id, prompt, workflow_name, workflow_data, model, aspect_ratio, batch_size, seed, status, priority, input_audio_path)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
         
         workflow_json = json.dumps(workflow_data) if workflow_data else None
@@ -339,7 +363,7 @@ class Database:
         try:
             conn = self.pool.get_connection()
             cursor = conn.cursor()
-            cursor.execute(sql, (job_id, user_id, prompt, workflow, workflow_json, model, aspect_ratio, batch_size, seed, status, input_audio_path))
+            cursor.execute(sql, (job_id, user_id, prompt, workflow, workflow_json, model, aspect_ratio, batch_size, seed, status, priority, input_audio_path))
             conn.commit()
             logger.info(f"✓ 任務記錄插入成功: {job_id}" + (f" (User: {user_id})" if user_id else ""))
             return True
@@ -351,6 +375,7 @@ class Database:
                 cursor.close()
                 conn.close()
     
+    @timed(MYSQL_QUERY_SECONDS, operation="update_job_status")
     def update_job_status(
         self,
         job_id: str,
@@ -386,6 +411,43 @@ class Database:
                 cursor.close()
                 conn.close()
     
+    @timed(MYSQL_QUERY_SECONDS, operation="update_job_statuses")
+    def update_job_statuses(self, statuses: Dict[str, str]) -> bool:
+        """
+        批次更新多個任務狀態 (單一連線、單一交易)
+        
+        Args:
+            statuses: {job_id: status}
+        
+        Returns:
+            是否成功 (失敗時整批回滾)
+        """
+        if not statuses:
+            return True
+        sql = "UPDATE jobs SET status = %s WHERE id = %s"
+        params = [(status, job_id) for job_id, status in statuses.items()]
+        
+        conn = None
+        try:
+            conn = self.pool.get_connection()
+            cursor = conn.cursor()
+            cursor.executemany(sql, params)
+            conn.commit()
+            return True
+        except Error as e:
+            logger.error(f"✗ 批次更新任務狀態失敗: {e}")
+            try:
+                if conn is not None:
+                    conn.rollback()
+            except Error:
+                pass
+            return False
+        finally:
+            if conn is not None and conn.is_connected():
+                cursor.close()
+                conn.close()
+    
+    @timed(MYSQL_QUERY_SECONDS, operation="get_history")
     def get_history(
         self,
         limit: int = 50,
@@ -459,6 +521,7 @@ class Database:
             if conn and conn.is_connected():
                 conn.close()
     
+    @timed(MYSQL_QUERY_SECONDS, operation="soft_delete_job")
     def soft_delete_job(self, job_id: str) -> bool:
         """
         軟刪除任務 (設置 deleted_at)
@@ -486,12 +549,14 @@ class Database:
                 cursor.close()
                 conn.close()
     
-    def get_or_create_user_id(self, ip_address: str) -> int:
+    @timed(MYSQL_QUERY_SECONDS, operation="get_or_create_user_id")
+    def get_or_create_user_id(self, ip_address: str, touch: bool = True) -> int:
         """
         根據 IP 地址獲取或建立用戶 ID
         
         Args:
             ip_address: 用戶的 IP 地址
+            touch: 是否同時更新 last_active (批次寫回時傳 False，改由 touch_users 更新)
         
         Returns:
             用戶 ID (INT)
@@ -505,9 +570,10 @@ class Database:
             result = cursor.fetchone()
             
             if result:
-                update_sql = "UPDATE user_mapping SET last_active = CURRENT_TIMESTAMP WHERE ip_address = %s"
-                cursor.execute(update_sql, (ip_address,))
-                conn.commit()
+                if touch:
+                    update_sql = "UPDATE user_mapping SET last_active = CURRENT_TIMESTAMP WHERE ip_address = %s"
+                    cursor.execute(update_sql, (ip_address,))
+                    conn.commit()
                 return result['id']
             else:
                 insert_sql = "INSERT INTO user_mapping (ip_address) VALUES (%s)"
@@ -524,6 +590,43 @@ class Database:
                 cursor.close()
                 conn.close()
     
+    @timed(MYSQL_QUERY_SECONDS, operation="touch_users")
+    def touch_users(self, ip_addresses: List[str], chunk_size: int = 500) -> bool:
+        """
+        批次更新多個 IP 的 last_active (每批一條 UPDATE ... WHERE ip_address IN (...))
+        
+        Args:
+            ip_addresses: 近期有活動的 IP 列表
+            chunk_size: 每條 SQL 最多的 IP 數
+        
+        Returns:
+            是否成功
+        """
+        if not ip_addresses:
+            return True
+        conn = None
+        try:
+            conn = self.pool.get_connection()
+            cursor = conn.cursor()
+            for start in range(0, len(ip_addresses), chunk_size):
+                chunk = ip_addresses[start:start + chunk_size]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                update_sql = (
+                    "UPDATE user_mapping SET last_active = CURRENT_TIMESTAMP "
+                    f"WHERE ip_address IN ({placeholders})"
+                )
+                cursor.execute(update_sql, tuple(chunk))
+            conn.commit()
+            return True
+        except Error as e:
+            logger.error(f"✗ 批次更新 last_active 失敗: {e}")
+            return False
+        finally:
+            if conn is not None and conn.is_connected():
+                cursor.close()
+                conn.close()
+    
+    @timed(MYSQL_QUERY_SECONDS, operation="get_active_users_count")
     def get_active_users_count(self) -> int:
         """獲取過去 24 小時內活躍的用戶數"""
         try:
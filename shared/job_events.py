@@ -0,0 +1,120 @@
+"""
+Job Event Subscriber
+====================
+訂閱 shared.job_status 發布的狀態變更事件 (PSUBSCRIBE job:events:*) 的共用背景連線：
+- 一個行程只需一條 Pub/Sub 連線，依 job_id 分派由呼叫端決定 (on_event)
+- 斷線時以指數退避重連；重連成功後呼叫 on_resync (斷線期間的事件可能遺失，呼叫端重新讀取狀態)
+
+使用者：
+- backend/src/status_events.StatusBroker：分派給各個 SSE 串流
+- worker/src/cancel_watcher.CancelWatcher：接收取消訊號
+"""
+
+import logging
+import threading
+from typing import Callable, Optional
+
+from shared.job_status import EVENTS_PATTERN
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = EVENTS_PATTERN.rstrip("*")
+
+
+class JobEventSubscriber:
+    """
+    使用範例:
+        subscriber = JobEventSubscriber(
+            redis_client,
+            on_event=lambda job_id, data: ...,   # data 為事件原始 JSON 字串
+            on_resync=lambda: ...,
+            name="status-broker",
+            label="狀態事件",
+        )
+        subscriber.start()
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        on_event: Callable[[str, str], None],
+        on_resync: Optional[Callable[[], None]] = None,
+        name: str = "job-events",
+        label: str = "任務事件",
+        max_backoff: float = 30.0,
+        log: logging.Logger = None
+    ):
+        """
+        Args:
+            redis_client: Redis 客戶端 (decode_responses=True)
+            on_event: 收到事件時呼叫 on_event(job_id, data)
+            on_resync: 斷線重連成功後呼叫 (首次連線不呼叫)
+            name: 背景執行緒名稱
+            label: 日誌中的訂閱名稱
+            max_backoff: 重連退避上限 (秒)
+            log: 日誌使用的 logger (預設為本模組 logger)
+        """
+        self.redis = redis_client
+        self.on_event = on_event
+        self.on_resync = on_resync
+        self.name = name
+        self.label = label
+        self.max_backoff = max_backoff
+        self.log = log or logger
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    # ==========================================
+    # 生命週期
+    # ==========================================
+
+    def start(self) -> None:
+        """啟動背景接收執行緒 (重複呼叫無作用)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # ==========================================
+    # 內部：接收與重連
+    # ==========================================
+
+    def _run(self) -> None:
+        backoff = 1.0
+        first_connect = True
+
+        while not self._stop.is_set():
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(EVENTS_PATTERN)
+                if first_connect:
+                    self.log.info(f"✓ {self.label}訂閱已啟動 ({EVENTS_PATTERN})")
+                    first_connect = False
+                else:
+                    self.log.info(f"✓ {self.label}訂閱已重新連接")
+                    if self.on_resync:
+                        self.on_resync()
+                backoff = 1.0
+
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get("type") == "pmessage":
+                        job_id = message.get("channel", "")[len(CHANNEL_PREFIX):]
+                        self.on_event(job_id, message.get("data"))
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                self.log.warning(f"⚠️ {self.label}訂閱中斷，{backoff:.0f}s 後重試: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
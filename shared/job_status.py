@@ -0,0 +1,150 @@
+"""
+Job Status Index
+================
+任務狀態的單一寫入入口，並維護每個狀態的索引：
+    job:status:<job_id>        任務狀態 Hash (前端輪詢讀取，與原本相同)
+    jobs:by_status:<status>    該狀態的任務集合 (Sorted Set，score = 狀態 Hash 的到期時間)
+    job:events:<job_id>        狀態變更事件 (Pub/Sub，內容為本次變更的欄位，供 SSE 推播)
+
+狀態變更以 Lua 腳本原子完成：更新 Hash、重設 TTL、從舊狀態集合移除、加入新狀態集合，
+並順便清除新狀態集合中已到期的成員，最後發布變更事件。統計只需每個狀態一次 ZCOUNT，
+不再使用 KEYS job:status:* 與逐筆 HGET，成本與累積任務數無關。
+
+注意：Lua 腳本會存取由狀態名稱組成的集合 key，僅適用單一 Redis 節點 (非 Cluster)。
+"""
+
+import json
+import time
+from typing import Iterable, Optional
+
+from shared.config_base import JOB_STATUS_EXPIRE_SECONDS
+
+STATUS_KEY = "job:status:{job_id}"
+STATUS_INDEX_PREFIX = "jobs:by_status:"
+EVENTS_CHANNEL = "job:events:{job_id}"
+EVENTS_PATTERN = "job:events:*"
+
+STATUSES = ("queued", "processing", "finished", "failed", "cancelled")
+TERMINAL_STATUSES = ("finished", "failed", "cancelled")
+
+# KEYS[1] = 狀態 Hash
+# ARGV[1] = job_id, ARGV[2] = 新狀態, ARGV[3] = TTL (秒), ARGV[4] = 現在時間 (epoch 秒)
+# ARGV[5] = 索引前綴, ARGV[6] = 不允許轉換的舊狀態 (逗號分隔，可為空)
+# ARGV[7] = 事件內容 (JSON), ARGV[8..] = 其他欄位 field, value, ...
+# 返回 {舊狀態 (不存在為空字串), 是否已套用 (1/0)}
+_SET_STATUS_LUA = """
+local old = redis.call('HGET', KEYS[1], 'status') or ''
+if ARGV[6] ~= '' and old ~= '' then
+    for blocked in string.gmatch(ARGV[6], '[^,]+') do
+        if blocked == old then
+            return {old, 0}
+        end
+    end
+end
+
+local ttl = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local expires_at = now + ttl
+
+redis.call('HSET', KEYS[1], 'status', ARGV[2], unpack(ARGV, 8))
+redis.call('EXPIRE', KEYS[1], ttl)
+
+if old ~= '' and old ~= ARGV[2] then
+    redis.call('ZREM', ARGV[5] .. old, ARGV[1])
+end
+local index = ARGV[5] .. ARGV[2]
+redis.call('ZADD', index, expires_at, ARGV[1])
+redis.call('ZREMRANGEBYSCORE', index, '-inf', now)
+redis.call('PUBLISH', 'job:events:' .. ARGV[1], ARGV[7])
+return {old, 1}
+"""
+
+# KEYS[1] = 任務佇列 (List，元素為任務 JSON)
+# ARGV[1] = job_id
+# 返回移除的元素數 (已被 Worker 取走則為 0)
+_REMOVE_QUEUED_LUA = """
+local removed = 0
+for _, raw in ipairs(redis.call('LRANGE', KEYS[1], 0, -1)) do
+    local ok, job = pcall(cjson.decode, raw)
+    if ok and type(job) == 'table' and job['job_id'] == ARGV[1] then
+        removed = removed + redis.call('LREM', KEYS[1], 1, raw)
+    end
+end
+return removed
+"""
+
+_scripts = {}  # (id(redis client), 腳本) -> Script
+
+
+def _script(r, source: str = _SET_STATUS_LUA):
+    script = _scripts.get((id(r), source))
+    if script is None:
+        script = r.register_script(source)
+        _scripts[(id(r), source)] = script
+    return script
+
+
+def set_job_status(
+    r,
+    job_id: str,
+    status: str,
+    fields: dict = None,
+    ttl: int = JOB_STATUS_EXPIRE_SECONDS,
+    unless: Iterable[str] = ()
+) -> Optional[str]:
+    """
+    原子地更新任務狀態與狀態索引
+
+    Args:
+        r: Redis 客戶端
+        job_id: 任務 ID
+        status: 新狀態
+        fields: 其他要寫入狀態 Hash 的欄位 (progress / image_url / error ...)
+        ttl: 狀態 Hash 的存活秒數
+        unless: 目前狀態屬於其中之一時不做任何變更 (例如取消時排除終態)
+
+    Returns:
+        變更前的狀態 (原本不存在為 "")；因 unless 被拒絕時返回 None
+    """
+    changes = {
+        key: value for key, value in (fields or {}).items()
+        if key != "status" and value is not None
+    }
+    event = json.dumps({"job_id": job_id, "status": status, **changes}, ensure_ascii=False)
+
+    args = [job_id, status, int(ttl), time.time(), STATUS_INDEX_PREFIX, ",".join(unless), event]
+    for key, value in changes.items():
+        args.extend((key, value))
+
+    old, applied = _script(r)(keys=[STATUS_KEY.format(job_id=job_id)], args=args)
+    return old if int(applied) else None
+
+
+def remove_queued_job(r, queue_name: str, job_id: str) -> int:
+    """
+    從任務佇列移除尚未被 Worker 取走的任務 (Lua 原子掃描並 LREM)
+
+    Returns:
+        移除的數量 (0 表示已被取走或不存在)
+    """
+    return int(_script(r, _REMOVE_QUEUED_LUA)(keys=[queue_name], args=[job_id]))
+
+
+def status_counts(r, statuses: Iterable[str] = STATUSES) -> dict:
+    """
+    各狀態目前 (尚未過期) 的任務數
+
+    Returns:
+        {status: count}
+    """
+    statuses = list(statuses)
+    now = time.time()
+    pipe = r.pipeline(transaction=False)
+    for status in statuses:
+        pipe.zcount(STATUS_INDEX_PREFIX + status, now, "+inf")
+    return dict(zip(statuses, (int(count) for count in pipe.execute())))
+
+
+def jobs_with_status(r, status: str, limit: int = 100) -> list:
+    """取得指定狀態中最近更新的任務 ID (依到期時間由新到舊)"""
+    return r.zrevrangebyscore(STATUS_INDEX_PREFIX + status, "+inf", time.time(), start=0, num=limit)
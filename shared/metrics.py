@@ -0,0 +1,426 @@
+"""
+Prometheus Metrics
+==================
+輕量的 Prometheus 文字格式 (text exposition format 0.0.4) 指標模組，
+Backend 與 Worker 共用，不需額外依賴：
+- Counter / Gauge / Histogram，支援 labels
+- Gauge 只做增量維護 (inc / dec / set)，或以 set_function 在抓取時呼叫 O(1) 的函式
+  (例如 LLEN)，抓取時不掃描任何 key
+- render() 輸出文字格式；Backend 由 /metrics 路由回傳，Worker 以 start_http_server() 提供
+
+各行程只會填入自己用到的指標；有 label 的指標在第一次使用前不會輸出樣本。
+"""
+
+import time
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 預設直方圖桶 (秒)：Redis / MySQL 呼叫延遲
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 任務階段耗時桶 (秒)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# ==========================================
+# 指標類型
+# ==========================================
+
+class _Metric:
+    """指標家族：依 label 值保存子指標 (執行緒安全)"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self.labels()  # 無 label 指標一開始就輸出 0
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values, **kwargs):
+        """取得 label 值對應的子指標"""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name}: labels 數量不符 (需要 {self.labelnames})")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        """無 label 指標直接操作的子指標"""
+        if self.labelnames:
+            raise ValueError(f"{self.name}: 需要先呼叫 labels({', '.join(self.labelnames)})")
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in sorted(children):
+            lines.extend(self._samples(key, child))
+        return lines
+
+    def _samples(self, key: tuple, child) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.get())}"]
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        if amount < 0:
+            raise ValueError("Counter 只能增加")
+        with self._lock:
+            self._value += amount
+
+    def get(self) -> float:
+        return self._value
+
+
+class Counter(_Metric):
+    """單調遞增計數器 (名稱慣例以 _total 結尾)"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._value = 0.0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = float(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """抓取時呼叫 function 取得數值 (必須是 O(1) 操作)"""
+        self._function = function
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def get(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception as e:
+                logger.debug(f"Gauge 取值失敗: {e}")
+                return float("nan")
+        return self._value
+
+
+class Gauge(_Metric):
+    """可增可減的數值"""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._default().dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._default().set_function(function)
+
+    def track_inprogress(self):
+        return self._default().track_inprogress()
+
+    def _samples(self, key: tuple, child) -> list:
+        value = child.get()
+        if value != value:  # NaN：取值失敗時不輸出樣本
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)   # 最後一格為 +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = len(self.buckets)
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                index = i
+                break
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """計時 with 區塊並記錄 (例外時仍會記錄)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram(_Metric):
+    """累積直方圖 (_bucket / _sum / _count)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _samples(self, key: tuple, child) -> list:
+        counts, total = child.snapshot()
+        lines = []
+        cumulative = 0
+        for upper, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = f'le="{_format_value(upper)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def timed(histogram: Histogram, **labels):
+    """
+    函式裝飾器：以 histogram 記錄呼叫耗時
+
+    使用範例:
+        @timed(MYSQL_QUERY_SECONDS, operation="insert_job")
+        def insert_job(...): ...
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            child = histogram.labels(**labels) if labels else histogram._default()
+            with child.time():
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ==========================================
+# Registry / 輸出
+# ==========================================
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指標名稱重複: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def render(registry: Registry = None) -> str:
+    """輸出 Prometheus 文字格式"""
+    return (registry or REGISTRY).render()
+
+
+def start_http_server(port: int, host: str = "0.0.0.0", registry: Registry = None) -> ThreadingHTTPServer:
+    """
+    在背景執行緒提供 GET /metrics (Worker 沒有 Web 框架時使用)
+
+    Returns:
+        HTTP server 實例 (daemon 執行緒，隨行程結束)
+    """
+    registry = registry or REGISTRY
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # 抓取頻繁，不寫入存取日誌
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    return server
+
+
+# ==========================================
+# Redis 儀表化
+# ==========================================
+
+def instrument_redis(client):
+    """
+    為 Redis 客戶端的每個指令 (與 pipeline.execute) 記錄延遲
+
+    以實例屬性覆寫 execute_command / pipeline，不影響其他 Redis 實例。
+    """
+    execute_command = client.execute_command
+    create_pipeline = client.pipeline
+
+    def timed_execute_command(*args, **options):
+        command = str(args[0]).upper() if args else "UNKNOWN"
+        with REDIS_COMMAND_SECONDS.labels(command=command).time():
+            return execute_command(*args, **options)
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = create_pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def timed_execute(*e_args, **e_kwargs):
+            with REDIS_COMMAND_SECONDS.labels(command="PIPELINE").time():
+                return execute(*e_args, **e_kwargs)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+    return client
+
+
+# ==========================================
+# 指標定義 (Backend / Worker 共用名稱)
+# ==========================================
+
+# 任務
+JOBS_SUBMITTED = Counter(
+    "studio_jobs_submitted_total", "Jobs accepted by the backend", ["workflow"])
+JOBS_COMPLETED = Counter(
+    "studio_jobs_completed_total", "Jobs finished by workers", ["workflow", "status"])
+JOB_STAGE_SECONDS = Histogram(
+    "studio_job_stage_seconds", "Job lifecycle stage duration", ["workflow", "stage"],
+    buckets=STAGE_BUCKETS)
+QUEUE_DEPTH = Gauge(
+    "studio_queue_depth", "Jobs waiting in the Redis queue")
+WORKER_INFLIGHT = Gauge(
+    "studio_worker_inflight_jobs", "Jobs currently executing on this worker")
+
+# 外部依賴
+REDIS_COMMAND_SECONDS = Histogram(
+    "studio_redis_command_seconds", "Redis command latency", ["command"])
+MYSQL_QUERY_SECONDS = Histogram(
+    "studio_mysql_query_seconds", "MySQL call latency", ["operation"])
+DB_WRITE_PENDING = Gauge(
+    "studio_db_write_pending", "Job status updates waiting for the MySQL writer")
+DB_WRITES_DROPPED = Counter(
+    "studio_db_writes_dropped_total", "Job status updates dropped because the writer was full")
+COMFY_WS_RECONNECTS = Counter(
+    "studio_comfy_ws_reconnects_total", "ComfyUI WebSocket reconnects")
+ENGINE_ROUTES = Counter(
+    "studio_engine_routes_total", "Jobs routed to a ComfyUI engine by model residency", ["engine", "affinity"])
+BYTES_COPIED = Counter(
+    "studio_bytes_copied_total", "Bytes moved between ComfyUI and storage", ["method"])
+
+# 結果快取 (固定 seed 任務)
+RESULT_CACHE_LOOKUPS = Counter(
+    "studio_result_cache_lookups_total", "Result cache lookups for fixed-seed jobs", ["result"])
+RESULT_CACHE_ENTRIES = Gauge(
+    "studio_result_cache_entries", "Entries in the result cache")
+
+# HTTP
+RATE_LIMITED = Counter(
+    "studio_rate_limited_total", "Requests rejected by the rate limiter", ["endpoint"])
@@ -0,0 +1,99 @@
+"""
+Workflow Runtime Statistics
+===========================
+由已完成任務學習每種 workflow / 參數組合的 ComfyUI 執行時間分佈：
+    runtime:samples:<workflow>|<aspect_ratio>|b<batch_size>|s<shots>   最近 N 次執行秒數 (List)
+    runtime:samples:<workflow>                                        同 workflow 不分參數 (樣本不足時的後備)
+    runtime:samples:<workflow>|...|s<shots>|mb<N>                     N 個任務合併為一個微批次 prompt 的總耗時
+                                                                      (與單獨執行的樣本分開，供 Worker 的批次逾時使用)
+
+用途：
+- shared.scheduler：估計成本 (DRR 扣除的配額) 與同一子佇列內的短任務優先 (SJF)
+- Worker：依 p95 決定每個任務的執行逾時，取代單一 WORKER_TIMEOUT
+- Backend /api/status：排隊位置與預估完成時間 (ETA)
+"""
+
+import math
+from typing import Optional
+
+from shared.config_base import RUNTIME_SAMPLE_SIZE, RUNTIME_MIN_SAMPLES
+
+SAMPLES_PREFIX = "runtime:samples:"
+
+
+def signature(job_data: dict, micro_batch: int = 1) -> str:
+    """任務參數組合 (workflow | 比例 | 批次 | 分鏡數 [| 微批次任務數])"""
+    prompts = job_data.get("prompts") or []
+    shots = len(prompts) if isinstance(prompts, list) and prompts else 1
+    parts = [
+        str(job_data.get("workflow", "text_to_image")),
+        str(job_data.get("aspect_ratio", "1:1")),
+        f"b{job_data.get('batch_size', 1)}",
+        f"s{shots}",
+    ]
+    if micro_batch > 1:
+        parts.append(f"mb{micro_batch}")
+    return "|".join(parts)
+
+
+def record(r, job_data: dict, seconds: float, micro_batch: int = 1) -> None:
+    """
+    記錄一次成功執行的耗時 (參數組合與 workflow 各一份)
+
+    micro_batch > 1 時為微批次 prompt 的總耗時，只記在 <參數組合>|mb<N>：
+    分攤後的時間遠低於單獨執行，混入會壓低單獨任務的 p95 逾時。
+    """
+    keys = [SAMPLES_PREFIX + signature(job_data, micro_batch)]
+    if micro_batch <= 1:
+        keys.append(SAMPLES_PREFIX + str(job_data.get("workflow", "text_to_image")))
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.lpush(key, round(seconds, 3))
+        pipe.ltrim(key, 0, RUNTIME_SAMPLE_SIZE - 1)
+    pipe.execute()
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def estimate(r, job_data: dict, micro_batch: int = 1) -> Optional[dict]:
+    """
+    預估任務執行時間
+
+    micro_batch > 1 時預估 N 個任務合併執行的批次總時間 (只使用 <參數組合>|mb<N> 的樣本)。
+
+    Returns:
+        {"mean", "p50", "p95", "samples", "key"}；參數組合與 workflow 的樣本都不足時返回 None
+    """
+    keys = [signature(job_data, micro_batch)]
+    if micro_batch <= 1:
+        keys.append(str(job_data.get("workflow", "text_to_image")))
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.lrange(SAMPLES_PREFIX + key, 0, -1)
+
+    for key, raw in zip(keys, pipe.execute()):
+        if len(raw) < RUNTIME_MIN_SAMPLES:
+            continue
+        values = sorted(float(v) for v in raw)
+        return {
+            "mean": round(sum(values) / len(values), 3),
+            "p50": _percentile(values, 0.50),
+            "p95": _percentile(values, 0.95),
+            "samples": len(values),
+            "key": key,
+        }
+    return None
+
+
+def adaptive_timeout(stats: Optional[dict], default: float, factor: float, minimum: float) -> float:
+    """
+    每個任務的執行逾時：p95 × factor，介於 [minimum, default] 之間
+
+    沒有統計資料時使用 default (WORKER_TIMEOUT)。
+    """
+    if not stats:
+        return default
+    return min(default, max(minimum, stats["p95"] * factor))
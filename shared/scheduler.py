@@ -0,0 +1,337 @@
+"""
+Fair-Share Job Scheduler
+========================
+Backend 與 Worker 之間的排程層，取代單一 FIFO 佇列 (JOB_QUEUE 的 rpush / BLMOVE)：
+
+    sched:q:<tier>:<owner>     每個流 (使用者 × 優先級) 各自的子佇列 (Sorted Set，元素為任務 JSON，
+                               score = 進入時間 + 預估執行秒數)
+    sched:flows                有待處理任務的流 (List，輪詢順序)
+    sched:active               sched:flows 的成員集合 (避免重複加入)
+    sched:deficit / quantum    每個流的 DRR 赤字與每輪配額 (Hash)
+    sched:work                 每個流等待中任務的預估總秒數 (Hash，ETA 用)
+    sched:jobs                 job_id -> 流 (Hash，取消時定位子佇列，HLEN 即等待中任務數)
+    sched:wakeup               新任務通知 (List，Worker 以 BLPOP 等待，取代輪詢)
+
+取出採 Deficit Round Robin：輪到的流先累積 quantum (= SCHED_QUANTUM × 優先級權重)，
+赤字足以支付佇列頭任務的成本時才取出。成本 = 預估執行秒數 / SCHED_COST_UNIT_SECONDS
+(shared.runtime_stats 由已完成任務學習；樣本不足時依 workflow 類別：圖片 1、影片 10 ...)。
+大量送出影片任務的使用者只佔用自己流的配額，互動式文生圖不會被整批長任務餓死。
+
+同一子佇列內為短任務優先 (SJF)：score 以進入時間加上預估秒數，
+等待夠久的長任務分數終究會低於新進的短任務，不會無限期被插隊。
+
+JOB_QUEUE 仍保留：Worker 崩潰回收 / 重啟恢復的任務放回 JOB_QUEUE 前端，
+取出時優先處理 (也相容舊版 Backend 直接 rpush 的任務)。
+
+注意：Lua 腳本存取由流名稱組成的 key，僅適用單一 Redis 節點 (非 Cluster)。
+"""
+
+import json
+import math
+import time
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from shared.config_base import (
+    WORKFLOW_CONFIG_PATH,
+    SCHED_QUANTUM,
+    SCHED_TIER_WEIGHTS,
+    SCHED_CATEGORY_COSTS,
+    SCHED_INTERACTIVE_CATEGORIES,
+    SCHED_COST_UNIT_SECONDS,
+)
+from shared.job_status import remove_queued_job, _script
+from shared import runtime_stats
+
+FLOW_QUEUE_PREFIX = "sched:q:"
+FLOWS_KEY = "sched:flows"
+ACTIVE_KEY = "sched:active"
+DEFICIT_KEY = "sched:deficit"
+QUANTUM_KEY = "sched:quantum"
+WORK_KEY = "sched:work"
+JOBS_KEY = "sched:jobs"
+WAKEUP_KEY = "sched:wakeup"
+# 已註冊 Worker 的集合 (由 Worker 的可靠佇列維護；ETA 以此估計並行度)
+WORKER_REGISTRY_KEY = "worker:registry"
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+
+# 單次取出最多檢查的流次數 (成本遠大於配額時需要多輪累積赤字)
+_MAX_ROUNDS = 1000
+
+# KEYS[1] = 流子佇列, KEYS[2..7] = flows, active, quantum, jobs, wakeup, work
+# ARGV[1] = 流名稱, ARGV[2] = 任務 JSON, ARGV[3] = job_id, ARGV[4] = 配額, ARGV[5] = score, ARGV[6] = 預估秒數
+_ENQUEUE_LUA = """
+redis.call('ZADD', KEYS[1], ARGV[5], ARGV[2])
+redis.call('HINCRBYFLOAT', KEYS[7], ARGV[1], ARGV[6])
+redis.call('HSET', KEYS[5], ARGV[3], ARGV[1])
+redis.call('HSET', KEYS[4], ARGV[1], ARGV[4])
+if redis.call('SADD', KEYS[3], ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+end
+redis.call('RPUSH', KEYS[6], '1')
+return redis.call('ZCARD', KEYS[1])
+"""
+
+# KEYS[1] = JOB_QUEUE, KEYS[2] = processing 清單, KEYS[3..9] = flows, active, deficit, quantum, jobs, wakeup, work
+# ARGV[1] = 子佇列前綴, ARGV[2] = 最多檢查次數
+# 返回取出的任務 JSON (已搬到 processing 清單)；沒有任務時返回 false
+_RESERVE_LUA = """
+local job = redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+if job then
+    return job
+end
+
+local function retire(flow)
+    redis.call('LPOP', KEYS[3])
+    redis.call('SREM', KEYS[4], flow)
+    redis.call('HDEL', KEYS[5], flow)
+    redis.call('HDEL', KEYS[6], flow)
+    redis.call('HDEL', KEYS[9], flow)
+end
+
+for _ = 1, tonumber(ARGV[2]) do
+    local flow = redis.call('LINDEX', KEYS[3], 0)
+    if not flow then
+        -- 沒有任何待處理任務：殘留的通知已無意義
+        redis.call('DEL', KEYS[8])
+        return false
+    end
+
+    local queue = ARGV[1] .. flow
+    local head = redis.call('ZRANGE', queue, 0, 0)[1]
+    if not head then
+        retire(flow)
+    else
+        local cost = 1
+        local ok, decoded = pcall(cjson.decode, head)
+        if ok and type(decoded) == 'table' and tonumber(decoded['sched_cost']) then
+            cost = tonumber(decoded['sched_cost'])
+        end
+
+        local deficit = tonumber(redis.call('HGET', KEYS[5], flow) or '0')
+        if deficit >= cost then
+            redis.call('ZREM', queue, head)
+            redis.call('RPUSH', KEYS[2], head)
+            if ok and type(decoded) == 'table' then
+                if decoded['job_id'] then
+                    redis.call('HDEL', KEYS[7], decoded['job_id'])
+                end
+                if tonumber(decoded['expected_seconds']) then
+                    redis.call('HINCRBYFLOAT', KEYS[9], flow, -tonumber(decoded['expected_seconds']))
+                end
+            end
+            if redis.call('ZCARD', queue) == 0 then
+                -- DRR：流清空時赤字歸零，不累積到下次
+                retire(flow)
+            else
+                redis.call('HSET', KEYS[5], flow, deficit - cost)
+            end
+            return head
+        end
+
+        local quantum = tonumber(redis.call('HGET', KEYS[6], flow) or '1')
+        redis.call('HSET', KEYS[5], flow, deficit + quantum)
+        redis.call('LMOVE', KEYS[3], KEYS[3], 'LEFT', 'RIGHT')
+    end
+end
+return false
+"""
+
+# KEYS[1] = jobs, KEYS[2] = work
+# ARGV[1] = job_id, ARGV[2] = 子佇列前綴
+# 返回移除的數量 (子佇列的清理留給下次取出時處理)
+_REMOVE_LUA = """
+local flow = redis.call('HGET', KEYS[1], ARGV[1])
+if not flow then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+local queue = ARGV[2] .. flow
+local removed = 0
+for _, raw in ipairs(redis.call('ZRANGE', queue, 0, -1)) do
+    local ok, job = pcall(cjson.decode, raw)
+    if ok and type(job) == 'table' and job['job_id'] == ARGV[1] then
+        removed = removed + redis.call('ZREM', queue, raw)
+        if tonumber(job['expected_seconds']) then
+            redis.call('HINCRBYFLOAT', KEYS[2], flow, -tonumber(job['expected_seconds']))
+        end
+    end
+end
+return removed
+"""
+
+
+def _parse_weights(spec: str) -> dict:
+    """'a:4,b:1' -> {'a': 4, 'b': 1}"""
+    weights = {}
+    for item in spec.split(","):
+        name, _, value = item.partition(":")
+        if name.strip() and value.strip():
+            weights[name.strip()] = max(1, int(value))
+    return weights
+
+
+TIER_WEIGHTS = _parse_weights(SCHED_TIER_WEIGHTS)
+CATEGORY_COSTS = _parse_weights(SCHED_CATEGORY_COSTS)
+INTERACTIVE_CATEGORIES = {c.strip() for c in SCHED_INTERACTIVE_CATEGORIES.split(",") if c.strip()}
+
+
+@lru_cache(maxsize=1)
+def _workflow_categories() -> dict:
+    """workflow 名稱 -> 類別 (ComfyUIworkflow/config.json 的 category)"""
+    try:
+        with open(WORKFLOW_CONFIG_PATH, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {name: entry.get("category", "") for name, entry in config.items() if isinstance(entry, dict)}
+
+
+def classify(workflow: str) -> Tuple[str, int]:
+    """
+    依 workflow 類別決定優先級與預設排程成本 (沒有執行時間統計時使用)
+
+    Returns:
+        (priority, cost)；未知 workflow 視為影片類長任務
+    """
+    category = _workflow_categories().get(workflow, "video")
+    priority = PRIORITY_INTERACTIVE if category in INTERACTIVE_CATEGORIES else PRIORITY_BATCH
+    return priority, CATEGORY_COSTS.get(category, max(CATEGORY_COSTS.values(), default=1))
+
+
+def enqueue(r, job_data: dict, owner: str) -> str:
+    """
+    把任務放入所屬流的子佇列
+
+    Args:
+        r: Redis 客戶端
+        job_data: 任務資料 (會加上 priority / sched_cost / expected_seconds / sched_flow 欄位)
+        owner: 使用者識別 (登入會員 user:<id>，訪客 ip:<address>)
+
+    Returns:
+        任務優先級
+    """
+    priority, category_cost = classify(job_data.get("workflow", "text_to_image"))
+    stats = runtime_stats.estimate(r, job_data)
+    expected = stats["mean"] if stats else category_cost * SCHED_COST_UNIT_SECONDS
+    cost = max(1, math.ceil(expected / SCHED_COST_UNIT_SECONDS))
+
+    flow = f"{priority}:{owner}"
+    job_data.update({
+        "priority": priority,
+        "sched_cost": cost,
+        "expected_seconds": expected,
+        "sched_flow": flow,
+    })
+    quantum = SCHED_QUANTUM * TIER_WEIGHTS.get(priority, 1)
+
+    _script(r, _ENQUEUE_LUA)(
+        keys=[FLOW_QUEUE_PREFIX + flow, FLOWS_KEY, ACTIVE_KEY, QUANTUM_KEY, JOBS_KEY, WAKEUP_KEY, WORK_KEY],
+        args=[flow, json.dumps(job_data), job_data["job_id"], quantum, time.time() + expected, expected]
+    )
+    return priority
+
+
+def reserve(r, legacy_queue: str, processing_key: str, timeout: int = 5) -> Optional[str]:
+    """
+    依 DRR 取出下一個任務並原子地搬到 processing 清單
+
+    沒有任務時以 BLPOP 等待新任務通知 (最多 timeout 秒) 後再試一次。
+
+    Returns:
+        任務 JSON 字串；逾時返回 None
+    """
+    script = _script(r, _RESERVE_LUA)
+    keys = [legacy_queue, processing_key, FLOWS_KEY, ACTIVE_KEY, DEFICIT_KEY, QUANTUM_KEY, JOBS_KEY, WAKEUP_KEY, WORK_KEY]
+    args = [FLOW_QUEUE_PREFIX, _MAX_ROUNDS]
+
+    job = script(keys=keys, args=args)
+    if job:
+        return job
+    r.blpop(WAKEUP_KEY, timeout=timeout)
+    return script(keys=keys, args=args) or None
+
+
+def remove(r, legacy_queue: str, job_id: str) -> int:
+    """
+    移除尚未被 Worker 取走的任務 (取消用)
+
+    Returns:
+        移除的數量 (0 表示已被取走或不存在)
+    """
+    removed = int(_script(r, _REMOVE_LUA)(keys=[JOBS_KEY, WORK_KEY], args=[job_id, FLOW_QUEUE_PREFIX]))
+    return removed + remove_queued_job(r, legacy_queue, job_id)
+
+
+def pending_count(r, legacy_queue: str) -> int:
+    """等待中的任務數 (JOB_QUEUE 中的回收任務 + 各流子佇列)"""
+    pipe = r.pipeline(transaction=False)
+    pipe.llen(legacy_queue)
+    pipe.hlen(JOBS_KEY)
+    return sum(int(n) for n in pipe.execute())
+
+
+def queue_position(r, legacy_queue: str, job_id: str) -> Optional[dict]:
+    """
+    估計排隊中任務的位置與開始前的等待時間
+
+    DRR 下本流處理完排在前面的 W 秒工作時，其他流 f 最多也會被處理
+    min(f 的等待總量, W × quantum_f / quantum_本流) 秒，因此：
+        等待時間 = (回收任務 + W + Σ 其他流的上述份量) / Worker 數
+
+    Returns:
+        {"position", "wait_seconds", "expected_seconds"}；任務已不在排程佇列時返回 None
+    """
+    flow = r.hget(JOBS_KEY, job_id)
+    if not flow:
+        return None
+
+    pipe = r.pipeline(transaction=False)
+    pipe.zrange(FLOW_QUEUE_PREFIX + flow, 0, -1)
+    pipe.lrange(legacy_queue, 0, -1)
+    pipe.hgetall(WORK_KEY)
+    pipe.hgetall(QUANTUM_KEY)
+    pipe.scard(WORKER_REGISTRY_KEY)
+    members, legacy, work, quanta, workers = pipe.execute()
+
+    def decode(raw: str) -> dict:
+        try:
+            job = json.loads(raw)
+        except ValueError:
+            return {}
+        return job if isinstance(job, dict) else {}
+
+    def expected_of(job: dict) -> float:
+        try:
+            return float(job.get("expected_seconds") or 0)
+        except (ValueError, TypeError):
+            return 0.0
+
+    ahead = 0
+    work_ahead = 0.0
+    own_expected = None
+    for raw in members:
+        job = decode(raw)
+        if job.get("job_id") == job_id:
+            own_expected = expected_of(job)
+            break
+        ahead += 1
+        work_ahead += expected_of(job)
+    if own_expected is None:
+        return None
+
+    parallelism = max(1, int(workers or 0))
+    own_quantum = float(quanta.get(flow, 1))
+    interleaved = sum(
+        min(max(0.0, float(pending)), (work_ahead + own_expected) * float(quanta.get(other, 1)) / own_quantum)
+        for other, pending in work.items() if other != flow
+    )
+    legacy_work = sum(expected_of(decode(raw)) for raw in legacy)
+
+    return {
+        "position": len(legacy) + ahead + 1,
+        "wait_seconds": round((legacy_work + work_ahead + interleaved) / parallelism, 1),
+        "expected_seconds": own_expected,
+    }
@@ -0,0 +1,206 @@
+"""
+Job Stage Timing
+================
+任務生命週期的分段計時：
+- Worker 以 JobTimer 記錄每個階段的耗時 (span)
+- 任務結束時寫入 Redis：
+    job:timing:<job_id>               每個任務的各階段秒數 (Hash，隨任務狀態一起過期)
+    timing:hist:<workflow>:<stage>    各 workflow 各階段的累積直方圖 (Hash: 桶計數 + sum + count)
+    timing:workflows                  有計時資料的 workflow 集合
+- 同時輸出一筆帶 timing 欄位的 JSON 日誌
+- Backend 透過 get_job_timing / get_timing_summary 提供查詢端點
+
+用來區分 p95 變慢是 GPU 執行時間，還是我們自己的前後處理開銷。
+"""
+
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+from shared.metrics import JOB_STAGE_SECONDS, STAGE_BUCKETS
+
+# 階段名稱 (依任務流程順序)
+STAGES = (
+    "queue_wait",         # Redis 佇列等待 (created_at → Worker 取出)
+    "input_prep",         # 圖片解碼 / 正規化 / 存檔、音訊複製
+    "parse_workflow",     # workflow 解析與注入
+    "queue_prompt",       # 提交到 ComfyUI
+    "comfy_queue_wait",   # ComfyUI 內部排隊 (提交 → execution_start)
+    "comfy_execution",    # ComfyUI 執行 (execution_start → 完成)
+    "output_copy",        # 輸出檔案取回
+    "db_sync",            # MySQL 狀態同步
+    "total",              # Worker 取出任務到處理結束
+)
+
+# 直方圖桶上界 (秒，與 Prometheus 指標相同)
+BUCKETS = STAGE_BUCKETS
+
+JOB_TIMING_KEY = "job:timing:{job_id}"
+HISTOGRAM_KEY = "timing:hist:{workflow}:{stage}"
+WORKFLOWS_KEY = "timing:workflows"
+
+logger = logging.getLogger(__name__)
+
+
+def _bucket_field(upper) -> str:
+    return "+Inf" if upper == float("inf") else f"{upper:g}"
+
+
+class JobTimer:
+    """
+    單一任務的分段計時器 (非執行緒安全，每個任務一個)
+
+    使用範例:
+        timer = JobTimer(job_id, "text_to_image", created_at=job_data.get("created_at"))
+        with timer.span("parse_workflow"):
+            workflow = parse_workflow(...)
+        timer.record("comfy_execution", 12.3)
+        timer.flush(r, ttl=JOB_STATUS_EXPIRE_SECONDS)
+    """
+
+    def __init__(self, job_id: str, workflow: str, created_at: str = None):
+        self.job_id = job_id
+        self.workflow = workflow or "unknown"
+        self.started = time.time()
+        self.spans = {}
+
+        # 佇列等待：Backend 建立任務時間 (ISO 格式，與 Worker 同一時區) 到現在
+        if created_at:
+            try:
+                created = datetime.fromisoformat(created_at)
+                self.record("queue_wait", max(0.0, (datetime.now() - created).total_seconds()))
+            except (TypeError, ValueError):
+                pass
+
+    def record(self, stage: str, seconds: float) -> None:
+        """記錄 (累加) 一個階段的耗時"""
+        if seconds is None or seconds < 0:
+            return
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage: str):
+        """計時 with 區塊 (例外時仍會記錄)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def flush(self, r, ttl: int = None, status: str = None) -> dict:
+        """
+        寫入 Redis (任務明細 + workflow 直方圖) 並輸出 JSON 日誌
+
+        Returns:
+            各階段秒數 (含 total)
+        """
+        self.record("total", time.time() - self.started)
+        spans = {stage: round(seconds, 4) for stage, seconds in self.spans.items()}
+
+        for stage, seconds in self.spans.items():
+            JOB_STAGE_SECONDS.labels(workflow=self.workflow, stage=stage).observe(seconds)
+
+        try:
+            pipe = r.pipeline(transaction=False)
+            job_key = JOB_TIMING_KEY.format(job_id=self.job_id)
+            pipe.hset(job_key, mapping={**spans, "workflow": self.workflow, "status": status or ""})
+            if ttl:
+                pipe.expire(job_key, ttl)
+
+            pipe.sadd(WORKFLOWS_KEY, self.workflow)
+            for stage, seconds in spans.items():
+                hist_key = HISTOGRAM_KEY.format(workflow=self.workflow, stage=stage)
+                upper = next((b for b in BUCKETS if seconds <= b), float("inf"))
+                pipe.hincrby(hist_key, _bucket_field(upper), 1)
+                pipe.hincrby(hist_key, "count", 1)
+                pipe.hincrbyfloat(hist_key, "sum", seconds)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ 寫入任務計時失敗: {e}")
+
+        logging.getLogger("worker").info(
+            "⏱️ 任務階段耗時: " + ", ".join(f"{k}={v:.2f}s" for k, v in spans.items()),
+            extra={"job_id": self.job_id, "workflow": self.workflow, "timing": spans}
+        )
+        return spans
+
+
+# ==========================================
+# 查詢 (Backend)
+# ==========================================
+
+def get_job_timing(r, job_id: str) -> Optional[dict]:
+    """取得單一任務的階段耗時，不存在返回 None"""
+    data = r.hgetall(JOB_TIMING_KEY.format(job_id=job_id))
+    if not data:
+        return None
+    stages = {}
+    for stage in STAGES:
+        if stage in data:
+            stages[stage] = float(data[stage])
+    return {
+        "job_id": job_id,
+        "workflow": data.get("workflow", ""),
+        "status": data.get("status", ""),
+        "stages": stages,
+    }
+
+
+def _quantile(buckets: list, count: int, q: float) -> Optional[float]:
+    """由累積桶估算分位數 (桶內線性內插，與 Prometheus histogram_quantile 相同)"""
+    if not count:
+        return None
+    rank = q * count
+    prev_upper, prev_cum = 0.0, 0
+    for upper, cumulative in buckets:
+        if cumulative >= rank:
+            if upper == float("inf"):
+                return prev_upper
+            in_bucket = cumulative - prev_cum
+            if in_bucket <= 0:
+                return upper
+            return prev_upper + (upper - prev_upper) * (rank - prev_cum) / in_bucket
+        prev_upper, prev_cum = upper, cumulative
+    return prev_upper
+
+
+def get_timing_summary(r, workflow: str = None) -> dict:
+    """
+    取得各 workflow 各階段的直方圖摘要
+
+    Returns:
+        {workflow: {stage: {"count", "mean", "p50", "p95", "p99", "buckets": {le: 累積數}}}}
+    """
+    workflows = [workflow] if workflow else sorted(r.smembers(WORKFLOWS_KEY))
+
+    pipe = r.pipeline(transaction=False)
+    keys = [(wf, stage) for wf in workflows for stage in STAGES]
+    for wf, stage in keys:
+        pipe.hgetall(HISTOGRAM_KEY.format(workflow=wf, stage=stage))
+    results = pipe.execute()
+
+    summary = {}
+    for (wf, stage), data in zip(keys, results):
+        if not data:
+            continue
+        count = int(data.get("count", 0))
+        cumulative, buckets = 0, []
+        for upper in BUCKETS + (float("inf"),):
+            cumulative += int(data.get(_bucket_field(upper), 0))
+            buckets.append((upper, cumulative))
+        total = float(data.get("sum", 0))
+        summary.setdefault(wf, {})[stage] = {
+            "count": count,
+            "mean": round(total / count, 4) if count else None,
+            "p50": _round(_quantile(buckets, count, 0.50)),
+            "p95": _round(_quantile(buckets, count, 0.95)),
+            "p99": _round(_quantile(buckets, count, 0.99)),
+            "buckets": {_bucket_field(upper): c for upper, c in buckets},
+        }
+    return summary
+
+
+def _round(value):
+    return round(value, 4) if value is not None else None
@@ -69,7 +69,13 @@ class JSONFormatter(logging.Formatter):
         # 注入 job_id (如果存在)
         if hasattr(record, 'job_id'):
             log_data["job_id"] = record.job_id
-        
+
+        # 注入任務階段耗時 (shared.stage_timing)
+        if hasattr(record, 'workflow'):
+            log_data["workflow"] = record.workflow
+        if hasattr(record, 'timing'):
+            log_data["timing"] = record.timing
+
         # 注入異常資訊 (如果存在)
         if record.exc_info:
             log_data["exc_info"] = self.formatException(record.exc_info)
@@ -204,6 +210,8 @@ def get_redis_client(decode_responses: bool = True):
         )
         # 測試連接
         client.ping()
-        return client
+        # 每個指令記錄延遲 (Prometheus /metrics)
+        from shared.metrics import instrument_redis
+        return instrument_redis(client)
     except Exception as e:
         raise Exception(f"Redis 連接失敗 ({REDIS_HOST}:{REDIS_PORT}): {e}")
@@ -0,0 +1,101 @@
+"""
+Job Cancel Watcher
+==================
+以 Redis Pub/Sub 接收取消訊號，取代每個進度事件都 HGET 一次狀態：
+- Backend 取消任務時經 shared.job_status.set_job_status 發布 job:events:<job_id> (status = cancelled)
+- 本 Worker 只用一條 PSUBSCRIBE 連線 (shared.job_events)，依 job_id 設定對應任務的 threading.Event
+- watch() 註冊後會讀一次目前狀態，避免訂閱前就已取消的任務漏接
+- Pub/Sub 斷線重連後以 pipeline 重新讀取所有監看中任務的狀態
+"""
+
+import json
+import logging
+import threading
+
+from shared.job_status import STATUS_KEY
+from shared.job_events import JobEventSubscriber
+
+logger = logging.getLogger("worker")
+
+
+class CancelWatcher:
+    """
+    使用範例:
+        watcher = CancelWatcher(redis_client)
+        watcher.start()
+        cancelled = watcher.watch(job_id)
+        try:
+            ... cancelled.is_set() ...
+        finally:
+            watcher.unwatch(job_id)
+    """
+
+    def __init__(self, redis_client, max_backoff: float = 30.0):
+        self.redis = redis_client
+        self._watched = {}   # job_id -> threading.Event
+        self._lock = threading.Lock()
+        self._subscriber = JobEventSubscriber(
+            redis_client, self._dispatch, self._resync,
+            name="cancel-watcher", label="取消訊號", max_backoff=max_backoff, log=logger
+        )
+
+    # ==========================================
+    # 生命週期
+    # ==========================================
+
+    def start(self) -> None:
+        """啟動背景接收執行緒 (重複呼叫無作用)"""
+        self._subscriber.start()
+
+    def stop(self) -> None:
+        self._subscriber.stop()
+
+    # ==========================================
+    # 監看管理
+    # ==========================================
+
+    def watch(self, job_id: str) -> threading.Event:
+        """開始監看任務，返回取消時會被 set 的 Event"""
+        with self._lock:
+            cancelled = self._watched.setdefault(job_id, threading.Event())
+        try:
+            if self.redis.hget(STATUS_KEY.format(job_id=job_id), "status") == "cancelled":
+                cancelled.set()
+        except Exception as e:
+            logger.warning(f"⚠️ 讀取任務狀態失敗 (僅依賴取消訊號): {e}")
+        return cancelled
+
+    def unwatch(self, job_id: str) -> None:
+        with self._lock:
+            self._watched.pop(job_id, None)
+
+    # ==========================================
+    # 內部：接收與分派
+    # ==========================================
+
+    def _dispatch(self, job_id: str, data: str) -> None:
+        with self._lock:
+            cancelled = self._watched.get(job_id)
+        # 其他任務的事件 (包含本 Worker 自己的進度更新) 不解析 JSON
+        if cancelled is None or cancelled.is_set():
+            return
+        try:
+            event = json.loads(data or "{}")
+        except ValueError:
+            return
+        if event.get("status") == "cancelled":
+            logger.info(f"🛑 收到取消訊號: {job_id}")
+            cancelled.set()
+
+    def _resync(self) -> None:
+        """重連期間的事件可能遺失：重新讀取所有監看中任務的狀態"""
+        with self._lock:
+            watched = list(self._watched.items())
+        if not watched:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for job_id, _ in watched:
+            pipe.hget(STATUS_KEY.format(job_id=job_id), "status")
+        for (job_id, cancelled), status in zip(watched, pipe.execute()):
+            if status == "cancelled":
+                cancelled.set()
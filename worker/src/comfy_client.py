@@ -3,43 +3,154 @@ ComfyUI Client
 ==============
 處理與 ComfyUI API 的通訊：
 - HTTP POST 提交 workflow
-- WebSocket 監聯執行狀態
-- 輸出檔案處理
+- WebSocket 監聽執行狀態 (每個 client 共用一條長連線，見 comfy_events.py)
+- 輸入檔案經 HTTP /upload/image 上傳 (INPUT_TRANSPORT=http，Worker 不需與 ComfyUI 共用磁碟)
+- 輸出檔案處理 (硬連結 / reflink / 從 /view 串流下載)
 """
 
+import os
 import json
 import uuid
 import time
+import queue
 import shutil
+import threading
+import mimetypes
 import requests
-import websocket
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 from typing import Optional, Callable
 
 from config import (
     COMFY_HOST, COMFY_PORT, COMFY_HTTP_URL, COMFY_WS_URL,
-    COMFYUI_OUTPUT_DIR, STORAGE_OUTPUT_DIR
+    COMFYUI_OUTPUT_DIR, STORAGE_OUTPUT_DIR, WORKER_MAX_INFLIGHT
 )
+from comfy_events import ComfyEventStream, RECONNECTED_EVENT
+from shared.metrics import BYTES_COPIED
 
 # 為了向後相容，保留模組級別的別名
 COMFY_OUTPUT_DIR = COMFYUI_OUTPUT_DIR
 
+# /view 串流下載的分塊大小
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Linux ioctl FICLONE (btrfs / xfs / overlayfs 等支援 reflink 的檔案系統)
+FICLONE = 0x40049409
+
+# 表示 prompt 已開始執行的事件 (用於計算 ComfyUI 排隊 / 執行時間)
+EXECUTION_EVENTS = ("execution_start", "execution_cached", "executing", "progress", "executed")
+# 表示 prompt 已結束的事件 (executing 且 node 為 None 另外處理)
+TERMINAL_EVENTS = ("execution_success", "execution_error", "execution_interrupted")
+
+
+def clone_file(source: Path, dest: Path) -> str:
+    """
+    以最低成本取得輸出檔案的副本：硬連結 → reflink → 串流複製
+    
+    先寫到同目錄暫存名再 os.replace，讀取端不會看到不完整的檔案；
+    完成後確認大小與來源一致。
+    
+    Returns:
+        使用的方式 ("hardlink" / "reflink" / "copy")
+    """
+    tmp = dest.with_name(f".tmp_{uuid.uuid4().hex}_{dest.name}")
+    expected = source.stat().st_size
+    method = None
+    try:
+        # ComfyUI 輸出檔名帶流水號、不會原地覆寫，共用 inode 是安全的
+        try:
+            os.link(source, tmp)
+            method = "hardlink"
+        except OSError:
+            pass
+        
+        if method is None:
+            try:
+                import fcntl
+                with open(source, "rb") as src, open(tmp, "wb") as dst:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                method = "reflink"
+            except (ImportError, OSError):
+                pass
+        
+        if method is None:
+            # shutil.copyfile 在 Linux 上走 sendfile，不經過 Python 緩衝
+            shutil.copyfile(source, tmp)
+            shutil.copystat(source, tmp)
+            method = "copy"
+        
+        actual = tmp.stat().st_size
+        if actual != expected:
+            raise IOError(f"檔案大小不符，預期 {expected} bytes，實際 {actual} bytes")
+        
+        os.replace(tmp, dest)
+        return method
+    except Exception:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        raise
+
+
+def _tag_outputs(output: dict, node_id: str) -> dict:
+    """在每個輸出檔案項目加上產生它的節點 ID ("node")，供批次任務依節點分配輸出"""
+    return {
+        key: [dict(item, node=node_id) if isinstance(item, dict) else item for item in items]
+        if isinstance(items, list) else items
+        for key, items in output.items()
+    }
+
 
 class ComfyClient:
     """
     ComfyUI API 客戶端
     """
     
-    def __init__(self, host: str = COMFY_HOST, port: int = COMFY_PORT):
+    def __init__(self, host: str = COMFY_HOST, port: int = COMFY_PORT, local_files: bool = True):
+        """
+        Args:
+            host / port: ComfyUI 位址
+            local_files: 是否與此 ComfyUI 共用 input / output 目錄；
+                         False 時一律以 /upload/image 上傳輸入、從 /view 下載輸出
+        """
         self.host = host
         self.port = port
+        self.local_files = local_files
         self.http_url = f"http://{host}:{port}"
         self.ws_url = f"ws://{host}:{port}/ws"
         self.client_id = str(uuid.uuid4())
         
+        # 每個 client_id 一條長連線，依 prompt_id 分派事件
+        self.events = ComfyEventStream(self.ws_url, self.client_id)
+        
+        # 上傳 / 查詢輸入檔案用的連線池 (並行槽位共用，保持 keep-alive)
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=max(4, WORKER_MAX_INFLIGHT * 2)))
+        
         # 確保輸出目錄存在
         STORAGE_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     
+    def start_event_stream(self, wait: float = 0) -> bool:
+        """
+        啟動共用的 WebSocket 事件流 (Worker 啟動時呼叫一次)
+        
+        Args:
+            wait: 等待連線建立的秒數，0 表示不等待
+        
+        Returns:
+            目前是否已連線
+        """
+        self.events.start()
+        if wait:
+            return self.events.wait_connected(timeout=wait)
+        return self.events.connected
+    
+    def close(self):
+        """關閉事件流與連線池"""
+        self.events.stop()
+        self.session.close()
+    
     def check_connection(self, retry: int = 1) -> bool:
         """
         檢查 ComfyUI 是否可連接
@@ -99,52 +210,141 @@ class ComfyClient:
             print(f"[ComfyClient] 提交錯誤: {e}")
             return None
     
+    def has_input(self, filename: str, subfolder: str = "") -> bool:
+        """
+        查詢 ComfyUI input 目錄是否已有指定檔案 (HEAD /view，不傳輸內容)
+        """
+        params = {"filename": filename, "subfolder": subfolder, "type": "input"}
+        try:
+            response = self.session.head(f"{self.http_url}/view", params=params, timeout=10)
+            return response.status_code == 200
+        except requests.RequestException as e:
+            print(f"[ComfyClient] 查詢輸入檔案失敗: {e}")
+            return False
+    
+    def upload_input(
+        self,
+        filename: str,
+        data: bytes = None,
+        path: Path = None,
+        skip_existing: bool = False
+    ) -> Optional[str]:
+        """
+        透過 HTTP multipart (/upload/image) 上傳輸入檔案到 ComfyUI input 目錄
+        
+        圖片與音訊都走同一個端點 (ComfyUI 不檢查副檔名)。
+        檔名由內容決定時 (如 in_<sha256>.png) 同名即同內容，可用 skip_existing 略過已有的檔案；
+        以任務 ID 命名的檔案 (如音訊) 不會重複，不應先查詢。
+        ComfyUI 沒有刪除 input 檔案的 API，上傳後的檔案須由 ComfyUI 主機自行清理。
+        
+        Args:
+            filename: 在 ComfyUI input 目錄中的檔名
+            data: 檔案內容 (與 path 擇一)
+            path: 本地檔案路徑 (與 data 擇一)
+            skip_existing: 先以 HEAD /view 查詢 ComfyUI 是否已有同名檔案 (僅適用內容定址檔名)
+        
+        Returns:
+            ComfyUI 端的檔名，失敗時返回 None
+        """
+        if skip_existing and self.has_input(filename):
+            print(f"[ComfyClient] ♻️ ComfyUI 已有輸入檔案，略過上傳: {filename}")
+            return filename
+        
+        mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        try:
+            if path is not None:
+                with open(path, "rb") as f:
+                    response = self.session.post(
+                        f"{self.http_url}/upload/image",
+                        files={"image": (filename, f, mime_type)},
+                        data={"type": "input", "overwrite": "true"},
+                        timeout=120
+                    )
+            else:
+                response = self.session.post(
+                    f"{self.http_url}/upload/image",
+                    files={"image": (filename, data, mime_type)},
+                    data={"type": "input", "overwrite": "true"},
+                    timeout=120
+                )
+            
+            if response.status_code == 200:
+                result = response.json()
+                name = result.get("name", filename)
+                if result.get("subfolder"):
+                    name = f"{result['subfolder']}/{name}"
+                size = Path(path).stat().st_size if path is not None else len(data)
+                BYTES_COPIED.labels(method="upload").inc(size)
+                print(f"[ComfyClient] ✓ 已上傳輸入檔案: {name}")
+                return name
+            else:
+                print(f"[ComfyClient] ✗ 上傳失敗: {response.status_code} - {response.text}")
+                return None
+        except Exception as e:
+            print(f"[ComfyClient] ✗ 上傳錯誤: {e}")
+            return None
+    
     def wait_for_completion(
         self, 
         prompt_id: str, 
         timeout: int = None,  # Phase 9: 改為 None，使用 config 預設值
-        on_progress: Optional[Callable] = None
+        on_progress: Optional[Callable] = None,
+        events: Optional[queue.Queue] = None,
+        cancelled: Optional[threading.Event] = None,
+        execution_timeout: Optional[float] = None
     ) -> dict:
         """
-        使用 WebSocket 等待任務完成
+        透過共用 WebSocket 事件流等待任務完成
         
         Args:
             prompt_id: 執行 ID
-            timeout: 超時時間 (秒)，None 則使用配置預設值
+            timeout: 超時時間 (秒)，None 則使用配置預設值 (含 ComfyUI 排隊時間)
+            execution_timeout: 開始執行後的超時時間 (秒，可選)；依該 workflow 的歷史執行時間決定，
+                               超過時移除/中斷此 prompt
             on_progress: 進度回調函數
+            events: 已訂閱的事件佇列 (None 則在此訂閱)；
+                    建議在 queue_prompt 後立即訂閱，backlog 會補送先到的事件
+            cancelled: 取消訊號 (可選)；被 set 時以 cancel_prompt 移除/中斷此 prompt 並結束等待 (最多延遲 1 秒)
         
         Returns:
             {
                 "success": bool,
-                "images": [{"filename": str, "subfolder": str, "type": str}],
-                "videos": [{"filename": str, "subfolder": str, "type": str}],
-                "gifs": [{"filename": str, "subfolder": str, "type": str}],
-                "error": str or None
+                "images": [{"filename": str, "subfolder": str, "type": str, "node": str}],
+                "videos": [{"filename": str, "subfolder": str, "type": str, "node": str}],
+                "gifs": [{"filename": str, "subfolder": str, "type": str, "node": str}],
+                "error": str or None,
+                "cancelled": bool,
+                "timing": {"execution_start": float or None, "execution_end": float or None}
             }
+            timing 為事件到達時間 (epoch 秒)，用於區分 ComfyUI 排隊與實際執行時間
         """
         # Phase 9: 使用配置的 WORKER_TIMEOUT
-        from config import WORKER_TIMEOUT, COMFY_POLLING_INTERVAL
+        from config import WORKER_TIMEOUT
         if timeout is None:
             timeout = WORKER_TIMEOUT
         
-        ws_url = f"{self.ws_url}?clientId={self.client_id}"
         result = {
             "success": False,
             "images": [],
             "videos": [],
             "gifs": [],
-            "error": None
+            "error": None,
+            "cancelled": False,
+            "timing": {"execution_start": None, "execution_end": None}
         }
+        timing = result["timing"]
         all_images = []  # 收集所有輸出圖片
         all_videos = []  # 收集所有輸出影片
         all_gifs = []    # 收集所有輸出 GIF
         
+        self.events.start()
+        if events is None:
+            events = self.events.subscribe(prompt_id)
+        print(f"[ComfyClient] 等待任務完成（prompt_id: {prompt_id}，超時: {timeout}s）...")
+        
         try:
-            ws = websocket.create_connection(ws_url, timeout=timeout)
-            print(f"[ComfyClient] WebSocket 已連接，等待任務完成（超時: {timeout}s）...")
-            
             start_time = time.time()
-            last_heartbeat = start_time  # Phase 9: 記錄上次心跳時間
+            last_heartbeat = 0  # Phase 9: 記錄上次心跳時間
             
             while True:
                 # 檢查超時
@@ -154,119 +354,168 @@ class ComfyClient:
                     print(f"[ComfyClient] ❌ 任務超時: {prompt_id} ({int(elapsed)}s)")
                     break
                 
-                # Phase 9: 每 60 秒輸出一次心跳日誌（保持連接存活，證明沒有卡死）
+                # 執行超時 (只計算 ComfyUI 開始執行後的時間，不含排隊)
+                started = timing["execution_start"]
+                if execution_timeout and started and time.time() - started > execution_timeout:
+                    result["error"] = f"執行超時（已執行 {int(time.time() - started)}s，超過預估上限 {int(execution_timeout)}s）"
+                    print(f"[ComfyClient] ❌ 任務執行超時: {prompt_id}")
+                    self.cancel_prompt(prompt_id)
+                    break
+                
+                # 使用者取消 (由 Pub/Sub 推送，不需輪詢 Redis)
+                if cancelled is not None and cancelled.is_set():
+                    print(f"[ComfyClient] 🛑 任務已被取消: {prompt_id}")
+                    self.cancel_prompt(prompt_id)
+                    result["error"] = "Task cancelled by user"
+                    result["cancelled"] = True
+                    break
+                
+                # Phase 9: 每 60 秒輸出一次心跳日誌（證明沒有卡死）
                 if elapsed - last_heartbeat >= 60:
-                    print(f"[ComfyClient] 💓 任務 {prompt_id} 仍在處理中... （已等待: {int(elapsed)}s / {timeout}s）")
+                    if last_heartbeat:
+                        print(f"[ComfyClient] 💓 任務 {prompt_id} 仍在處理中... （已等待: {int(elapsed)}s / {timeout}s）")
                     last_heartbeat = elapsed
                 
                 try:
-                    message = ws.recv()
-                    
-                    # 跳過二進制消息 (圖片預覽等)
-                    if isinstance(message, bytes):
-                        continue
-                    
-                    # 嘗試解析 JSON
-                    try:
-                        data = json.loads(message)
-                    except (json.JSONDecodeError, UnicodeDecodeError):
-                        # 無法解析的消息，跳過
-                        continue
-                    
-                    # 確保 data 是字典類型
-                    if not isinstance(data, dict):
-                        continue
-                    
-                    msg_type = data.get("type")
-                    msg_data = data.get("data") or {}  # 確保 msg_data 不為 None
-                    
-                    # 確保 msg_data 是字典類型
-                    if not isinstance(msg_data, dict):
-                        msg_data = {}
+                    event = events.get(timeout=1)
+                except queue.Empty:
+                    continue
+                
+                msg_type = event.get("type")
+                msg_data = event.get("data") or {}
+                event_ts = event.get("ts") or time.time()
+                
+                # 開始執行時間：execution_start 遺失時以第一個執行相關事件代替
+                if timing["execution_start"] is None and msg_type in EXECUTION_EVENTS:
+                    timing["execution_start"] = event_ts
+                if msg_type in TERMINAL_EVENTS:
+                    timing["execution_end"] = event_ts
+                
+                # WebSocket 重連：期間的事件可能遺失，改由 History API 確認是否已完成
+                if msg_type == RECONNECTED_EVENT:
+                    history_result = self._get_result_from_history(prompt_id)
+                    if history_result is not None:
+                        print(f"[ComfyClient] WebSocket 重連期間任務已結束，改用 History API 結果")
+                        result.update(history_result)
+                        break
+                    continue
+                
+                # 進度更新
+                if msg_type == "progress":
+                    value = msg_data.get("value", 0)
+                    max_value = msg_data.get("max", 100) or 100
+                    progress = int((value / max_value) * 100)
+                    print(f"[ComfyClient] 進度: {progress}%")
                     
-                    # 進度更新
-                    if msg_type == "progress":
-                        value = msg_data.get("value", 0)
-                        max_value = msg_data.get("max", 100)
-                        progress = int((value / max_value) * 100)
-                        print(f"[ComfyClient] 進度: {progress}%")
+                    # 透過回調函數通知進度更新
+                    if on_progress:
+                        on_progress(progress)
+                
+                # 執行中
+                elif msg_type == "executing":
+                    node = msg_data.get("node")
+                    if node:
+                        print(f"[ComfyClient] 執行節點: {node}")
+                    else:
+                        # node 為 None 表示執行完成
+                        print(f"[ComfyClient] 任務執行完成")
+                        timing["execution_end"] = event_ts
+                        result["success"] = True
+                        # 使用收集到的所有輸出
+                        result["images"] = all_images
+                        result["videos"] = all_videos
+                        result["gifs"] = all_gifs
                         
-                        # 透過回調函數通知進度更新
-                        if on_progress:
-                            on_progress(progress)
-                    
-                    # 執行中
-                    elif msg_type == "executing":
-                        node = msg_data.get("node")
-                        if node:
-                            print(f"[ComfyClient] 執行節點: {node}")
-                        elif msg_data.get("prompt_id") == prompt_id:
-                            # node 為 None 表示執行完成
-                            print(f"[ComfyClient] 任務執行完成")
-                            result["success"] = True
-                            # 使用收集到的所有輸出
-                            result["images"] = all_images
-                            result["videos"] = all_videos
-                            result["gifs"] = all_gifs
-                            
-                            # 如果 WebSocket 沒有收到輸出，從 History API 獲取
-                            if not all_images and not all_videos and not all_gifs:
-                                print(f"[ComfyClient] WebSocket 未收到輸出，嘗試從 History API 獲取...")
-                                history_outputs = self.get_outputs_from_history(prompt_id)
-                                result["images"] = history_outputs.get("images", [])
-                                result["videos"] = history_outputs.get("videos", [])
-                                result["gifs"] = history_outputs.get("gifs", [])
-                                
-                                if result["images"] or result["videos"] or result["gifs"]:
-                                    print(f"[ComfyClient] ✅ 從 History API 獲取到輸出")
-                            break
-                    
-                    # 執行完成 (獲取輸出)
-                    elif msg_type == "executed":
-                        if msg_data.get("prompt_id") == prompt_id:
-                            output = msg_data.get("output", {})
-                            # 確保 output 是字典類型（防止 ComfyUI 返回 None）
-                            if output is None or not isinstance(output, dict):
-                                output = {}
+                        # 如果 WebSocket 沒有收到輸出，從 History API 獲取
+                        if not all_images and not all_videos and not all_gifs:
+                            print(f"[ComfyClient] WebSocket 未收到輸出，嘗試從 History API 獲取...")
+                            history_outputs = self.get_outputs_from_history(prompt_id)
+                            result["images"] = history_outputs.get("images", [])
+                            result["videos"] = history_outputs.get("videos", [])
+                            result["gifs"] = history_outputs.get("gifs", [])
                             
-                            # 處理圖片
-                            images = output.get("images", [])
-                            if images:
-                                all_images.extend(images)
-                                print(f"[ComfyClient] 輸出圖片: {images}")
-                                
-                            # 處理影片 (有些節點可能用 videos)
-                            videos = output.get("videos", [])
-                            if videos:
-                                all_videos.extend(videos)
-                                print(f"[ComfyClient] 輸出影片: {videos}")
-                                
-                            # 處理 GIF (有些節點可能用 gifs)
-                            gifs = output.get("gifs", [])
-                            if gifs:
-                                all_gifs.extend(gifs)
-                                print(f"[ComfyClient] 輸出 GIF: {gifs}")
-
+                            if result["images"] or result["videos"] or result["gifs"]:
+                                print(f"[ComfyClient] ✅ 從 History API 獲取到輸出")
+                        break
+                
+                # 執行完成 (獲取輸出)
+                elif msg_type == "executed":
+                    output = msg_data.get("output", {})
+                    # 確保 output 是字典類型（防止 ComfyUI 返回 None）
+                    if output is None or not isinstance(output, dict):
+                        output = {}
+                    output = _tag_outputs(output, msg_data.get("node"))
                     
-                    # 執行錯誤
-                    elif msg_type == "execution_error":
-                        if msg_data.get("prompt_id") == prompt_id:
-                            error_msg = msg_data.get("exception_message", "未知錯誤")
-                            result["error"] = error_msg
-                            print(f"[ComfyClient] 執行錯誤: {error_msg}")
-                            break
-                            
-                except websocket.WebSocketTimeoutException:
-                    continue
-            
-            ws.close()
+                    # 處理圖片
+                    images = output.get("images", [])
+                    if images:
+                        all_images.extend(images)
+                        print(f"[ComfyClient] 輸出圖片: {images}")
+                        
+                    # 處理影片 (有些節點可能用 videos)
+                    videos = output.get("videos", [])
+                    if videos:
+                        all_videos.extend(videos)
+                        print(f"[ComfyClient] 輸出影片: {videos}")
+                        
+                    # 處理 GIF (有些節點可能用 gifs)
+                    gifs = output.get("gifs", [])
+                    if gifs:
+                        all_gifs.extend(gifs)
+                        print(f"[ComfyClient] 輸出 GIF: {gifs}")
+                
+                # 執行錯誤
+                elif msg_type == "execution_error":
+                    error_msg = msg_data.get("exception_message", "未知錯誤")
+                    result["error"] = error_msg
+                    print(f"[ComfyClient] 執行錯誤: {error_msg}")
+                    break
+                
+                # 執行被中斷 (/interrupt)
+                elif msg_type == "execution_interrupted":
+                    result["error"] = "執行已被中斷"
+                    print(f"[ComfyClient] 執行已被中斷: {prompt_id}")
+                    break
             
         except Exception as e:
             result["error"] = str(e)
-            print(f"[ComfyClient] WebSocket 錯誤: {e}")
+            print(f"[ComfyClient] 等待任務錯誤: {e}")
+        finally:
+            self.events.unsubscribe(prompt_id)
         
         return result
     
+    def _get_result_from_history(self, prompt_id: str) -> Optional[dict]:
+        """
+        從 History API 判斷任務是否已結束
+        
+        Returns:
+            已結束時返回 wait_for_completion 格式的部分結果；尚在執行或查詢失敗返回 None
+        """
+        try:
+            response = requests.get(f"{self.http_url}/history/{prompt_id}", timeout=30)
+            if response.status_code != 200:
+                return None
+            entry = response.json().get(prompt_id)
+        except Exception as e:
+            print(f"[ComfyClient] History API 錯誤: {e}")
+            return None
+        
+        if not entry:
+            return None
+        
+        status = entry.get("status") or {}
+        if status.get("status_str") == "error":
+            return {"success": False, "error": "執行錯誤 (由 History API 回報)"}
+        
+        outputs = self.get_outputs_from_history(prompt_id)
+        return {
+            "success": True,
+            "images": outputs.get("images", []),
+            "videos": outputs.get("videos", []),
+            "gifs": outputs.get("gifs", []),
+        }
+    
     def get_outputs_from_history(self, prompt_id: str) -> dict:
         """
         從 ComfyUI History API 獲取任務輸出
@@ -306,6 +555,7 @@ class ComfyClient:
             
             # 遍歷所有節點的輸出
             for node_id, node_output in outputs.items():
+                node_output = _tag_outputs(node_output or {}, node_id)
                 # 處理圖片
                 images = node_output.get("images", [])
                 if images:
@@ -342,6 +592,9 @@ class ComfyClient:
         """
         將 ComfyUI 輸出的檔案（圖片/影片）複製到 storage/outputs
         
+        本地可找到來源時依序嘗試硬連結、reflink、串流複製 (數百 MB 的影片不再整檔重寫)；
+        Worker 與 ComfyUI 不共用檔案系統時，改從 /view 分塊串流下載。
+        
         Args:
             filename: 原始檔名
             subfolder: 子資料夾
@@ -351,6 +604,33 @@ class ComfyClient:
         Returns:
             新的檔名，失敗時返回 None
         """
+        # 目標檔名
+        ext = Path(filename).suffix
+        if job_id:
+            new_filename = f"{job_id}{ext}"
+        else:
+            new_filename = f"{int(time.time())}_{filename}"
+        
+        dest_path = STORAGE_OUTPUT_DIR / new_filename
+        
+        # 1. 與 ComfyUI 共用檔案系統：硬連結 / reflink / 串流複製
+        source_path = self._find_local_output(filename, subfolder, file_type) if self.local_files else None
+        if source_path is not None:
+            try:
+                method = clone_file(source_path, dest_path)
+                BYTES_COPIED.labels(method=method).inc(dest_path.stat().st_size)
+                print(f"[ComfyClient] ✓ 已取得輸出 ({method}): {source_path} -> {dest_path}")
+                return new_filename
+            except Exception as e:
+                print(f"[ComfyClient] ✗ 本地複製失敗，改由 /view 下載: {e}")
+        
+        # 2. 不共用檔案系統 (或本地找不到)：從 /view 分塊串流下載
+        if self._download_output(filename, subfolder, file_type, dest_path):
+            return new_filename
+        return None
+    
+    def _find_local_output(self, filename: str, subfolder: str, file_type: str) -> Optional[Path]:
+        """在本地 ComfyUI output / temp 目錄尋找輸出檔案，找不到返回 None"""
         # 根據 file_type 決定來源根目錄
         if file_type == "temp":
             base_dir = COMFY_OUTPUT_DIR.parent / "temp"
@@ -365,73 +645,166 @@ class ComfyClient:
         
         print(f"[ComfyClient] 檢查檔案路徑: {source_path}")
         
-        if not source_path.exists():
-            print(f"[ComfyClient] 找不到輸出檔案: {source_path}")
-            
-            # 嘗試備用路徑（有時 ComfyUI 的輸出可能在不同位置）
-            alternative_paths = []
-            
-            # 1. 嘗試直接在 output 根目錄
+        if source_path.exists():
+            return source_path
+        
+        print(f"[ComfyClient] 本地找不到輸出檔案: {source_path}")
+        
+        # 嘗試備用路徑（有時 ComfyUI 的輸出可能在不同位置）
+        alternative_paths = []
+        
+        # 1. 嘗試直接在 output 根目錄
+        if subfolder:
+            alternative_paths.append(COMFY_OUTPUT_DIR / filename)
+        
+        # 2. 如果是 temp 類型，嘗試 output 目錄
+        if file_type == "temp":
             if subfolder:
+                alternative_paths.append(COMFY_OUTPUT_DIR / subfolder / filename)
+            else:
                 alternative_paths.append(COMFY_OUTPUT_DIR / filename)
-            
-            # 2. 如果是 temp 類型，嘗試 output 目錄
-            if file_type == "temp":
-                if subfolder:
-                    alternative_paths.append(COMFY_OUTPUT_DIR / subfolder / filename)
-                else:
-                    alternative_paths.append(COMFY_OUTPUT_DIR / filename)
-            
-            # 3. 嘗試 temp 目錄（即使 file_type 不是 temp）
-            if file_type != "temp":
-                temp_dir = COMFY_OUTPUT_DIR.parent / "temp"
-                if subfolder:
-                    alternative_paths.append(temp_dir / subfolder / filename)
-                else:
-                    alternative_paths.append(temp_dir / filename)
-            
-            # 檢查所有備用路徑
-            for alt_path in alternative_paths:
-                print(f"[ComfyClient] 嘗試備用路徑: {alt_path}")
-                if alt_path.exists():
-                    print(f"[ComfyClient] ✓ 在備用路徑找到檔案！")
-                    source_path = alt_path
-                    break
+        
+        # 3. 嘗試 temp 目錄（即使 file_type 不是 temp）
+        if file_type != "temp":
+            temp_dir = COMFY_OUTPUT_DIR.parent / "temp"
+            if subfolder:
+                alternative_paths.append(temp_dir / subfolder / filename)
             else:
-                # 所有路徑都找不到
-                print(f"[ComfyClient] ✗ 所有可能路徑都找不到檔案")
-                return None
+                alternative_paths.append(temp_dir / filename)
         
-        # 目標檔名
-        ext = source_path.suffix
-        if job_id:
-            new_filename = f"{job_id}{ext}"
-        else:
-            new_filename = f"{int(time.time())}_{filename}"
+        # 檢查所有備用路徑
+        for alt_path in alternative_paths:
+            print(f"[ComfyClient] 嘗試備用路徑: {alt_path}")
+            if alt_path.exists():
+                print(f"[ComfyClient] ✓ 在備用路徑找到檔案！")
+                return alt_path
         
-        dest_path = STORAGE_OUTPUT_DIR / new_filename
+        return None
+    
+    def _download_output(self, filename: str, subfolder: str, file_type: str, dest_path: Path) -> bool:
+        """
+        從 ComfyUI /view 分塊串流下載輸出檔案 (不會整檔載入記憶體)
         
+        寫入暫存檔，確認大小與 Content-Length 一致後才原子地改名
+        (ComfyUI /view 不提供內容雜湊或 ETag，無可比對的參考值，因此不另做雜湊)。
+        """
+        params = {"filename": filename, "subfolder": subfolder, "type": file_type}
+        tmp_path = dest_path.with_name(f".tmp_{uuid.uuid4().hex}_{dest_path.name}")
         try:
-            shutil.copy2(source_path, dest_path)
-            print(f"[ComfyClient] ✓ 已複製檔案: {source_path} -> {dest_path}")
-            return new_filename
+            with self.session.get(f"{self.http_url}/view", params=params, stream=True, timeout=60) as response:
+                if response.status_code != 200:
+                    print(f"[ComfyClient] ✗ /view 下載失敗: {response.status_code} ({filename})")
+                    return False
+                
+                expected = response.headers.get("Content-Length")
+                written = 0
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                            written += len(chunk)
+            
+            if expected is not None and int(expected) != written:
+                raise IOError(f"檔案大小不符，預期 {expected} bytes，實際 {written} bytes")
+            
+            os.replace(tmp_path, dest_path)
+            BYTES_COPIED.labels(method="download").inc(written)
+            print(f"[ComfyClient] ✓ 已從 /view 下載: {filename} -> {dest_path} "
+                  f"({written} bytes)")
+            return True
         except Exception as e:
-            print(f"[ComfyClient] ✗ 複製檔案失敗: {e}")
-            return None
+            print(f"[ComfyClient] ✗ /view 下載錯誤: {e}")
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            return False
             
     # 向後相容別名
     copy_output_image = copy_output_file
     
-    def interrupt(self) -> bool:
+    def get_queue(self) -> Optional[dict]:
+        """
+        取得 ComfyUI 佇列 (GET /queue)
+        
+        Returns:
+            {"running": [prompt_id, ...], "pending": [prompt_id, ...]}，查詢失敗返回 None
+        """
+        try:
+            response = self.session.get(f"{self.http_url}/queue", timeout=5)
+            if response.status_code != 200:
+                print(f"[ComfyClient] ✗ 佇列查詢失敗: {response.status_code}")
+                return None
+            data = response.json()
+        except Exception as e:
+            print(f"[ComfyClient] ✗ 佇列查詢錯誤: {e}")
+            return None
+        
+        # 每個項目為 [number, prompt_id, prompt, extra_data, outputs_to_execute]
+        return {
+            "running": [item[1] for item in data.get("queue_running", []) if len(item) > 1],
+            "pending": [item[1] for item in data.get("queue_pending", []) if len(item) > 1],
+        }
+    
+    def delete_queued(self, prompt_ids: list) -> bool:
+        """
+        從 ComfyUI 佇列移除尚未開始執行的 prompt (POST /queue {"delete": [...]})
+        
+        Returns:
+            bool: 是否成功發送刪除指令
+        """
+        try:
+            response = self.session.post(
+                f"{self.http_url}/queue",
+                json={"delete": list(prompt_ids)},
+                timeout=5
+            )
+            if response.status_code == 200:
+                print(f"[ComfyClient] ✓ 已從 ComfyUI 佇列移除: {prompt_ids}")
+                return True
+            print(f"[ComfyClient] ✗ 佇列移除失敗: {response.status_code}")
+            return False
+        except Exception as e:
+            print(f"[ComfyClient] ✗ 佇列移除錯誤: {e}")
+            return False
+    
+    def cancel_prompt(self, prompt_id: str) -> str:
+        """
+        取消單一 prompt，不影響其他任務
+        
+        - 仍在 ComfyUI 佇列中：以 /queue delete 移除，不佔用 GPU
+        - 正在執行：發送指定 prompt_id 的 /interrupt
+        - 都不在 (已結束)：不做任何事
+        
+        Returns:
+            "deleted" / "interrupted" / "not_found" / "failed"
+        """
+        comfy_queue = self.get_queue()
+        if comfy_queue is None:
+            # 無法判斷位置：送出帶 prompt_id 的中斷 (新版 ComfyUI 只在該 prompt 執行中時中斷)
+            return "interrupted" if self.interrupt(prompt_id) else "failed"
+        
+        if prompt_id in comfy_queue["pending"]:
+            return "deleted" if self.delete_queued([prompt_id]) else "failed"
+        if prompt_id in comfy_queue["running"]:
+            return "interrupted" if self.interrupt(prompt_id) else "failed"
+        print(f"[ComfyClient] prompt 已不在 ComfyUI 佇列中: {prompt_id}")
+        return "not_found"
+    
+    def interrupt(self, prompt_id: str = None) -> bool:
         """
         中斷 ComfyUI 當前執行的任務
         
+        Args:
+            prompt_id: 只在此 prompt 正在執行時中斷 (None 則無條件中斷目前執行的任務)
+        
         Returns:
             bool: 是否成功發送中斷指令
         """
         try:
             response = requests.post(
                 f"{self.http_url}/interrupt",
+                json={"prompt_id": prompt_id} if prompt_id else None,
                 timeout=5
             )
             
@@ -0,0 +1,262 @@
+"""
+ComfyUI Event Stream
+====================
+每個 Worker 只維持一條長連線的 ComfyUI WebSocket：
+- Worker 啟動時連線一次，斷線後自動重連
+- 依 prompt_id 將 progress / executing / executed / execution_error 等事件
+  分派給各自的訂閱者 (queue.Queue)
+- 尚未訂閱的 prompt 事件會暫存在 backlog，訂閱時補送，
+  解決 queue_prompt 與開始監聽之間的事件遺失問題
+"""
+
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+from typing import Optional
+
+import websocket
+
+from shared.metrics import COMFY_WS_RECONNECTS
+
+# 分派給訂閱者的事件類型
+ROUTED_EVENT_TYPES = {
+    "execution_start",
+    "execution_cached",
+    "executing",
+    "progress",
+    "executed",
+    "execution_success",
+    "execution_error",
+    "execution_interrupted",
+}
+
+# 重連後通知所有訂閱者 (期間的事件可能遺失，需由訂閱者自行補查 History)
+RECONNECTED_EVENT = "reconnected"
+
+
+class ComfyEventStream:
+    """
+    單一 WebSocket 的事件多工器
+
+    使用範例:
+        stream = ComfyEventStream("ws://127.0.0.1:8188/ws", client_id)
+        stream.start()
+        events = stream.subscribe(prompt_id)
+        event = events.get(timeout=1)   # {"type": ..., "data": {...}, "ts": ...}
+        stream.unsubscribe(prompt_id)
+    """
+
+    def __init__(
+        self,
+        ws_url: str,
+        client_id: str,
+        backlog_prompts: int = 256,
+        backlog_events: int = 1024,
+        recv_timeout: float = 5.0,
+        max_backoff: float = 30.0
+    ):
+        self.url = f"{ws_url}?clientId={client_id}"
+        self.client_id = client_id
+        self.recv_timeout = recv_timeout
+        self.max_backoff = max_backoff
+        self.backlog_prompts = backlog_prompts
+        self.backlog_events = backlog_events
+
+        self._subscribers = {}          # prompt_id -> queue.Queue
+        self._backlog = OrderedDict()   # prompt_id -> deque[event] (尚無訂閱者)
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._ws = None
+
+        # 目前正在 ComfyUI 執行的 prompt (舊版 progress 事件不帶 prompt_id)
+        self.running_prompt_id = None
+        # 重連次數 (監控用)
+        self.reconnects = 0
+
+    # ==========================================
+    # 生命週期
+    # ==========================================
+
+    def start(self) -> None:
+        """啟動背景接收執行緒 (重複呼叫無副作用)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="comfy-events", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """停止接收並關閉連線"""
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        if self._thread:
+            self._thread.join(timeout=self.recv_timeout + 1)
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def wait_connected(self, timeout: float = None) -> bool:
+        """等待 WebSocket 連線建立"""
+        return self._connected.wait(timeout)
+
+    # ==========================================
+    # 訂閱管理
+    # ==========================================
+
+    def subscribe(self, prompt_id: str) -> queue.Queue:
+        """
+        訂閱指定 prompt 的事件，並補送訂閱前已收到的事件
+
+        Returns:
+            事件佇列，每個元素為 {"type": str, "data": dict, "ts": float}
+        """
+        events = queue.Queue()
+        with self._lock:
+            for event in self._backlog.pop(prompt_id, ()):
+                events.put(event)
+            self._subscribers[prompt_id] = events
+        return events
+
+    def unsubscribe(self, prompt_id: str) -> None:
+        with self._lock:
+            self._subscribers.pop(prompt_id, None)
+            self._backlog.pop(prompt_id, None)
+
+    # ==========================================
+    # 內部：接收與分派
+    # ==========================================
+
+    def _run(self) -> None:
+        backoff = 1.0
+        first_connect = True
+
+        while not self._stop.is_set():
+            try:
+                self._ws = websocket.create_connection(self.url, timeout=self.recv_timeout)
+            except Exception as e:
+                print(f"[ComfyEvents] WebSocket 連線失敗，{backoff:.0f}s 後重試: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = 1.0
+            self._connected.set()
+            if first_connect:
+                print(f"[ComfyEvents] WebSocket 已連接 (client_id: {self.client_id})")
+                first_connect = False
+            else:
+                self.reconnects += 1
+                COMFY_WS_RECONNECTS.inc()
+                print(f"[ComfyEvents] WebSocket 已重新連接 (第 {self.reconnects} 次)")
+                self._broadcast({"type": RECONNECTED_EVENT, "data": {}, "ts": time.time()})
+
+            try:
+                self._receive_loop()
+            except Exception as e:
+                if not self._stop.is_set():
+                    print(f"[ComfyEvents] WebSocket 中斷: {e}")
+            finally:
+                self._connected.clear()
+                try:
+                    self._ws.close()
+                except Exception:
+                    pass
+                self._ws = None
+
+    def _receive_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                message = self._ws.recv()
+            except websocket.WebSocketTimeoutException:
+                continue
+
+            # 跳過二進制消息 (圖片預覽等)
+            if isinstance(message, bytes):
+                continue
+
+            try:
+                data = json.loads(message)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+
+            if isinstance(data, dict):
+                self._dispatch(data)
+
+    def _dispatch(self, data: dict) -> None:
+        msg_type = data.get("type")
+        if msg_type not in ROUTED_EVENT_TYPES:
+            return
+
+        msg_data = data.get("data") or {}
+        if not isinstance(msg_data, dict):
+            msg_data = {}
+
+        prompt_id = msg_data.get("prompt_id")
+
+        # 追蹤目前執行中的 prompt
+        if msg_type == "execution_start" and prompt_id:
+            self.running_prompt_id = prompt_id
+        elif msg_type == "executing":
+            if msg_data.get("node") is None:
+                if prompt_id == self.running_prompt_id:
+                    self.running_prompt_id = None
+            elif prompt_id:
+                self.running_prompt_id = prompt_id
+
+        # 舊版 ComfyUI 的 progress 事件沒有 prompt_id，歸給執行中的 prompt
+        if not prompt_id:
+            prompt_id = self.running_prompt_id
+        if not prompt_id:
+            return
+
+        event = {"type": msg_type, "data": msg_data, "ts": time.time()}
+
+        with self._lock:
+            subscriber = self._subscribers.get(prompt_id)
+            if subscriber is not None:
+                subscriber.put(event)
+                return
+
+            # 尚未訂閱：暫存到 backlog (數量有上限，最舊的先丟棄)
+            pending = self._backlog.get(prompt_id)
+            if pending is None:
+                pending = deque(maxlen=self.backlog_events)
+                self._backlog[prompt_id] = pending
+                while len(self._backlog) > self.backlog_prompts:
+                    self._backlog.popitem(last=False)
+            pending.append(event)
+
+    def _broadcast(self, event: dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+
+# ==========================================
+# 測試用
+# ==========================================
+if __name__ == "__main__":
+    import uuid
+    from config import COMFY_WS_URL
+
+    stream = ComfyEventStream(COMFY_WS_URL, str(uuid.uuid4()))
+    stream.start()
+    if stream.wait_connected(timeout=10):
+        print("[Test] WebSocket 事件流連接成功！")
+    else:
+        print("[Test] WebSocket 事件流連接失敗，請確認 ComfyUI 是否已啟動")
+    stream.stop()
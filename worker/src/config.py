@@ -7,6 +7,7 @@ Worker Configuration
 
 import os
 import sys
+import socket
 from pathlib import Path
 
 # 添加 shared 模組到 Python 路徑
@@ -40,6 +41,14 @@ COMFY_PORT = int(os.getenv("COMFY_PORT", "8188"))
 COMFY_HTTP_URL = f"http://{COMFY_HOST}:{COMFY_PORT}"
 COMFY_WS_URL = f"ws://{COMFY_HOST}:{COMFY_PORT}/ws"
 
+# 多個 ComfyUI 實例 (逗號分隔 host:port，預設只有 COMFY_HOST:COMFY_PORT)
+# 只有 COMFY_HOST:COMFY_PORT 與 Worker 共用 input / output 目錄，其餘實例以 HTTP 傳送檔案
+COMFY_ENGINES = [
+    e.strip() for e in (os.getenv("COMFY_ENGINES") or f"{COMFY_HOST}:{COMFY_PORT}").split(",") if e.strip()
+]
+# 每個實例視為常駐 (VRAM / RAM 中) 的最近使用權重檔數量，用於模型親和路由
+ENGINE_RESIDENT_MODELS = int(os.getenv("ENGINE_RESIDENT_MODELS", "8"))
+
 # ComfyUI 資料夾路徑
 COMFYUI_INPUT_DIR = Path(os.getenv(
     "COMFYUI_INPUT_DIR",
@@ -57,13 +66,66 @@ COMFYUI_INPUT_DIR.mkdir(parents=True, exist_ok=True)
 STORAGE_MODELS_DIR = STORAGE_DIR / "models"
 STORAGE_MODELS_DIR.mkdir(parents=True, exist_ok=True)
 
+# 輸入檔案傳送方式：
+#   filesystem - 直接寫入 COMFYUI_INPUT_DIR (Worker 與 ComfyUI 共用磁碟/Volume)
+#   http       - 經 ComfyUI /upload/image 上傳 (Worker 可部署在不同主機)
+#                ComfyUI 沒有刪除 input 檔案的 API：上傳的檔案不會被 Worker 清理，須由 ComfyUI 主機定期清理
+INPUT_TRANSPORT = os.getenv("INPUT_TRANSPORT", "filesystem").lower()
+
 # Worker 特定配置
 TEMP_FILE_MAX_AGE_HOURS = int(os.getenv("TEMP_FILE_MAX_AGE_HOURS", "1"))
 
+# 輸入圖片快取 (COMFYUI_INPUT_DIR/in_<sha256>.png) 容量上限，超出時 LRU 淘汰空閒檔案
+INPUT_CACHE_MAX_MB = int(os.getenv("INPUT_CACHE_MAX_MB", "2048"))
+INPUT_CACHE_MAX_FILES = int(os.getenv("INPUT_CACHE_MAX_FILES", "500"))
+
+# 輸入圖片正規化：最長邊上限 (0 = 不縮小；Qwen 系列 workflow 本身會縮放到約 1MP)
+# 與 PNG 壓縮等級 (1 = 快速，9 = 最小檔案)
+INPUT_MAX_SIDE = int(os.getenv("INPUT_MAX_SIDE", "2048"))
+INPUT_PNG_COMPRESS_LEVEL = int(os.getenv("INPUT_PNG_COMPRESS_LEVEL", "1"))
+
 # Phase 9: Reliability - 延長超時配置
 WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", "2400"))  # 預設 40 分鐘
 COMFY_POLLING_INTERVAL = float(os.getenv("COMFY_POLLING_INTERVAL", "0.5"))
 
+# 自適應執行逾時：歷史 p95 × 倍數，下限 ADAPTIVE_TIMEOUT_MIN 秒，上限 WORKER_TIMEOUT
+# (樣本不足時直接使用 WORKER_TIMEOUT)
+ADAPTIVE_TIMEOUT_FACTOR = float(os.getenv("ADAPTIVE_TIMEOUT_FACTOR", "3"))
+ADAPTIVE_TIMEOUT_MIN = float(os.getenv("ADAPTIVE_TIMEOUT_MIN", "300"))
+
+# 並行執行窗口：同一個 Worker 同時送進每個 ComfyUI 實例佇列的最大任務數
+# 設為 1 即回到舊的「一次一個任務」行為
+WORKER_MAX_INFLIGHT = max(1, int(os.getenv("WORKER_MAX_INFLIGHT", "2")))
+
+# 微批次：相容的任務 (同 workflow / 模型 / 比例，且無輸入圖片) 在 BATCH_WINDOW 秒內最多
+# BATCH_MAX_SIZE 個合併為單一 ComfyUI prompt (設為 1 即停用)
+BATCH_MAX_SIZE = max(1, int(os.getenv("BATCH_MAX_SIZE", "4")))
+BATCH_WINDOW = float(os.getenv("BATCH_WINDOW", "0.3"))
+BATCH_WORKFLOWS = {
+    w.strip() for w in os.getenv("BATCH_WORKFLOWS", "text_to_image").split(",") if w.strip()
+}
+
+# 結果快取：固定 seed 任務的輸出保留時間 (秒，命中時續期) 與項目上限 (LRU 淘汰)；任一為 0 即停用
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+
+# 可靠佇列：Worker 識別、心跳逾時 (即任務可見性逾時) 與最大投遞次數
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+WORKER_HEARTBEAT_TTL = int(os.getenv("WORKER_HEARTBEAT_TTL", "30"))
+JOB_MAX_DELIVERIES = int(os.getenv("JOB_MAX_DELIVERIES", "3"))
+
+# 進度更新節流：最短間隔 (秒) 與最小進度變化 (百分點)
+PROGRESS_UPDATE_INTERVAL = float(os.getenv("PROGRESS_UPDATE_INTERVAL", "0.25"))
+PROGRESS_UPDATE_MIN_DELTA = int(os.getenv("PROGRESS_UPDATE_MIN_DELTA", "1"))
+
+# MySQL 狀態寫回：待寫入任務數上限、寫入間隔 (秒) 與每批筆數
+DB_WRITER_MAX_PENDING = int(os.getenv("DB_WRITER_MAX_PENDING", "1000"))
+DB_WRITER_FLUSH_INTERVAL = float(os.getenv("DB_WRITER_FLUSH_INTERVAL", "1.0"))
+DB_WRITER_BATCH_SIZE = int(os.getenv("DB_WRITER_BATCH_SIZE", "200"))
+
+# Prometheus /metrics 埠號 (0 表示停用)
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9101"))
+
 # ==========================================
 # 除錯輸出
 # ==========================================
@@ -75,10 +137,18 @@ def print_config():
     print(f"  PROJECT_ROOT: {PROJECT_ROOT}")
     print(f"  REDIS: {REDIS_HOST}:{REDIS_PORT}")
     print(f"  COMFY: {COMFY_HOST}:{COMFY_PORT}")
+    print(f"  COMFY_ENGINES: {', '.join(COMFY_ENGINES)}")
     print(f"  COMFYUI_INPUT_DIR: {COMFYUI_INPUT_DIR}")
     print(f"  COMFYUI_OUTPUT_DIR: {COMFYUI_OUTPUT_DIR}")
+    print(f"  INPUT_TRANSPORT: {INPUT_TRANSPORT}")
+    print(f"  INPUT_CACHE: {INPUT_CACHE_MAX_MB} MB / {INPUT_CACHE_MAX_FILES} files")
     print(f"  STORAGE_OUTPUT_DIR: {STORAGE_OUTPUT_DIR}")
     print(f"  WORKFLOW_DIR: {WORKFLOW_DIR}")
+    print(f"  WORKER_MAX_INFLIGHT: {WORKER_MAX_INFLIGHT}")
+    print(f"  RESULT_CACHE: ttl {RESULT_CACHE_TTL}s / {RESULT_CACHE_MAX_ENTRIES} entries")
+    print(f"  BATCH: {BATCH_MAX_SIZE} jobs / {BATCH_WINDOW}s ({', '.join(sorted(BATCH_WORKFLOWS))})")
+    print(f"  WORKER_ID: {WORKER_ID}")
+    print(f"  WORKER_METRICS_PORT: {WORKER_METRICS_PORT}")
     print("=" * 50)
 
 
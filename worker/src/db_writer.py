@@ -0,0 +1,178 @@
+"""
+Job Status DB Writer
+====================
+Worker 的 MySQL 狀態寫回 (write-behind)：
+- update_job_status 只把 (job_id, status) 放進記憶體，立即返回，不在任務執行緒中取連線 / commit
+- 同一任務的多次變更在寫入前合併，只寫最後狀態；終態不會被之後的非終態覆蓋
+- 背景執行緒每 flush_interval 秒 (或累積達 batch_size 筆) 以單一交易批次寫入
+- 待寫入任務數上限 max_pending：滿時丟棄最舊的非終態更新 (終態之後仍會寫入)
+- MySQL 失敗時保留資料並指數退避重試；close() 會在關閉前盡量寫完
+
+Redis 仍是任務狀態的即時來源，MySQL 只作為歷史紀錄，允許延遲數秒。
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from shared.job_status import TERMINAL_STATUSES
+from shared.metrics import DB_WRITE_PENDING, DB_WRITES_DROPPED
+
+logger = logging.getLogger("worker")
+
+
+class JobStatusWriter:
+    """
+    使用範例:
+        writer = JobStatusWriter(db_client, max_pending=1000, flush_interval=1.0)
+        writer.start()
+        writer.submit(job_id, "finished")
+        ...
+        writer.close(timeout=10)
+    """
+
+    def __init__(
+        self,
+        db_client,
+        max_pending: int = 1000,
+        flush_interval: float = 1.0,
+        batch_size: int = 200,
+        max_backoff: float = 30.0
+    ):
+        self.db = db_client
+        self.max_pending = max(1, max_pending)
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.max_backoff = max_backoff
+
+        self._pending = OrderedDict()   # job_id -> status，最早進入的在前
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        DB_WRITE_PENDING.set_function(lambda: len(self._pending))
+
+    # ==========================================
+    # 生命週期
+    # ==========================================
+
+    def start(self) -> None:
+        """啟動背景寫入執行緒 (重複呼叫無作用)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """
+        停止背景執行緒並寫完剩餘資料
+
+        Returns:
+            是否已全部寫入 (MySQL 無法使用時為 False，剩餘更新會被捨棄)
+        """
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+        deadline = time.monotonic() + timeout
+        while self.pending_count():
+            if not self.flush() and time.monotonic() >= deadline:
+                break
+        remaining = self.pending_count()
+        if remaining:
+            logger.warning(f"⚠️ MySQL 狀態寫回未完成，捨棄 {remaining} 筆更新")
+            return False
+        return True
+
+    # ==========================================
+    # 提交
+    # ==========================================
+
+    def submit(self, job_id: str, status: str) -> None:
+        """登記任務狀態變更 (不阻塞)"""
+        with self._lock:
+            current = self._pending.get(job_id)
+            if current in TERMINAL_STATUSES and status not in TERMINAL_STATUSES:
+                return
+            if current is None and len(self._pending) >= self.max_pending:
+                self._drop_one()
+            self._pending[job_id] = status
+            full_batch = len(self._pending) >= self.batch_size
+        if full_batch or status in TERMINAL_STATUSES:
+            self._wakeup.set()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    # ==========================================
+    # 寫入
+    # ==========================================
+
+    def flush(self) -> bool:
+        """
+        寫入一批待寫入的狀態
+
+        Returns:
+            是否成功 (沒有資料也視為成功)
+        """
+        with self._lock:
+            if not self._pending:
+                return True
+            batch = OrderedDict()
+            while self._pending and len(batch) < self.batch_size:
+                job_id, status = self._pending.popitem(last=False)
+                batch[job_id] = status
+
+        try:
+            ok = self.db.update_job_statuses(dict(batch))
+        except Exception as e:
+            logger.error(f"❌ MySQL 狀態批次寫入錯誤: {e}")
+            ok = False
+
+        if ok:
+            logger.info(f"✓ MySQL 狀態同步: {len(batch)} 筆")
+            return True
+
+        # 失敗：放回佇列前端，期間已有較新狀態的任務以新狀態為準
+        with self._lock:
+            for job_id, status in reversed(batch.items()):
+                if job_id in self._pending:
+                    continue
+                self._pending[job_id] = status
+                self._pending.move_to_end(job_id, last=False)
+            while len(self._pending) > self.max_pending:
+                self._drop_one()
+        return False
+
+    def _drop_one(self) -> None:
+        """丟棄最舊的一筆非終態更新 (全部都是終態時丟棄最舊的一筆)；呼叫端須持有鎖"""
+        victim = next(
+            (job_id for job_id, status in self._pending.items() if status not in TERMINAL_STATUSES),
+            next(iter(self._pending))
+        )
+        status = self._pending.pop(victim)
+        DB_WRITES_DROPPED.inc()
+        logger.warning(f"⚠️ MySQL 寫入佇列已滿，丟棄狀態更新: {victim} -> {status}")
+
+    def _run(self) -> None:
+        backoff = self.flush_interval
+        while not self._stop.is_set():
+            self._wakeup.wait(backoff)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
+
+            ok = True
+            while ok and self.pending_count() and not self._stop.is_set():
+                ok = self.flush()
+
+            if ok:
+                backoff = self.flush_interval
+            else:
+                backoff = min(max(backoff, 1.0) * 2, self.max_backoff)
+                logger.warning(f"⚠️ MySQL 狀態寫回失敗，{backoff:.0f}s 後重試 (待寫入 {self.pending_count()} 筆)")
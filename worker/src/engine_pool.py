@@ -0,0 +1,208 @@
+"""
+ComfyUI Engine Pool
+===================
+多個 ComfyUI 實例 (COMFY_ENGINES) 的連線池與模型親和路由：
+- 每個 engine 一個 ComfyClient (各自一條 WebSocket 事件流)，並行上限 max_inflight
+- 追蹤每個 engine 最近載入的模型權重檔 (Redis engine:resident:<engine>，多個 Worker 共用)
+- 任務優先分派到已載入其所需模型的 engine，其次才是負載最低者；
+  text_to_image → face_swap → virtual_human 交錯時，不必每次切換都重新載入數 GB 權重
+
+ComfyUI 沒有查詢已載入模型的 API，常駐集合以「最近使用的 resident_slots 個權重檔」近似
+(VRAM 不足時 ComfyUI 會卸載較早的模型，與 LRU 行為一致)。
+"""
+
+import time
+import logging
+import threading
+from typing import Iterable, List, Optional
+
+from comfy_client import ComfyClient
+from shared.metrics import ENGINE_ROUTES
+
+logger = logging.getLogger("worker")
+
+RESIDENT_KEY = "engine:resident:{engine}"
+
+
+class Engine:
+    """單一 ComfyUI 實例與其本地狀態"""
+
+    def __init__(self, name: str, client: ComfyClient, max_inflight: int):
+        self.name = name
+        self.client = client
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.last_assigned = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self.inflight < self.max_inflight
+
+
+class EnginePool:
+    """
+    使用範例:
+        pool = EnginePool(["127.0.0.1:8188", "10.0.0.2:8188"], r, max_inflight=2)
+        pool.start()
+        engine = pool.acquire(models)
+        try:
+            process_job(r, engine.client, job_data)
+        finally:
+            pool.release(engine)
+    """
+
+    def __init__(
+        self,
+        endpoints: Iterable[str],
+        r=None,
+        max_inflight: int = 1,
+        resident_slots: int = 8,
+        local_endpoint: str = None
+    ):
+        """
+        Args:
+            endpoints: "host:port" 列表
+            r: Redis 客戶端 (可選，用於多個 Worker 共用常駐模型狀態)
+            max_inflight: 每個 engine 同時送入的最大任務數
+            resident_slots: 每個 engine 視為常駐的權重檔數量
+            local_endpoint: 與 Worker 共用磁碟的 engine (其餘 engine 一律以 HTTP 傳送輸入 / 輸出)
+        """
+        self.r = r
+        self.resident_slots = resident_slots
+        self.engines: List[Engine] = []
+        self._resident = {}  # engine name -> {model: last_used}，Redis 不可用時使用
+        self._cond = threading.Condition()
+
+        for endpoint in dict.fromkeys(e.strip() for e in endpoints if e.strip()):
+            host, _, port = endpoint.rpartition(":")
+            client = ComfyClient(host, int(port), local_files=(endpoint == local_endpoint))
+            self.engines.append(Engine(endpoint, client, max_inflight))
+            self._resident[endpoint] = {}
+        if not self.engines:
+            raise ValueError("COMFY_ENGINES 至少需要一個 ComfyUI 端點")
+
+    @property
+    def capacity(self) -> int:
+        return sum(engine.max_inflight for engine in self.engines)
+
+    # ==========================================
+    # 生命週期
+    # ==========================================
+
+    def start(self, wait: float = 0) -> int:
+        """開啟所有 engine 的事件流，返回已連線數"""
+        connected = 0
+        for engine in self.engines:
+            if engine.client.start_event_stream(wait=wait):
+                connected += 1
+        return connected
+
+    def check_connection(self) -> bool:
+        """至少一個 engine 可連線"""
+        return any(engine.client.check_connection(retry=0) for engine in self.engines)
+
+    def close(self) -> None:
+        for engine in self.engines:
+            engine.client.close()
+
+    # ==========================================
+    # 路由
+    # ==========================================
+
+    def acquire(self, models: Iterable[str] = (), timeout: float = None) -> Optional[Engine]:
+        """
+        選出執行任務的 engine 並佔用一個槽位
+
+        排序：常駐模型命中數 (多者優先) → 進行中任務數 (少者優先) → 最久未分派者優先
+
+        Returns:
+            Engine；timeout 內沒有空閒槽位時返回 None
+        """
+        models = frozenset(models)
+        resident = self._load_resident() if models else {}
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                candidates = [engine for engine in self.engines if engine.available]
+                if candidates:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+            def score(engine: Engine):
+                hits = len(models & resident.get(engine.name, set()))
+                return (-hits, engine.inflight, engine.last_assigned)
+
+            engine = min(candidates, key=score)
+            hits = len(models & resident.get(engine.name, set()))
+            engine.inflight += 1
+            engine.last_assigned = time.monotonic()
+
+        if models:
+            affinity = "hit" if hits == len(models) else ("partial" if hits else "miss")
+            logger.info(f"🎯 分派到 engine {engine.name} (常駐模型命中 {hits}/{len(models)})")
+            self._mark_resident(engine, models)
+        else:
+            affinity = "none"
+        ENGINE_ROUTES.labels(engine=engine.name, affinity=affinity).inc()
+        return engine
+
+    def release(self, engine: Engine) -> None:
+        with self._cond:
+            engine.inflight = max(0, engine.inflight - 1)
+            self._cond.notify()
+
+    def stats(self) -> list:
+        resident = self._load_resident()
+        return [
+            {
+                "engine": engine.name,
+                "inflight": engine.inflight,
+                "connected": engine.client.events.connected,
+                "resident_models": sorted(resident.get(engine.name, ())),
+            }
+            for engine in self.engines
+        ]
+
+    # ==========================================
+    # 常駐模型狀態
+    # ==========================================
+
+    def _load_resident(self) -> dict:
+        """engine name -> 常駐模型集合"""
+        if self.r is not None:
+            try:
+                pipe = self.r.pipeline(transaction=False)
+                for engine in self.engines:
+                    pipe.zrange(RESIDENT_KEY.format(engine=engine.name), 0, -1)
+                return {
+                    engine.name: set(models)
+                    for engine, models in zip(self.engines, pipe.execute())
+                }
+            except Exception as e:
+                logger.warning(f"⚠️ 讀取 engine 常駐模型失敗 (改用本地狀態): {e}")
+        with self._cond:
+            return {name: set(models) for name, models in self._resident.items()}
+
+    def _mark_resident(self, engine: Engine, models: frozenset) -> None:
+        """任務分派後其模型即視為常駐 (保留最近使用的 resident_slots 個)"""
+        now = time.time()
+        with self._cond:
+            local = self._resident[engine.name]
+            for model in models:
+                local[model] = now
+            for model in sorted(local, key=local.get)[:-self.resident_slots]:
+                del local[model]
+
+        if self.r is not None:
+            key = RESIDENT_KEY.format(engine=engine.name)
+            try:
+                pipe = self.r.pipeline(transaction=False)
+                pipe.zadd(key, {model: now for model in models})
+                pipe.zremrangebyrank(key, 0, -self.resident_slots - 1)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"⚠️ 更新 engine 常駐模型失敗: {e}")
@@ -0,0 +1,99 @@
+"""
+Input Image Normalization
+=========================
+把使用者上傳的圖片正規化為 ComfyUI LoadImage 可直接讀取的 8-bit RGB PNG：
+- 已經是 8-bit RGB、非交錯且尺寸未超限的 PNG：只檢查 IHDR，原樣通過 (不解碼)
+- 超大圖片：JPEG 以 Image.draft 在解碼階段直接縮小 (DCT scaling)，再縮放到最長邊上限
+- PNG 編碼使用快速壓縮等級，不使用 optimize=True
+"""
+
+import io
+import struct
+import logging
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger("worker")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# IHDR color type 2 = Truecolor (RGB)
+_PNG_COLOR_RGB = 2
+
+
+def png_passthrough_ok(data: bytes, max_side: int = 0) -> bool:
+    """
+    判斷資料是否為可原樣使用的 PNG (8-bit RGB、非交錯、尺寸未超限)
+
+    只讀取檔頭 33 bytes，不解碼像素。
+    """
+    if len(data) < 33 or not data.startswith(PNG_SIGNATURE):
+        return False
+    # IHDR 必須是第一個 chunk: length(4) type(4) width height depth color compress filter interlace
+    length, chunk_type = struct.unpack(">I4s", data[8:16])
+    if chunk_type != b"IHDR" or length != 13:
+        return False
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", data[16:29])
+    if bit_depth != 8 or color_type != _PNG_COLOR_RGB or interlace != 0:
+        return False
+    if max_side and max(width, height) > max_side:
+        return False
+    return width > 0 and height > 0
+
+
+def normalize_image(data: bytes, max_side: int = 0, compress_level: int = 1) -> bytes:
+    """
+    將上傳圖片正規化為 8-bit RGB PNG
+
+    Args:
+        data: 原始圖片位元組 (JPEG / PNG / WebP / AVIF ...)
+        max_side: 最長邊上限 (0 表示不限制)
+        compress_level: PNG zlib 壓縮等級 (0-9，1 為快速)
+
+    Returns:
+        PNG 位元組
+
+    Raises:
+        ValueError: 圖片無法解碼
+    """
+    if png_passthrough_ok(data, max_side):
+        logger.info(f"📷 RGB PNG 原樣使用 ({len(data)} bytes)")
+        return data
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        original_format, original_size = img.format, img.size
+
+        oversized = max_side and max(img.size) > max_side
+
+        # 超大 JPEG：解碼時直接以 1/2、1/4、1/8 縮小 (結果仍不小於目標尺寸)
+        if oversized and img.format == "JPEG":
+            ratio = max_side / max(img.size)
+            img.draft("RGB", (int(img.width * ratio), int(img.height * ratio)))
+
+        # 手機照片的方向資訊只存在 EXIF，轉成 PNG 前先套用
+        img = ImageOps.exif_transpose(img)
+
+        # 仍超過上限：先整數倍 reduce 再雙線性縮放到最長邊 = max_side
+        if oversized and max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+
+        # 轉換為 RGB（透明背景以白色填滿）
+        if img.mode in ("RGBA", "LA", "P", "PA"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG", compress_level=compress_level)
+    except Exception as e:
+        raise ValueError(f"圖片格式轉換失敗: {e}")
+
+    png_bytes = buffer.getvalue()
+    logger.info(
+        f"✅ 已轉換為 PNG: {original_format} {original_size} -> {img.size}, "
+        f"{len(png_bytes)} bytes"
+    )
+    return png_bytes
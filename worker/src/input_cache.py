@@ -0,0 +1,282 @@
+"""
+Input Image Cache
+=================
+ComfyUI input 目錄中的內容定址輸入圖片快取：
+- 以原始上傳內容的 SHA-256 作為鍵，正規化後的 PNG 存為 in_<sha256>.png
+- 同一張圖片重複提交時只需一次雜湊 + 查表，不再重新解碼 / 編碼 / 寫檔
+  (檔名固定也讓 ComfyUI 自身的 LoadImage 快取得以命中)
+- 以引用計數保護本 Worker 執行中任務使用的檔案，空閒檔案依 LRU 淘汰
+- 引用計數只在單一程序內有效：共用同一 input 目錄的其他 Worker 取用時會更新 mtime，
+  mtime 在 min_idle 秒 (WORKER_TIMEOUT，即任務最長執行時間) 內的檔案一律不淘汰
+- Worker 啟動時掃描目錄重建索引 (取代舊的 mtime 定時清理)
+"""
+
+import os
+import time
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+logger = logging.getLogger("worker")
+
+CACHE_FILE_PREFIX = "in_"
+CACHE_FILE_SUFFIX = ".png"
+# 舊版每個任務各自寫入的暫存檔 (upload_<job_id>_<field>.png)
+LEGACY_FILE_PATTERN = "upload_*.png"
+
+
+class _Entry:
+    __slots__ = ("filename", "size", "refs", "last_used")
+
+    def __init__(self, filename: str, size: int, refs: int = 0, last_used: float = None):
+        self.filename = filename
+        self.size = size
+        self.refs = refs
+        self.last_used = last_used if last_used is not None else time.time()
+
+
+class InputCache:
+    """
+    引用計數 + LRU 的輸入圖片快取
+
+    使用範例:
+        cache = InputCache(COMFYUI_INPUT_DIR, max_bytes=2 << 30, max_files=500, min_idle=WORKER_TIMEOUT)
+        cache.scan()
+        filename = cache.acquire(digest, lambda: normalize(raw_bytes))
+        ...  # ComfyUI 執行任務
+        cache.release(filename)
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, max_files: int, min_idle: float = 0):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.min_idle = min_idle
+
+        self._entries = OrderedDict()   # digest -> _Entry (最舊的在前)
+        self._by_filename = {}          # filename -> digest
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        # 命中統計 (監控用)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def filename_for(digest: str) -> str:
+        return f"{CACHE_FILE_PREFIX}{digest}{CACHE_FILE_SUFFIX}"
+
+    # ==========================================
+    # 取得 / 釋放
+    # ==========================================
+
+    def acquire(self, digest: str, produce: Callable[[], bytes]) -> str:
+        """
+        取得 digest 對應的輸入檔並增加引用計數
+
+        Args:
+            digest: 原始上傳內容的 SHA-256
+            produce: 快取未命中時呼叫，返回正規化後的 PNG 位元組
+
+        Returns:
+            ComfyUI input 目錄中的檔名
+        """
+        filename = self.filename_for(digest)
+        path = self.directory / filename
+
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and path.exists():
+                entry.refs += 1
+                self._touch(digest, entry, path)
+                self.hits += 1
+                logger.info(f"♻️ 輸入圖片快取命中: {filename}")
+                return filename
+            if entry is not None:
+                # 檔案已被外部刪除，索引失效
+                self._drop(digest)
+
+        # 未命中：在鎖外做正規化與寫檔 (同一內容並行寫入時結果相同，os.replace 為原子操作)
+        data = produce()
+        self._write_atomic(path, data)
+
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                entry = _Entry(filename, len(data))
+                self._entries[digest] = entry
+                self._by_filename[filename] = digest
+                self._total_bytes += entry.size
+            entry.refs += 1
+            self._touch(digest, entry, path)
+            self.misses += 1
+            self._evict_locked()
+
+        return filename
+
+    def release(self, filename: str) -> None:
+        """任務結束後釋放引用，並視需要淘汰空閒檔案"""
+        with self._lock:
+            digest = self._by_filename.get(filename)
+            if digest is None:
+                return
+            entry = self._entries[digest]
+            entry.refs = max(0, entry.refs - 1)
+            self._evict_locked()
+
+    # ==========================================
+    # 啟動掃描 / 淘汰
+    # ==========================================
+
+    def scan(self, legacy_max_age_hours: float = None) -> int:
+        """
+        掃描目錄重建索引 (引用計數皆為 0，依 mtime 排列 LRU 順序)
+
+        Args:
+            legacy_max_age_hours: 同時刪除超過此時間的舊版 upload_*.png 暫存檔
+
+        Returns:
+            索引中的檔案數
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        found = []
+        for path in self.directory.glob(f"{CACHE_FILE_PREFIX}*{CACHE_FILE_SUFFIX}"):
+            digest = path.name[len(CACHE_FILE_PREFIX):-len(CACHE_FILE_SUFFIX)]
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime, digest, path.name, stat.st_size))
+        found.sort()
+
+        with self._lock:
+            for mtime, digest, filename, size in found:
+                if digest in self._entries:
+                    continue
+                self._entries[digest] = _Entry(filename, size, last_used=mtime)
+                self._by_filename[filename] = digest
+                self._total_bytes += size
+            evicted = self._evict_locked()
+            count = len(self._entries)
+
+        if legacy_max_age_hours is not None:
+            self._remove_legacy(legacy_max_age_hours)
+
+        logger.info(
+            f"🗂️ 輸入圖片快取: {count} 個檔案, "
+            f"{self._total_bytes / (1024 * 1024):.1f} MB (淘汰 {evicted} 個)"
+        )
+        return count
+
+    def evict(self) -> int:
+        """依容量上限淘汰空閒檔案，返回刪除數"""
+        with self._lock:
+            return self._evict_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": self._total_bytes,
+                "in_use": sum(1 for e in self._entries.values() if e.refs > 0),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    # ==========================================
+    # 內部
+    # ==========================================
+
+    def _touch(self, digest: str, entry: _Entry, path: Path) -> None:
+        entry.last_used = time.time()
+        self._entries.move_to_end(digest)
+        # 更新 mtime：共用同一 input 目錄的其他 Worker 淘汰前會檢查
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _drop(self, digest: str) -> None:
+        entry = self._entries.pop(digest)
+        self._by_filename.pop(entry.filename, None)
+        self._total_bytes -= entry.size
+
+    def _evict_locked(self) -> int:
+        """
+        淘汰最久未使用的空閒檔案直到符合容量上限
+
+        所有檔案都在使用中或未閒置滿 min_idle 秒時允許暫時超出上限。
+        """
+        evicted = 0
+        now = time.time()
+        for digest in list(self._entries.keys()):
+            if (self._total_bytes <= self.max_bytes
+                    and len(self._entries) <= self.max_files):
+                break
+
+            entry = self._entries[digest]
+            if entry.refs > 0:
+                continue
+
+            path = self.directory / entry.filename
+            try:
+                mtime = path.stat().st_mtime
+            except FileNotFoundError:
+                self._drop(digest)
+                continue
+            except OSError:
+                continue
+
+            # 其他 Worker 近期使用過 (mtime 比本地記錄新)：視為最近使用，不淘汰
+            if mtime > entry.last_used + 1:
+                entry.last_used = mtime
+                self._entries.move_to_end(digest)
+                continue
+            # 閒置未滿 min_idle：其他 Worker 的任務可能仍在讀取 (本地引用計數看不到)
+            if now - mtime < self.min_idle:
+                continue
+
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"⚠️ 無法刪除快取圖片 {entry.filename}: {e}")
+                continue
+            self._drop(digest)
+            evicted += 1
+
+        if evicted:
+            logger.info(f"🗑️ 輸入圖片快取淘汰 {evicted} 個檔案")
+        return evicted
+
+    def _write_atomic(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp_", suffix=CACHE_FILE_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _remove_legacy(self, max_age_hours: float) -> None:
+        cutoff = time.time() - max_age_hours * 3600
+        deleted = 0
+        for path in self.directory.glob(LEGACY_FILE_PATTERN):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    deleted += 1
+            except OSError as e:
+                logger.warning(f"⚠️ 無法刪除 {path}: {e}")
+        if deleted:
+            logger.info(f"🗑️ 已清理 {deleted} 個舊版暫存檔案")
@@ -3,13 +3,20 @@ JSON Parser for ComfyUI Workflow
 ================================
 動態解析並修改 ComfyUI workflow JSON 檔案。
 支援 Aspect Ratio、Model、Prompt、Seed 等參數注入。
+
+模板與 config.json 由 workflow_registry 快取 (mtime 失效)，
+每個任務只淺複製模板並以 copy-on-write 修改用到的節點。
 """
 
 import json
 import os
 import copy
+from collections import deque
 from pathlib import Path
 
+from workflow_registry import registry, WorkflowTemplate
+from workflow_graph import WorkflowGraph, is_link
+
 # ==========================================
 # Aspect Ratio 映射表 (SDXL 最佳解析度)
 # ==========================================
@@ -99,6 +106,35 @@ IMAGE_NODE_MAP = {
     },
 }
 
+# ==========================================
+# 輸出節點映射表 (Fallback)
+# ==========================================
+# 優先使用 config.json mapping.output_node_id；
+# 此映射用於 config.json 以其他名稱登記的 workflow (如 multi_blend / image_edit)
+OUTPUT_NODE_MAP = {
+    "text_to_image": "34",
+    "face_swap": "503",
+    "multi_image_blend": "60",
+    "single_image_edit": "119",
+    "sketch_to_image": "119",
+    "virtual_human": "131",
+    "veo3_long_video": "110",
+    "image_to_video": "110",
+    "t2v_veo3": "110",
+    "flf_veo3": "110",
+}
+
+# ==========================================
+# 裁剪規則 (prune_workflow)
+# ==========================================
+# 可選輸入：上游節點被移除時只斷開這條連線，不移除使用它的節點
+OPTIONAL_INPUTS = {
+    "TextEncodeQwenImageEditPlus": {"image1", "image2", "image3"},
+    "VeoVideoGenerator": {"trigger"},  # 串接前一段的觸發訊號
+}
+# 批次節點：輸入被移除時收縮；只剩一個輸入時由該輸入直接取代
+BATCH_NODE_CLASSES = {"ImageBatch"}
+
 # ==========================================
 # 音訊節點映射表 (用於 virtual_human 等工作流)
 # ==========================================
@@ -115,57 +151,37 @@ def get_workflow_path(workflow_name: str) -> Path:
     取得 workflow JSON 檔案路徑
     優先從 config.json 讀取，若不存在則使用 WORKFLOW_MAP
     """
-    from config import WORKFLOW_DIR, WORKFLOW_CONFIG_PATH
-    import json
-    
-    # 嘗試從 config.json 讀取文件名
-    if WORKFLOW_CONFIG_PATH.exists():
-        try:
-            with open(WORKFLOW_CONFIG_PATH, 'r', encoding='utf-8') as f:
-                config_data = json.load(f)
-            
-            workflow_config = config_data.get(workflow_name, {})
-            if 'file' in workflow_config:
-                filename = workflow_config['file']
-                print(f"[Parser] 從 config.json 讀取 workflow 文件: {filename}")
-                return WORKFLOW_DIR / filename
-        except Exception as e:
-            print(f"[Parser] ⚠️ 讀取 config.json 失敗: {e}")
-    
-    # Fallback: 使用 WORKFLOW_MAP
-    filename = WORKFLOW_MAP.get(workflow_name, f"{workflow_name}.json")
-    return WORKFLOW_DIR / filename
+    return registry.get_path(workflow_name, WORKFLOW_MAP)
 
 
 def load_workflow(workflow_name: str) -> dict:
     """
-    載入 workflow JSON 模板
+    載入 workflow JSON 模板 (返回可自由修改的深複製)
     """
-    workflow_path = get_workflow_path(workflow_name)
-    
-    if not workflow_path.exists():
-        raise FileNotFoundError(f"Workflow 檔案不存在: {workflow_path}")
-    
-    with open(workflow_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return copy.deepcopy(registry.get(workflow_name, WORKFLOW_MAP).workflow)
 
 
-def find_node_by_class(workflow: dict, class_type: str) -> tuple:
+def find_node_by_class(workflow, class_type: str) -> tuple:
     """
-    根據 class_type 找到節點
+    根據 class_type 找到節點 (傳入 WorkflowGraph 時直接查索引)
     Returns: (node_id, node_data) or (None, None)
     """
+    if isinstance(workflow, WorkflowGraph):
+        node_id = workflow.first_of_class(class_type)
+        return (node_id, workflow.nodes[node_id]) if node_id else (None, None)
     for node_id, node_data in workflow.items():
         if isinstance(node_data, dict) and node_data.get("class_type") == class_type:
             return node_id, node_data
     return None, None
 
 
-def find_nodes_by_class(workflow: dict, class_type: str) -> list:
+def find_nodes_by_class(workflow, class_type: str) -> list:
     """
-    找到所有符合 class_type 的節點
+    找到所有符合 class_type 的節點 (傳入 WorkflowGraph 時直接查索引)
     Returns: [(node_id, node_data), ...]
     """
+    if isinstance(workflow, WorkflowGraph):
+        return [(node_id, workflow.nodes[node_id]) for node_id in workflow.nodes_of_class(class_type)]
     nodes = []
     for node_id, node_data in workflow.items():
         if isinstance(node_data, dict) and node_data.get("class_type") == class_type:
@@ -173,119 +189,263 @@ def find_nodes_by_class(workflow: dict, class_type: str) -> list:
     return nodes
 
 
-def trim_veo3_workflow(workflow: dict, image_files: dict) -> dict:
+# 模型權重檔副檔名 (用於模型親和路由：判斷任務會載入哪些權重)
+MODEL_FILE_EXTENSIONS = (".safetensors", ".gguf", ".ckpt", ".pt", ".pth", ".bin", ".onnx")
+
+
+def workflow_models(workflow: dict) -> set:
+    """列出 workflow 節點 inputs 中引用的模型權重檔"""
+    models = set()
+    for node_data in workflow.values():
+        if not isinstance(node_data, dict):
+            continue
+        for value in node_data.get("inputs", {}).values():
+            if isinstance(value, str) and value.lower().endswith(MODEL_FILE_EXTENSIONS):
+                models.add(value)
+    return models
+
+
+def required_models(workflow_name: str, model: str = "turbo_fp8") -> frozenset:
     """
-    根據實際上傳的圖片數量，動態裁剪 Veo3 Long Video 工作流
+    任務執行時 ComfyUI 需要載入的模型權重檔 (模板引用的權重，套用 MODEL_MAP 替換後)
+
+    只讀取快取的模板，不建立任務工作流；Veo3 等雲端 workflow 返回空集合。
+    """
+    template = registry.get(workflow_name, WORKFLOW_MAP)
+    models = workflow_models(template.workflow)
+    model_filename = MODEL_MAP.get(model)
+    if model_filename:
+        for node_ids, input_key in ((template.plan.unet, "unet_name"), (template.plan.checkpoint, "ckpt_name")):
+            if node_ids:
+                models.discard(template.workflow[node_ids[0]]["inputs"].get(input_key))
+                models.add(model_filename)
+    return frozenset(models)
+
+
+def _writable(workflow: dict, node_id: str, template: WorkflowTemplate = None) -> dict:
+    """取得可修改的節點 (有模板時 copy-on-write，否則直接返回)"""
+    if template is not None:
+        return template.writable_node(workflow, node_id)
+    return workflow[node_id]
+
+
+def image_node_map(workflow_name: str, image_map_config: dict = None) -> dict:
+    """
+    取得圖片欄位與 LoadImage 節點的對應 {field_name: node_id}
+    優先使用 config.json 的 image_map，否則使用 IMAGE_NODE_MAP
+    """
+    if image_map_config:
+        return dict(image_map_config)
+    return {field: node_id for node_id, field in IMAGE_NODE_MAP.get(workflow_name, {}).items()}
+
+
+def missing_image_nodes(node_map: dict, image_files: dict) -> list:
+    """
+    列出沒有收到圖片的 LoadImage 節點
+    完全沒有上傳圖片時返回空清單 (保留模板預設圖片，維持舊行為)
+    """
+    if not image_files:
+        return []
+    return [node_id for field, node_id in node_map.items() if not image_files.get(field)]
+
+
+def prune_workflow(
+    workflow: dict,
+    output_node_id: str,
+    removed_inputs: list = (),
+    template: WorkflowTemplate = None,
+    graph: WorkflowGraph = None
+) -> dict:
+    """
+    通用的死分支裁剪
+    
+    1. 移除 removed_inputs (例如未上傳圖片的 LoadImage) 並向下游傳遞：
+       - 可選輸入 (OPTIONAL_INPUTS)：只斷開該連線
+       - 批次節點 (BATCH_NODE_CLASSES)：移除該輸入；只剩一個輸入時由它直接取代批次節點，
+         所有輸入都被移除時批次節點本身也移除
+       - 其他必要輸入：使用它的節點一併移除
+    2. 只保留從輸出節點往上游可到達的節點 (多餘的 SaveImage / Preview 不再執行)
     
-    Veo3 工作流結構 (每個 Shot 的節點):
-    - Shot 1: 節點 6 (LoadImage), 10 (VeoVideoGenerator), 11 (VHS_VideoCombine)
-    - Shot 2: 節點 20 (LoadImage), 21 (VeoVideoGenerator), 22 (VHS_VideoCombine)
-    - Shot 3: 節點 30 (LoadImage), 31 (VeoVideoGenerator), 32 (VHS_VideoCombine)
-    - Shot 4: 節點 40 (LoadImage), 41 (VeoVideoGenerator), 42 (VHS_VideoCombine)
-    - Shot 5: 節點 50 (LoadImage), 51 (VeoVideoGenerator), 52 (VHS_VideoCombine)
-    - ImageBatch 鏈: 100 -> 101 -> 102 -> 103 -> 110 (最終輸出)
+    輸出節點本身會被移除時放棄裁剪，返回原工作流。
+    必須在其他結構性修改之前呼叫 (graph 需與 workflow 結構一致)。
     
     Args:
-        workflow: 原始工作流
-        image_files: 圖片檔案映射 {"shot_0": "xxx.png", "shot_1": "yyy.png", ...}
+        workflow: 任務工作流
+        output_node_id: config.json 的 output_node_id
+        removed_inputs: 要移除的節點 ID
+        template: 工作流與模板共用節點時傳入，修改節點前先複製 (copy-on-write)
+        graph: 與 workflow 結構一致的索引 (預設使用 template.graph)
     
     Returns:
         裁剪後的工作流
     """
-    # 確定有哪些 shots
-    valid_shots = []
-    for i in range(5):
-        shot_key = f"shot_{i}"
-        if shot_key in image_files and image_files[shot_key]:
-            valid_shots.append(i)
-    
-    shot_count = len(valid_shots)
-    print(f"[Parser] Veo3 動態裁剪: 偵測到 {shot_count} 個有效 shots: {valid_shots}")
-    
-    if shot_count == 0:
-        print("[Parser] ⚠️ 沒有有效的圖片，返回原始工作流")
+    if not output_node_id or output_node_id not in workflow:
         return workflow
+    if graph is None:
+        graph = template.graph if template is not None else WorkflowGraph(workflow)
+    
+    # 1. 傳遞移除
+    removed = {node_id for node_id in removed_inputs if node_id in workflow}
+    dropped = {}  # node_id -> {斷開的 input 名稱}
+    pending = deque(removed)
+    while pending:
+        node_id = pending.popleft()
+        for dst, name, _ in graph.consumers_of(node_id):
+            if dst in removed or dst not in workflow:
+                continue
+            class_type = graph.class_of(dst)
+            if name in OPTIONAL_INPUTS.get(class_type, ()) or class_type in BATCH_NODE_CLASSES:
+                dropped.setdefault(dst, set()).add(name)
+                if class_type not in BATCH_NODE_CLASSES:
+                    continue
+                if any(src_name not in dropped[dst] for src_name, _, _ in graph.inputs_of(dst)):
+                    continue
+            removed.add(dst)
+            pending.append(dst)
     
-    if shot_count == 5:
-        print("[Parser] 所有 5 個 shots 都有圖片，不需要裁剪")
+    if output_node_id in removed:
+        print(f"[Parser] ⚠️ 缺少的輸入會移除輸出節點 {output_node_id}，略過裁剪")
         return workflow
     
-    # Shot 節點映射 (對應 Veo3_VideoConnection.json)
-    # 注意：此 workflow 沒有獨立的 VHS_VideoCombine 節點，只有最終輸出節點 110
-    shot_nodes = {
-        0: {"load": "6", "gen": "10"},   # Shot 1
-        1: {"load": "20", "gen": "21"},  # Shot 2
-        2: {"load": "30", "gen": "31"},  # Shot 3
-        3: {"load": "40", "gen": "41"},  # Shot 4
-        4: {"load": "50", "gen": "51"},  # Shot 5
-    }
+    for node_id in removed:
+        del workflow[node_id]
+    
+    # 斷開可選輸入；只剩一個輸入的批次節點記錄為別名
+    alias = {}  # 批次節點 ID -> 取代它的連線 [node_id, slot]
+    for node_id, names in dropped.items():
+        if node_id in removed:
+            continue
+        node = _writable(workflow, node_id, template)
+        for name in names:
+            node["inputs"].pop(name, None)
+            print(f"[Parser] ✂️ 斷開 Node {node_id}.{name}")
+        if graph.class_of(node_id) in BATCH_NODE_CLASSES:
+            remaining = [value for value in node["inputs"].values() if is_link(value)]
+            if len(remaining) == 1:
+                alias[node_id] = remaining[0]
+    
+    # 重新接線：使用批次節點的下游改接到最終來源 (處理批次鏈)
+    def resolve(link: list) -> list:
+        while link[0] in alias:
+            link = alias[link[0]]
+        return list(link)
+    
+    for batch_id in alias:
+        for dst, name, _ in graph.consumers_of(batch_id):
+            if dst in workflow and dst not in alias:
+                node = _writable(workflow, dst, template)
+                node["inputs"][name] = resolve(node["inputs"][name])
+                print(f"[Parser] 🔗 Node {dst}.{name} 改接到 {node['inputs'][name][0]} (收縮批次節點 {batch_id})")
+    for batch_id in alias:
+        del workflow[batch_id]
+    
+    # 2. 只保留輸出節點的上游
+    if removed or alias:
+        graph = WorkflowGraph(workflow)
+    reachable = graph.ancestors([output_node_id])
+    unreachable = [node_id for node_id in workflow if node_id not in reachable]
+    for node_id in unreachable:
+        del workflow[node_id]
+    
+    if removed or alias or unreachable:
+        print(f"[Parser] ✂️ 工作流裁剪: 移除 {len(removed)} 個缺少輸入的節點、"
+              f"收縮 {len(alias)} 個批次節點、移除 {len(unreachable)} 個不影響輸出的節點 "
+              f"(剩餘 {len(workflow)} 個)")
+    return workflow
+
+
+def trim_veo3_workflow(workflow: dict, image_files: dict, template: WorkflowTemplate = None) -> dict:
+    """
+    根據實際上傳的圖片數量，動態裁剪 Veo3 Long Video 工作流
     
-    # 刪除沒有圖片的 Shot 節點
-    nodes_to_remove = []
-    for i in range(5):
-        if i not in valid_shots:
-            nodes = shot_nodes[i]
-            nodes_to_remove.extend([nodes["load"], nodes["gen"]])
-            print(f"[Parser] 移除 Shot {i+1} 節點: {nodes}")
-    
-    for node_id in nodes_to_remove:
-        if node_id in workflow:
-            del workflow[node_id]
-    
-    # 重建 ImageBatch 鏈 (只連接有效的 shots)
-    # 原始鏈: 100(10+21) -> 101(100+31) -> 102(101+41) -> 103(102+51) -> 110
-    
-    # 移除原有的 ImageBatch 節點
-    for node_id in ["100", "101", "102", "103"]:
-        if node_id in workflow:
-            del workflow[node_id]
-    
-    # 獲取有效 shots 的 generator 節點 ID (輸出影片幀)
-    valid_gen_nodes = [shot_nodes[i]["gen"] for i in valid_shots]
-    print(f"[Parser] 有效的 generator 節點: {valid_gen_nodes}")
-    
-    if shot_count == 1:
-        # 只有一個 shot，直接連接到最終輸出
-        if "110" in workflow:
-            workflow["110"]["inputs"]["images"] = [valid_gen_nodes[0], 0]
-            print(f"[Parser] 單一 shot 模式: 節點 110 直接連接到 {valid_gen_nodes[0]}")
-    else:
-        # 多個 shots，重建 ImageBatch 鏈
-        # 使用節點 ID 100, 101, 102... 來建立鏈
-        batch_node_id = 100
-        
-        # 第一個 batch: 連接前兩個 generator
-        workflow[str(batch_node_id)] = {
-            "inputs": {
-                "image1": [valid_gen_nodes[0], 0],
-                "image2": [valid_gen_nodes[1], 0]
-            },
-            "class_type": "ImageBatch",
-            "_meta": {"title": "Batch Images (Dynamic)"}
+    沒有圖片的 Shot (LoadImage + VeoVideoGenerator) 會被移除，
+    ImageBatch 鏈自動收縮，後續 Shot 的 trigger 連線斷開 (見 prune_workflow)。
+    
+    Args:
+        workflow: 原始工作流
+        image_files: 圖片檔案映射 {"shot_0": "xxx.png", "shot_1": "yyy.png", ...}
+        template: 工作流與模板共用節點時傳入，修改節點前先複製 (copy-on-write)
+    
+    Returns:
+        裁剪後的工作流
+    """
+    node_map = image_node_map("veo3_long_video")
+    valid_shots = [field for field in sorted(node_map) if image_files.get(field)]
+    print(f"[Parser] Veo3 動態裁剪: 偵測到 {len(valid_shots)} 個有效 shots: {valid_shots}")
+    
+    return prune_workflow(
+        workflow,
+        output_node_id=OUTPUT_NODE_MAP["veo3_long_video"],
+        removed_inputs=missing_image_nodes(node_map, image_files),
+        template=template
+    )
+
+
+def has_seed_injection(workflow_name: str) -> bool:
+    """workflow 是否有注入任務 seed 的取樣節點 (固定 seed 時輸出可重現，可使用結果快取)"""
+    return bool(registry.get(workflow_name, WORKFLOW_MAP).plan.seed)
+
+
+# ==========================================
+# 微批次 (多個任務合併為單一 ComfyUI prompt)
+# ==========================================
+BATCH_NODE_PREFIX = "b{index}_"
+
+
+def merge_workflows(workflows: list) -> dict:
+    """
+    將多個已注入參數的 workflow 合併為一張圖
+
+    - 各任務的節點 ID 加上前綴 b<i>_，連線一併改寫
+    - 類型與輸入 (含改寫後的連線) 完全相同、且有下游的節點只保留一份：
+      模型 / CLIP / VAE 載入與相同的負向提示等只執行一次，各任務的取樣分支各自保留
+    - 沒有下游的節點 (SaveImage / PreviewImage 等輸出) 一律保留，用於依前綴分配輸出
+
+    Returns:
+        合併後的 workflow (不修改傳入的 workflow)
+    """
+    merged = {}
+    shared = {}  # (class_type, inputs) 簽章 -> 合併後節點 ID
+
+    for index, workflow in enumerate(workflows):
+        prefix = BATCH_NODE_PREFIX.format(index=index)
+        consumed = {
+            value[0]
+            for node_data in workflow.values()
+            for value in node_data.get("inputs", {}).values()
+            if is_link(value)
         }
-        print(f"[Parser] 建立 ImageBatch {batch_node_id}: {valid_gen_nodes[0]} + {valid_gen_nodes[1]}")
-        
-        # 後續的 batch: 連接前一個 batch 和下一個 generator
-        for i in range(2, shot_count):
-            prev_batch_id = str(batch_node_id)
-            batch_node_id += 1
-            
-            workflow[str(batch_node_id)] = {
-                "inputs": {
-                    "image1": [prev_batch_id, 0],
-                    "image2": [valid_gen_nodes[i], 0]
-                },
-                "class_type": "ImageBatch",
-                "_meta": {"title": f"Batch Images (Dynamic {i})"}
+        placed = {}  # 原節點 ID -> 合併後節點 ID
+
+        def place(node_id: str) -> str:
+            if node_id in placed:
+                return placed[node_id]
+            node_data = workflow[node_id]
+            inputs = {
+                key: [place(value[0]), value[1]] if is_link(value) and value[0] in workflow else value
+                for key, value in node_data.get("inputs", {}).items()
             }
-            print(f"[Parser] 建立 ImageBatch {batch_node_id}: {prev_batch_id} + {valid_gen_nodes[i]}")
-        
-        # 最終輸出節點連接到最後一個 batch
-        if "110" in workflow:
-            workflow["110"]["inputs"]["images"] = [str(batch_node_id), 0]
-            print(f"[Parser] 節點 110 連接到最後的 ImageBatch: {batch_node_id}")
-    
-    return workflow
+            new_id = prefix + node_id
+            if node_id in consumed:
+                signature = json.dumps([node_data.get("class_type"), inputs], sort_keys=True)
+                new_id = shared.setdefault(signature, new_id)
+            if new_id not in merged:
+                merged[new_id] = dict(node_data, inputs=inputs)
+            placed[node_id] = new_id
+            return new_id
+
+        for node_id in workflow:
+            place(node_id)
+
+    return merged
+
+
+def batch_index(node_id) -> int:
+    """由合併後的節點 ID 取得所屬任務的索引 (非批次節點返回 None)"""
+    if not isinstance(node_id, str) or not node_id.startswith("b"):
+        return None
+    index, sep, _ = node_id[1:].partition("_")
+    return int(index) if sep and index.isdigit() else None
 
 
 def parse_workflow(
@@ -303,44 +463,53 @@ def parse_workflow(
     """
     解析並注入參數到 workflow
     優先從 config.json 讀取映射規則 (Config-Driven)
+    
+    節點 ID 由模板的注入計畫 (InjectionPlan) 預先解析，
+    此處只對淺複製的工作流做 copy-on-write 修改。
     """
     # ==========================================
-    # 1. 初始化變數與引入 Config (優先定義)
+    # 1. 初始化變數
     # ==========================================
-    from config import WORKFLOW_CONFIG_PATH
-    config_path = WORKFLOW_CONFIG_PATH  # 確保變數在最開始就被定義
-    
     if image_files is None:
         image_files = {}
     if prompts is None:
         prompts = []
     
-    # 載入原始 workflow
-    workflow = load_workflow(workflow_name)
-    workflow = copy.deepcopy(workflow)  # 避免修改原始資料
-    
     # ==========================================
-    # 2. 載入 Config.json 配置 (Config-Driven)
+    # 2. 取得快取的模板、Config 與注入計畫 (Config-Driven)
     # ==========================================
-    config_data = {}
-    workflow_config = {}
-    image_map_config = {}
-    
-    try:
-        if config_path.exists():
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config_data = json.load(f)
-            workflow_config = config_data.get(workflow_name, {})
-            image_map_config = workflow_config.get('image_map', {})
-            print(f"[Parser] 成功載入 config.json for {workflow_name}")
-            if image_map_config:
-                print(f"[Parser] 偵測到 image_map 配置: {image_map_config}")
-    except Exception as e:
-        print(f"[Parser] ⚠️ 讀取 config.json 失敗，將使用 Fallback: {e}")
-    
-    # Veo3 Long Video 特殊處理：根據圖片數量動態裁剪工作流
-    if workflow_name == "veo3_long_video":
-        workflow = trim_veo3_workflow(workflow, image_files)
+    template = registry.get(workflow_name, WORKFLOW_MAP)
+    workflow = template.instantiate()  # 淺複製，修改節點時才複製 (避免修改模板)
+    plan = template.plan
+    workflow_config = template.config
+    image_map_config = plan.image_map
+    
+    def writable(node_id: str) -> dict:
+        return template.writable_node(workflow, node_id)
+    
+    def first_present(candidates: list):
+        for candidate in candidates:
+            node_id = candidate[0] if isinstance(candidate, tuple) else candidate
+            if node_id in workflow:
+                return candidate
+        return None
+    
+    if image_map_config:
+        print(f"[Parser] 偵測到 image_map 配置: {image_map_config}")
+    
+    # 裁剪死分支：移除未上傳圖片的 LoadImage 及其分支，只保留輸出節點的上游
+    # (Veo3 Long Video 依圖片數量移除 Shot 並收縮 ImageBatch 鏈)
+    output_node_id = (
+        workflow_config.get('mapping', {}).get('output_node_id')
+        or OUTPUT_NODE_MAP.get(workflow_name)
+    )
+    if output_node_id:
+        workflow = prune_workflow(
+            workflow,
+            output_node_id,
+            removed_inputs=missing_image_nodes(image_node_map(workflow_name, image_map_config), image_files),
+            template=template
+        )
     
     # 取得解析度
     resolution = ASPECT_RATIO_MAP.get(aspect_ratio, DEFAULT_RESOLUTION)
@@ -359,197 +528,96 @@ def parse_workflow(
     # 從 config.json 讀取 text_node_id，注入到 inputs.text
     # ==========================================
     if workflow_name == "virtual_human" and prompt:
-        text_node_id = workflow_config.get('mapping', {}).get('text_node_id')
-        if text_node_id and text_node_id in workflow:
-            node = workflow[text_node_id]
-            if 'inputs' in node and 'text' in node['inputs']:
-                node['inputs']['text'] = prompt
+        if plan.tts_text and plan.tts_text[0] in workflow:
+            text_node_id, source = plan.tts_text
+            writable(text_node_id)['inputs']['text'] = prompt
+            if source == "config":
                 print(f"[Parser] 🎤 virtual_human: 注入台詞到 Node {text_node_id} (IndexTTS2BaseNode)")
                 print(f"[Parser] 📝 台詞內容: {prompt[:100] if len(prompt) > 100 else prompt}...")
             else:
-                print(f"[Parser] ⚠️ Node {text_node_id} 沒有 inputs.text 欄位")
-        else:
-            # Fallback: 直接查找 IndexTTS2BaseNode
-            tts_nodes = find_nodes_by_class(workflow, "IndexTTS2BaseNode")
-            if tts_nodes:
-                node_id, node = tts_nodes[0]
-                if 'inputs' in node and 'text' in node['inputs']:
-                    node['inputs']['text'] = prompt
-                    print(f"[Parser] 🎤 virtual_human: 注入台詞到 IndexTTS2BaseNode 節點 {node_id} (fallback)")
+                print(f"[Parser] 🎤 virtual_human: 注入台詞到 IndexTTS2BaseNode 節點 {text_node_id} (fallback)")
+        elif plan.tts_warning:
+            print(f"[Parser] ⚠️ {plan.tts_warning}")
     
     # ==========================================
     # 注入 Prompt (支援多種節點類型)
+    # 候選依序為 CLIPTextEncode → StringConstantMultiline →
+    # TextEncodeQwenImageEditPlus → Veo3 節點 → config prompt_node_id
     # ==========================================
-    prompt_injected = False
-    
-    # 1. 嘗試 CLIPTextEncode (標準 SDXL workflow)
-    positive_nodes = find_nodes_by_class(workflow, "CLIPTextEncode")
-    for node_id, node in positive_nodes:
-        title = node.get("_meta", {}).get("title", "")
-        if "Positive" in title or "positive" in title.lower():
-            node["inputs"]["text"] = prompt
-            print(f"[Parser] 注入 Prompt 到 CLIPTextEncode 節點 {node_id}")
-            prompt_injected = True
-            break
+    target = first_present(plan.prompt)
+    if target:
+        node_id, input_key, source = target
+        writable(node_id)["inputs"][input_key] = prompt
+        print(f"[Parser] 注入 Prompt 到 {source} 節點 {node_id}")
     else:
-        # 如果沒找到標題，嘗試第一個 CLIPTextEncode
-        if positive_nodes:
-            positive_nodes[0][1]["inputs"]["text"] = prompt
-            print(f"[Parser] 注入 Prompt 到第一個 CLIPTextEncode 節點")
-            prompt_injected = True
-    
-    # 2. 嘗試 StringConstantMultiline (用於 face_swap 等需要用戶輸入的 workflow)
-    # 注意：不要注入到 title 包含 "Trigger" 或 "trigger" 的節點，那些是預設內容
-    if not prompt_injected:
-        string_nodes = find_nodes_by_class(workflow, "StringConstantMultiline")
-        for node_id, node in string_nodes:
-            title = node.get("_meta", {}).get("title", "").lower()
-            # 跳過包含 trigger 的節點（那是預設固定的 prompt）
-            if "trigger" not in title:
-                if "inputs" in node and "string" in node["inputs"]:
-                    node["inputs"]["string"] = prompt
-                    print(f"[Parser] 注入 Prompt 到 StringConstantMultiline 節點 {node_id} (title: {node.get('_meta', {}).get('title', '')})")
-                    prompt_injected = True
-                    break
-    
-    # 3. 嘗試 TextEncodeQwenImageEditPlus (Qwen Image Edit workflow)
-    if not prompt_injected:
-        qwen_nodes = find_nodes_by_class(workflow, "TextEncodeQwenImageEditPlus")
-        for node_id, node in qwen_nodes:
-            title = node.get("_meta", {}).get("title", "").lower()
-            # 只注入到 Positive 節點 (通常 Negative 節點的 prompt 為空)
-            if "negative" not in title:
-                if "inputs" in node and "prompt" in node["inputs"]:
-                    node["inputs"]["prompt"] = prompt
-                    print(f"[Parser] 注入 Prompt 到 TextEncodeQwenImageEditPlus 節點 {node_id}")
-                    prompt_injected = True
-                    break
-        
-        if not prompt_injected and qwen_nodes:
-            # 如果找不到明確的 Positive，嘗試第一個有 prompt 輸入的節點
-            for node_id, node in qwen_nodes:
-                if "inputs" in node and "prompt" in node["inputs"]:
-                    # 檢查這個節點的 prompt 是否不為空 (表示是 Positive)
-                    if node["inputs"]["prompt"] or node["inputs"]["prompt"] == "":
-                        node["inputs"]["prompt"] = prompt
-                        print(f"[Parser] 注入 Prompt 到 TextEncodeQwenImageEditPlus 節點 {node_id} (fallback)")
-                        prompt_injected = True
-                        break
-    
-    # 4. 嘗試 VeoVideoGenerator / Veo3StartEndVideoGenerator (Veo3 Video workflows)
-    if not prompt_injected:
-        veo_classes = ["VeoVideoGenerator", "Veo3StartEndVideoGenerator"]
-        for veo_class in veo_classes:
-            veo_nodes = find_nodes_by_class(workflow, veo_class)
-            for node_id, node in veo_nodes:
-                if "inputs" in node and "prompt" in node["inputs"]:
-                    node["inputs"]["prompt"] = prompt
-                    print(f"[Parser] 注入 Prompt 到 {veo_class} 節點 {node_id}")
-                    prompt_injected = True
-                    break
-            if prompt_injected:
-                break
-    
-    # 5. 從 config.json 讀取 prompt_node_id 直接注入 (T2V/FLF 專用)
-    if not prompt_injected and config_path.exists():
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config_data = json.load(f)
-        workflow_config = config_data.get(workflow_name, {})
-        mapping = workflow_config.get('mapping', {})
-        prompt_node_id = mapping.get('prompt_node_id')
-        
-        if prompt_node_id and prompt_node_id in workflow:
-            node = workflow[prompt_node_id]
-            if 'inputs' in node and 'prompt' in node['inputs']:
-                node['inputs']['prompt'] = prompt
-                print(f"[Parser] 從 config 注入 Prompt 到 Node {prompt_node_id}")
-                prompt_injected = True
-    
-    if not prompt_injected:
         print(f"[Parser] ⚠️ 未找到可注入 Prompt 的節點")
     
     # ==========================================
     # Veo3 Long Video: 注入多段 Prompts (Strategy B)
     # 關鍵：迭代 Config 的 prompt_segments，而非用戶輸入
     # ==========================================
-    # 檢查 workflow_name 是否有 prompt_segments 配置
-    # from config import WORKFLOW_CONFIG_PATH
-    # import json
-    
-    # config_path = WORKFLOW_CONFIG_PATH
-    if config_path.exists():
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config_data = json.load(f)
-        
-        workflow_config = config_data.get(workflow_name, {})
-        mapping = workflow_config.get('mapping', {})
-        prompt_segments_config = mapping.get('prompt_segments', {})
+    if plan.prompt_segments:
+        print(f"[Parser] 檢測到 prompt_segments 配置，開始注入 {len(plan.prompt_segments)} 個片段...")
         
-        if prompt_segments_config:
-            print(f"[Parser] 檢測到 prompt_segments 配置，開始注入 {len(prompt_segments_config)} 個片段...")
+        # Strategy B: 迭代 Config 定義的 segments
+        injected_count = 0
+        skipped_count = 0
+        for segment_index, node_id_str in plan.prompt_segments:
+            # 優先檢查節點是否仍存在於工作流中（可能已被動態裁剪刪除）
+            if node_id_str not in workflow:
+                print(f"[Parser] ⏭️ 跳過已刪除的節點 {node_id_str} (segment {segment_index})")
+                skipped_count += 1
+                continue
             
-            # Strategy B: 迭代 Config 定義的 segments
-            injected_count = 0
-            skipped_count = 0
-            for segment_index_str, node_id_str in prompt_segments_config.items():
-                segment_index = int(segment_index_str)
-                
-                # 優先檢查節點是否仍存在於工作流中（可能已被動態裁剪刪除）
-                if node_id_str not in workflow:
-                    print(f"[Parser] ⏭️ 跳過已刪除的節點 {node_id_str} (segment {segment_index})")
-                    skipped_count += 1
-                    continue
-                
-                # 檢查用戶是否提供了該 segment 的 prompt
-                if segment_index < len(prompts) and prompts[segment_index]:
-                    user_prompt = prompts[segment_index]
-                else:
-                    # 用戶未提供或留空，使用空字串
-                    user_prompt = ""
-                
-                print(f"[Parser] Segment {segment_index}: Node {node_id_str} = '{user_prompt[:40] if user_prompt else '(empty)'}...'")
-                
-                # 注入到對應節點
-                node = workflow[node_id_str]
-                
-                # 優先嘗試 inputs.prompt（ComfyUI API 格式）
-                if 'inputs' in node and isinstance(node['inputs'], dict):
-                    if 'prompt' in node['inputs']:
-                        node['inputs']['prompt'] = user_prompt
-                        print(f"[Parser] ✓ 已注入到 Node {node_id_str}.inputs.prompt")
-                        injected_count += 1
-                
-                # 嘗試 widgets_values (舊版格式)
-                elif 'widgets_values' in node:
-                    if isinstance(node['widgets_values'], list) and len(node['widgets_values']) > 0:
-                        node['widgets_values'][0] = user_prompt
-                        injected_count += 1
-                    elif isinstance(node['widgets_values'], dict) and 'prompt' in node['widgets_values']:
-                        node['widgets_values']['prompt'] = user_prompt
-                        injected_count += 1
+            # 檢查用戶是否提供了該 segment 的 prompt
+            if segment_index < len(prompts) and prompts[segment_index]:
+                user_prompt = prompts[segment_index]
+            else:
+                # 用戶未提供或留空，使用空字串
+                user_prompt = ""
+            
+            print(f"[Parser] Segment {segment_index}: Node {node_id_str} = '{user_prompt[:40] if user_prompt else '(empty)'}...'")
             
-            print(f"[Parser] ✅ 完成 prompt segments 注入: {injected_count} 個成功, {skipped_count} 個跳過")
+            # 注入到對應節點
+            node = workflow[node_id_str]
+            
+            # 優先嘗試 inputs.prompt（ComfyUI API 格式）
+            if 'inputs' in node and isinstance(node['inputs'], dict):
+                if 'prompt' in node['inputs']:
+                    writable(node_id_str)['inputs']['prompt'] = user_prompt
+                    print(f"[Parser] ✓ 已注入到 Node {node_id_str}.inputs.prompt")
+                    injected_count += 1
+            
+            # 嘗試 widgets_values (舊版格式)
+            elif 'widgets_values' in node:
+                if isinstance(node['widgets_values'], list) and len(node['widgets_values']) > 0:
+                    writable(node_id_str)['widgets_values'][0] = user_prompt
+                    injected_count += 1
+                elif isinstance(node['widgets_values'], dict) and 'prompt' in node['widgets_values']:
+                    writable(node_id_str)['widgets_values']['prompt'] = user_prompt
+                    injected_count += 1
+        
+        print(f"[Parser] ✅ 完成 prompt segments 注入: {injected_count} 個成功, {skipped_count} 個跳過")
     
     # ==========================================
     # 注入 Seed (KSampler)
     # ==========================================
-    sampler_id, sampler_node = find_node_by_class(workflow, "KSampler")
-    if sampler_node:
-        sampler_node["inputs"]["seed"] = seed
+    sampler_id = first_present(plan.seed)
+    if sampler_id:
+        writable(sampler_id)["inputs"]["seed"] = seed
         print(f"[Parser] 注入 Seed 到 KSampler 節點 {sampler_id}")
     
     # ==========================================
     # 注入 Resolution (EmptySD3LatentImage / EmptyLatentImage)
     # ==========================================
-    latent_classes = ["EmptySD3LatentImage", "EmptyLatentImage"]
-    for class_type in latent_classes:
-        latent_id, latent_node = find_node_by_class(workflow, class_type)
-        if latent_node:
-            latent_node["inputs"]["width"] = width
-            latent_node["inputs"]["height"] = height
-            latent_node["inputs"]["batch_size"] = batch_size
-            print(f"[Parser] 注入解析度 {width}x{height} 到 {class_type} 節點 {latent_id}")
-            break
+    latent = first_present(plan.latent)
+    if latent:
+        latent_id, class_type = latent
+        latent_inputs = writable(latent_id)["inputs"]
+        latent_inputs["width"] = width
+        latent_inputs["height"] = height
+        latent_inputs["batch_size"] = batch_size
+        print(f"[Parser] 注入解析度 {width}x{height} 到 {class_type} 節點 {latent_id}")
     
     # ==========================================
     # 注入 Model (UNETLoader / CheckpointLoaderSimple)
@@ -558,15 +626,15 @@ def parse_workflow(
     
     if model_filename:
         # 嘗試 UNETLoader
-        unet_id, unet_node = find_node_by_class(workflow, "UNETLoader")
-        if unet_node:
-            unet_node["inputs"]["unet_name"] = model_filename
+        unet_id = first_present(plan.unet)
+        if unet_id:
+            writable(unet_id)["inputs"]["unet_name"] = model_filename
             print(f"[Parser] 注入模型 {model_filename} 到 UNETLoader 節點 {unet_id}")
         
         # 嘗試 CheckpointLoaderSimple
-        ckpt_id, ckpt_node = find_node_by_class(workflow, "CheckpointLoaderSimple")
-        if ckpt_node:
-            ckpt_node["inputs"]["ckpt_name"] = model_filename
+        ckpt_id = first_present(plan.checkpoint)
+        if ckpt_id:
+            writable(ckpt_id)["inputs"]["ckpt_name"] = model_filename
             print(f"[Parser] 注入模型 {model_filename} 到 CheckpointLoaderSimple 節點 {ckpt_id}")
     else:
         print(f"[Parser] ⚠️ 未知模型: {model}，使用 workflow 預設值")
@@ -583,8 +651,8 @@ def parse_workflow(
             if field_name in image_files:
                 filename = image_files[field_name]
                 if node_id in workflow:
-                    node = workflow[node_id]
-                    if "inputs" in node:
+                    if "inputs" in workflow[node_id]:
+                        node = writable(node_id)
                         old_image = node["inputs"].get("image", "")
                         node["inputs"]["image"] = filename
                         print(f"[Parser] ✅ Config Injection: Node {node_id} ({field_name}): {old_image!r} -> {filename!r}")
@@ -605,8 +673,8 @@ def parse_workflow(
                 if field_name in image_files:
                     filename = image_files[field_name]
                     if node_id in workflow:
-                        node = workflow[node_id]
-                        if "inputs" in node:
+                        if "inputs" in workflow[node_id]:
+                            node = writable(node_id)
                             old_image = node["inputs"].get("image", "")
                             node["inputs"]["image"] = filename
                             print(f"[Parser] ✅ Fallback 節點 {node_id}: {old_image!r} -> {filename!r}")
@@ -627,11 +695,11 @@ def parse_workflow(
     audio_injected = False
     
     # 優先策略: 從 config.json 讀取 audio_node_id
-    audio_node_id = workflow_config.get('mapping', {}).get('audio_node_id')
+    audio_node_id = plan.audio_node_id
     if audio_node_id and audio_file:
         if audio_node_id in workflow:
-            node = workflow[audio_node_id]
-            if "inputs" in node:
+            if "inputs" in workflow[audio_node_id]:
+                node = writable(audio_node_id)
                 old_audio = node["inputs"].get("audio", "")
                 node["inputs"]["audio"] = audio_file
                 print(f"[Parser] 🎵 Config: 音訊注入到 Node {audio_node_id}")
@@ -651,8 +719,8 @@ def parse_workflow(
             input_key = audio_config.get("input_key", "audio")
             
             if node_id and node_id in workflow:
-                node = workflow[node_id]
-                if "inputs" in node:
+                if "inputs" in workflow[node_id]:
+                    node = writable(node_id)
                     old_audio = node["inputs"].get(input_key, "")
                     node["inputs"][input_key] = audio_file
                     print(f"[Parser] 🎵 Fallback: Injecting audio file: {audio_file} into node {node_id}")
@@ -10,9 +10,12 @@ import json
 import time
 import redis
 import base64
+import hashlib
 import uuid
 import logging
 import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 from datetime import datetime, timedelta
@@ -26,6 +29,15 @@ sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 # Phase 8C: 使用新的結構化日誌系統
 # ==========================================
 from shared.utils import load_env, setup_logger, JobLogAdapter, get_redis_client
+from shared.blob_store import is_blob_ref, read_bytes as read_blob, cleanup_expired as cleanup_expired_blobs
+from shared.stage_timing import JobTimer
+from shared.job_status import set_job_status
+from shared.scheduler import pending_count
+from shared import runtime_stats
+from shared.metrics import (
+    JOBS_COMPLETED, QUEUE_DEPTH, WORKER_INFLIGHT, RESULT_CACHE_ENTRIES,
+    start_http_server as start_metrics_server
+)
 
 load_env()
 
@@ -35,125 +47,138 @@ logger.info("=" * 60)
 logger.info("Worker 日誌系統已啟動 (雙通道輸出)")
 logger.info("=" * 60)
 
-from json_parser import parse_workflow
+from json_parser import parse_workflow, required_models, merge_workflows, batch_index, has_seed_injection
 from comfy_client import ComfyClient
+from engine_pool import EnginePool
+from reliable_queue import ReliableQueue
+from input_cache import InputCache
+from db_writer import JobStatusWriter
+from cancel_watcher import CancelWatcher
+from result_cache import ResultCache, workflow_key, file_digest
+from image_normalize import normalize_image
 from config import (
     REDIS_HOST, REDIS_PORT, REDIS_PASSWORD,
     COMFYUI_INPUT_DIR, JOB_QUEUE, TEMP_FILE_MAX_AGE_HOURS,
     JOB_STATUS_EXPIRE_SECONDS, STORAGE_INPUT_DIR, print_config,
-    WORKER_TIMEOUT
+    WORKER_TIMEOUT, WORKER_MAX_INFLIGHT,
+    BATCH_MAX_SIZE, BATCH_WINDOW, BATCH_WORKFLOWS,
+    RESULT_CACHE_TTL, RESULT_CACHE_MAX_ENTRIES, STORAGE_OUTPUT_DIR,
+    COMFY_HOST, COMFY_PORT, COMFY_ENGINES, ENGINE_RESIDENT_MODELS,
+    WORKER_ID, WORKER_HEARTBEAT_TTL, JOB_MAX_DELIVERIES,
+    INPUT_CACHE_MAX_MB, INPUT_CACHE_MAX_FILES,
+    INPUT_MAX_SIDE, INPUT_PNG_COMPRESS_LEVEL, INPUT_TRANSPORT,
+    WORKER_METRICS_PORT,
+    DB_WRITER_MAX_PENDING, DB_WRITER_FLUSH_INTERVAL, DB_WRITER_BATCH_SIZE,
+    PROGRESS_UPDATE_INTERVAL, PROGRESS_UPDATE_MIN_DELTA,
+    ADAPTIVE_TIMEOUT_FACTOR, ADAPTIVE_TIMEOUT_MIN
 )
 from shared.config_base import (
-    DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+    DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME,
+    BLOB_MAX_AGE_HOURS
+)
+
+# 輸入圖片快取 (所有並行槽位共用，啟動時由 main() 掃描重建索引)
+input_cache = InputCache(
+    COMFYUI_INPUT_DIR,
+    max_bytes=INPUT_CACHE_MAX_MB * 1024 * 1024,
+    max_files=INPUT_CACHE_MAX_FILES,
+    min_idle=WORKER_TIMEOUT
 )
 
+# MySQL 狀態寫回 (資料庫連線成功後由 main() 建立；None 時退回同步寫入)
+db_writer = None
+
+# 取消訊號監看 (Redis 連線成功後由 main() 建立；None 時不監看取消)
+cancel_watcher = None
+
+# 固定 seed 任務的結果快取 (Redis 連線成功後由 main() 建立；None 時停用)
+result_cache = None
 
-def save_base64_image(base64_data: str, job_id: str, field_name: str) -> str:
+# 需要同步到 MySQL 的狀態 (進度更新只改 Redis；同一任務的變更由 db_writer 合併)
+DB_SYNC_STATUSES = ("processing", "finished", "failed")
+
+
+def load_image_input(image_input) -> bytes:
     """
-    將 base64 圖片保存到 ComfyUI input 目錄
+    取得上傳圖片的原始位元組
     
     Args:
-        base64_data: base64 編碼的圖片數據 (可能包含 data:image/xxx;base64, 前綴)
-        job_id: 任務 ID
-        field_name: 欄位名稱 (source, target, input 等)
+        image_input: blob 引用 {"blob": sha256, "size": n}，
+                     或舊格式的 base64 字串 (可能包含 data:image/xxx;base64, 前綴)
     
     Returns:
-        保存的檔名 (不含路徑，用於 ComfyUI 相對路徑參考)
+        圖片原始位元組
     """
-    import io
-    from PIL import Image
+    if is_blob_ref(image_input):
+        return read_blob(image_input)
     
+    base64_data = image_input
     # 移除 data:image/xxx;base64, 前綴（更嚴格的處理）
     if isinstance(base64_data, str) and "," in base64_data:
         base64_data = base64_data.split(",", 1)[1].strip()
     
     # 解碼 base64
     try:
-        image_bytes = base64.b64decode(base64_data)
+        return base64.b64decode(base64_data)
     except Exception as e:
         raise ValueError(f"Base64 解碼失敗: {e}")
-    
-    # 始終轉換為真正的 PNG 格式（解決格式不匹配問題）
-    # 原因：用戶上傳的圖片可能是 JPEG, AVIF, WebP 等格式，
-    #       如果直接保存為 .png 副檔名但內容是其他格式，
-    #       ComfyUI 的 LoadImage 節點可能無法正確識別
-    try:
-        img = Image.open(io.BytesIO(image_bytes))
-        original_format = img.format
-        logger.info(f"📷 原始圖片格式: {original_format}, 尺寸: {img.size}")
-        
-        # 轉換為 RGB（處理 RGBA 或其他色彩模式）
-        if img.mode in ('RGBA', 'LA', 'P'):
-            # 創建白色背景
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # 保存為真正的 PNG 格式
-        img_buffer = io.BytesIO()
-        img.save(img_buffer, format='PNG', optimize=True)
-        image_bytes = img_buffer.getvalue()
-        logger.info(f"✅ 已轉換為 PNG 格式，大小: {len(image_bytes)} bytes")
-        
-    except Exception as e:
-        raise ValueError(f"圖片格式轉換失敗: {e}")
 
+
+def uses_http_transport(client: ComfyClient) -> bool:
+    """輸入檔案是否須經 /upload/image 上傳 (http 模式，或該 ComfyUI 實例不與 Worker 共用磁碟)"""
+    return INPUT_TRANSPORT == "http" or not client.local_files
+
+
+def save_input_image(image_input, field_name: str, client: ComfyClient) -> str:
+    """
+    將上傳圖片放入 ComfyUI input 目錄 (檔名以內容雜湊決定: in_<sha256>.png)
     
-    # 生成唯一檔名（只用檔名，不用絕對路徑）
-    filename = f"upload_{job_id}_{field_name}.png"
-    filepath = Path(COMFYUI_INPUT_DIR) / filename
+    同一張圖片再次提交時只需查表：blob 引用本身即帶有 SHA-256，
+    舊格式 base64 則解碼後雜湊一次。
+    - filesystem 模式：經由本地內容定址快取寫入，呼叫端在任務結束後須以
+      input_cache.release(filename) 釋放引用
+    - http 模式 (或非本機 ComfyUI 實例)：ComfyUI 已有同名檔案時略過，否則正規化後經 /upload/image 上傳
     
-    # 確保目錄存在
-    filepath.parent.mkdir(parents=True, exist_ok=True)
+    Args:
+        image_input: blob 引用或 base64 字串 (見 load_image_input)
+        field_name: 欄位名稱 (source, target, input 等)
+        client: ComfyClient (http 模式上傳用)
     
-    # 寫入檔案
-    try:
-        with open(filepath, "wb") as f:
-            f.write(image_bytes)
-            f.flush()  # 確保寫入磁碟
-            os.fsync(f.fileno())  # 強制同步到磁碟
-        
-        logger.info(f"💾 已保存圖片: {filename} ({len(image_bytes)} bytes) 至 {filepath}")
-        
-        # 驗證檔案是否可讀（確保 ComfyUI 能讀取）
-        if not filepath.exists():
-            raise FileNotFoundError(f"檔案寫入後無法找到: {filepath}")
-        
-        file_size = filepath.stat().st_size
-        if file_size != len(image_bytes):
-            raise IOError(f"檔案大小不符，預期 {len(image_bytes)} bytes，實際 {file_size} bytes")
-        
-        # 嘗試重新開啟檔案驗證可讀性
-        try:
-            from PIL import Image
-            with Image.open(filepath) as test_img:
-                test_img.verify()
-            logger.info(f"✅ 檔案驗證成功: {filename}")
-        except Exception as verify_err:
-            logger.warning(f"⚠️ 檔案驗證警告: {verify_err}")
-        
-        # 添加短暫延遲，確保檔案系統完成所有 I/O 操作
-        time.sleep(0.1)
-        
-    except Exception as e:
-        logger.error(f"❌ 檔案寫入失敗: {e}")
-        raise
+    Returns:
+        檔名 (不含路徑，用於 ComfyUI 相對路徑參考)
+    """
+    if is_blob_ref(image_input):
+        digest = image_input["blob"]
+        load = lambda: read_blob(image_input)
+    else:
+        image_bytes = load_image_input(image_input)
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        load = lambda: image_bytes
+    
+    normalize = lambda: normalize_image(load(), INPUT_MAX_SIDE, INPUT_PNG_COMPRESS_LEVEL)
+    
+    if uses_http_transport(client):
+        filename = InputCache.filename_for(digest)
+        if not client.has_input(filename):
+            filename = client.upload_input(filename, data=normalize(), skip_existing=False)
+            if not filename:
+                raise IOError(f"上傳圖片到 ComfyUI 失敗: {field_name}")
+    else:
+        filename = input_cache.acquire(digest, normalize)
+    logger.info(f"💾 輸入圖片就緒: {field_name} -> {filename}")
     
     # 返回只有檔名（相對路徑），不返回絕對路徑
     return filename
 
 
-def copy_audio_to_comfyui(audio_filename: str, job_id: str) -> str:
+def copy_audio_to_comfyui(audio_filename: str, job_id: str, client: ComfyClient) -> str:
     """
-    將音訊檔案從 storage/inputs 複製到 ComfyUI input 目錄
+    將音訊檔案從 storage/inputs 複製 (或 http 模式下上傳) 到 ComfyUI input 目錄
     
     Args:
         audio_filename: 上傳的音訊檔名 (如 audio_1ba6e2ba-e8a.mp3)
         job_id: 任務 ID (用於生成唯一檔名)
+        client: ComfyClient (http 模式上傳用)
     
     Returns:
         複製後的檔名 (不含路徑)
@@ -169,6 +194,15 @@ def copy_audio_to_comfyui(audio_filename: str, job_id: str) -> str:
     # 保留原副檔名，生成新檔名
     file_ext = source_path.suffix.lower()
     new_filename = f"audio_{job_id}{file_ext}"
+    
+    if uses_http_transport(client):
+        # 檔名以任務 ID 決定，ComfyUI 不可能已有此檔：直接上傳，不先查詢
+        uploaded = client.upload_input(new_filename, path=source_path, skip_existing=False)
+        if not uploaded:
+            raise IOError(f"上傳音訊到 ComfyUI 失敗: {audio_filename}")
+        logger.info(f"🎵 已上傳音訊: {audio_filename} -> {uploaded} ({source_path.stat().st_size} bytes)")
+        return uploaded
+    
     dest_path = Path(COMFYUI_INPUT_DIR) / new_filename
     
     # 確保目錄存在
@@ -183,26 +217,17 @@ def copy_audio_to_comfyui(audio_filename: str, job_id: str) -> str:
 
 def cleanup_old_temp_files():
     """
-    清理超過指定時間的暫存圖片檔案
+    清理暫存檔案：淘汰超出容量的輸入圖片快取，並刪除過期的上傳 blob
     """
-    input_dir = Path(COMFYUI_INPUT_DIR)
-    if not input_dir.exists():
-        return
-    
-    cutoff_time = datetime.now() - timedelta(hours=TEMP_FILE_MAX_AGE_HOURS)
-    deleted_count = 0
-    
-    for filepath in input_dir.glob("upload_*.png"):
-        try:
-            file_mtime = datetime.fromtimestamp(filepath.stat().st_mtime)
-            if file_mtime < cutoff_time:
-                filepath.unlink()
-                deleted_count += 1
-        except Exception as e:
-            logger.warning(f"⚠️ 無法刪除 {filepath}: {e}")
+    input_cache.evict()
     
-    if deleted_count > 0:
-        logger.info(f"🗑️ 已清理 {deleted_count} 個過期暫存檔案")
+    # 清理過期的上傳 blob (Backend 提交任務時寫入)
+    try:
+        deleted_blobs = cleanup_expired_blobs(BLOB_MAX_AGE_HOURS)
+        if deleted_blobs > 0:
+            logger.info(f"🗑️ 已清理 {deleted_blobs} 個過期上傳 blob")
+    except Exception as e:
+        logger.warning(f"⚠️ 清理上傳 blob 失敗: {e}")
 
 
 def cleanup_old_output_files(db_client=None):
@@ -256,23 +281,25 @@ def cleanup_old_output_files(db_client=None):
             logger.info(f"📊 已同步軟刪除資料庫記錄: {db_synced} 筆")
 
 
-def worker_heartbeat(redis_client):
+def worker_heartbeat(rq: ReliableQueue):
     """
-    Worker 心跳線程 - 每 10 秒向 Redis 發送心跳信號
-    Backend 可通過檢查 'worker:heartbeat' 鍵來判斷 Worker 是否在線
+    Worker 心跳線程 - 每 10 秒向 Redis 發送心跳信號，並巡檢其他 Worker
+    
+    - 本 Worker 心跳鍵 (worker:heartbeat:<worker_id>) 過期即代表其處理中任務可被回收
+    - Backend 可通過檢查 'worker:heartbeat' 鍵來判斷是否有 Worker 在線
+    - 心跳過期的 Worker，其 processing 清單會被放回佇列前端
     
     Args:
-        redis_client: Redis 客戶端實例
+        rq: 本 Worker 的可靠佇列實例
     """
     while True:
         try:
-            # 設置心跳鍵，30 秒過期
-            redis_client.setex('worker:heartbeat', 30, 'alive')
+            rq.heartbeat()
             logger.debug("💓 Worker 心跳發送成功")
-            time.sleep(10)  # 每 10 秒發送一次
+            rq.reap()
         except Exception as e:
             logger.error(f"❌ Worker 心跳發送失敗: {e}")
-            time.sleep(10)
+        time.sleep(10)  # 每 10 秒發送一次
 
 
 def update_job_status(
@@ -282,10 +309,12 @@ def update_job_status(
     progress: int = 0,
     image_url: str = None,
     error: str = None,
-    db_client=None
+    db_client=None,
+    timer: JobTimer = None,
+    fields: dict = None
 ):
     """
-    更新任務狀態到 Redis 和 MySQL
+    更新任務狀態到 Redis 和 MySQL (已被使用者取消的任務不會被覆寫)
     
     Args:
         r: Redis 客戶端
@@ -295,42 +324,57 @@ def update_job_status(
         image_url: 輸出圖片 URL
         error: 錯誤訊息
         db_client: Database 客戶端 (可選，用於同步到 MySQL)
+        timer: 任務計時器 (可選，MySQL 同步耗時記為 db_sync 階段；
+               使用 db_writer 時只計入登記耗時，實際寫入在背景執行緒)
+        fields: 其他寫入狀態 Hash 的欄位 (可選)
+    
+    Returns:
+        是否已套用 (任務已取消時為 False)
     """
-    # 1. 更新 Redis
-    status_key = f"job:status:{job_id}"
-    data = {
-        "status": status,
-        "progress": progress
-    }
+    # 1. 更新 Redis (狀態 Hash 與狀態索引原子更新)
+    data = {"progress": progress}
     
     if image_url:
         data["image_url"] = image_url
     if error:
         data["error"] = error
+    if fields:
+        data.update(fields)
     
-    r.hset(status_key, mapping=data)
-    r.expire(status_key, JOB_STATUS_EXPIRE_SECONDS)
+    if set_job_status(r, job_id, status, data, ttl=JOB_STATUS_EXPIRE_SECONDS, unless=("cancelled",)) is None:
+        logger.info(f"🛑 任務已取消，略過狀態更新: {job_id} -> {status}")
+        return False
     logger.info(f"✓ Redis 狀態更新: {job_id} -> {status}")
     
-    # 2. 同步到 MySQL (如果可用且狀態為 finished 或 failed)
-    if db_client and status in ['finished', 'failed']:
-        try:
-            # 轉換 image_url 為 output_path (去除 /outputs/ 前綴)
-            output_path = None
-            if image_url:
-                output_path = image_url.replace('/outputs/', '')
-            
-            success = db_client.update_job_status(
-                job_id=job_id,
-                status=status,
-                output_path=output_path
-            )
-            if success:
-                logger.info(f"✓ MySQL 狀態同步: {job_id} -> {status}")
-            else:
-                logger.warning(f"⚠️ MySQL 狀態同步失敗: {job_id}")
-        except Exception as e:
-            logger.error(f"❌ MySQL 同步錯誤: {e}")
+    # 2. 同步到 MySQL (交由背景寫回，不阻塞任務執行緒)
+    if db_client and status in DB_SYNC_STATUSES:
+        with timer.span("db_sync") if timer else nullcontext():
+            if db_writer is not None:
+                db_writer.submit(job_id, status)
+            elif status != "processing":
+                _sync_job_status_to_db(db_client, job_id, status, image_url)
+    return True
+
+
+def _sync_job_status_to_db(db_client, job_id: str, status: str, image_url: str = None):
+    """同步終態到 MySQL (失敗只記錄日誌)"""
+    try:
+        # 轉換 image_url 為 output_path (去除 /outputs/ 前綴)
+        output_path = None
+        if image_url:
+            output_path = image_url.replace('/outputs/', '')
+        
+        success = db_client.update_job_status(
+            job_id=job_id,
+            status=status,
+            output_path=output_path
+        )
+        if success:
+            logger.info(f"✓ MySQL 狀態同步: {job_id} -> {status}")
+        else:
+            logger.warning(f"⚠️ MySQL 狀態同步失敗: {job_id}")
+    except Exception as e:
+        logger.error(f"❌ MySQL 同步錯誤: {e}")
 
 
 
@@ -348,8 +392,8 @@ def process_job(r: redis.Redis, client: ComfyClient, job_data: dict, db_client=N
         "aspect_ratio": "1:1",
         "batch_size": 1,
         "images": {
-            "source": "base64...",
-            "target": "base64..."
+            "source": {"blob": "sha256...", "size": 12345},
+            "target": {"blob": "sha256...", "size": 23456}
         }
     }
     """
@@ -365,9 +409,17 @@ def process_job(r: redis.Redis, client: ComfyClient, job_data: dict, db_client=N
     job_logger.info(f"🚀 開始處理任務")
     job_logger.info("="*50)
     
+    acquired_inputs = []  # 本任務持有的輸入圖片快取引用
+    # 取消訊號 (Backend 取消任務時經 Pub/Sub 推送)
+    cancelled = cancel_watcher.watch(job_id) if cancel_watcher else threading.Event()
+    # 各階段耗時 (佇列等待由 Backend 寫入的 created_at 計算)
+    timer = JobTimer(job_id, job_data.get("workflow", "text_to_image"), job_data.get("created_at"))
     try:
-        # 1. 更新狀態為處理中
-        update_job_status(r, job_id, "processing", progress=10, db_client=db_client)
+        # 1. 更新狀態為處理中 (排隊期間已被取消則直接結束)
+        if cancelled.is_set():
+            job_logger.warning("🛑 任務已在排隊中被取消，略過執行")
+            return
+        update_job_status(r, job_id, "processing", progress=10, db_client=db_client, timer=timer)
         
         # 2. 提取參數
         workflow_name = job_data.get("workflow", "text_to_image")
@@ -377,7 +429,7 @@ def process_job(r: redis.Redis, client: ComfyClient, job_data: dict, db_client=N
         aspect_ratio = job_data.get("aspect_ratio", "1:1")
         model = job_data.get("model", "turbo_fp8")
         batch_size = job_data.get("batch_size", 1)
-        images = job_data.get("images", {})  # base64 圖片字典
+        images = job_data.get("images", {})  # 圖片 blob 引用字典 (舊任務可能為 base64)
         
         job_logger.info(f"Workflow: {workflow_name}")
         job_logger.info(f"Prompt: {prompt[:50] if prompt else '(empty)'}...")
@@ -388,188 +440,122 @@ def process_job(r: redis.Redis, client: ComfyClient, job_data: dict, db_client=N
         job_logger.info(f"Batch Size: {batch_size}")
         job_logger.info(f"Images: {list(images.keys()) if images else 'None'}")
         
-        # 3. 處理上傳的圖片 (base64 -> 檔案)
-        update_job_status(r, job_id, "processing", progress=15, db_client=db_client)
+        # 3. 處理上傳的圖片 (blob -> 檔案)
+        update_job_status(r, job_id, "processing", progress=15, db_client=db_client, timer=timer)
         
-        image_files = {}  # 儲存檔名映射 {"source": "upload_xxx_source.png"}
-        if images:
-            job_logger.info(f"📷 開始處理 {len(images)} 張圖片...")
-            for field_name, base64_data in images.items():
-                if base64_data:
-                    try:
-                        filename = save_base64_image(base64_data, job_id, field_name)
-                        image_files[field_name] = filename
-                    except Exception as e:
-                        job_logger.warning(f"⚠️ 處理圖片 {field_name} 失敗: {e}")
+        with timer.span("input_prep"):
+            image_files = {}  # 儲存檔名映射 {"source": "in_<sha256>.png"}
+            if images:
+                job_logger.info(f"📷 開始處理 {len(images)} 張圖片...")
+                for field_name, image_input in images.items():
+                    if image_input:
+                        try:
+                            filename = save_input_image(image_input, field_name, client)
+                            image_files[field_name] = filename
+                            if not uses_http_transport(client):
+                                acquired_inputs.append(filename)
+                        except Exception as e:
+                            job_logger.warning(f"⚠️ 處理圖片 {field_name} 失敗: {e}")
         
-        # 3.5 處理音訊參數 (Phase 7 新增)
-        # 需要將音訊從 storage/inputs 複製到 ComfyUI/input
-        audio_file = job_data.get("audio", "")
-        comfyui_audio_file = ""
-        if audio_file:
-            job_logger.info(f"🎵 Audio file specified: {audio_file}")
-            try:
-                comfyui_audio_file = copy_audio_to_comfyui(audio_file, job_id)
-            except Exception as e:
-                job_logger.warning(f"⚠️ 複製音訊檔案失敗: {e}")
-                comfyui_audio_file = ""
+            # 3.5 處理音訊參數 (Phase 7 新增)
+            # 需要將音訊從 storage/inputs 複製到 ComfyUI/input
+            audio_file = job_data.get("audio", "")
+            comfyui_audio_file = ""
+            if audio_file:
+                job_logger.info(f"🎵 Audio file specified: {audio_file}")
+                try:
+                    comfyui_audio_file = copy_audio_to_comfyui(audio_file, job_id, client)
+                except Exception as e:
+                    job_logger.warning(f"⚠️ 複製音訊檔案失敗: {e}")
+                    comfyui_audio_file = ""
         
         # 4. 解析 workflow (包含圖片與音訊注入)
-        update_job_status(r, job_id, "processing", progress=20, db_client=db_client)
+        update_job_status(r, job_id, "processing", progress=20, db_client=db_client, timer=timer)
         
-        workflow = parse_workflow(
-            workflow_name=workflow_name,
-            prompt=prompt,
-            seed=seed,
-            aspect_ratio=aspect_ratio,
-            model=model,
-            batch_size=batch_size,
-            image_files=image_files,      # 傳入圖片檔名映射
-            audio_file=comfyui_audio_file, # 傳入複製後的音訊檔名 (Phase 7)
-            prompts=prompts               # Veo3 Long Video: 傳入多段 prompts
-        )
+        with timer.span("parse_workflow"):
+            workflow = parse_workflow(
+                workflow_name=workflow_name,
+                prompt=prompt,
+                seed=seed,
+                aspect_ratio=aspect_ratio,
+                model=model,
+                batch_size=batch_size,
+                image_files=image_files,      # 傳入圖片檔名映射
+                audio_file=comfyui_audio_file, # 傳入複製後的音訊檔名 (Phase 7)
+                prompts=prompts               # Veo3 Long Video: 傳入多段 prompts
+            )
         
         job_logger.info("Workflow 解析完成")
         
+        # 4.5 固定 seed：相同 workflow 圖 (含輸入檔案內容) 已有輸出時直接沿用
+        input_files = {comfyui_audio_file: Path(STORAGE_INPUT_DIR) / audio_file} if comfyui_audio_file else {}
+        cache_key, cache_hit = check_result_cache(
+            r, job_id, job_data, workflow, db_client, timer, job_logger, input_files
+        )
+        if cache_hit:
+            return
+        
         # 5. 檢查 ComfyUI 連接
         if not client.check_connection():
             raise Exception("無法連接 ComfyUI，請確認是否已啟動")
         
-        # 6. 提交任務到 ComfyUI
-        update_job_status(r, job_id, "processing", progress=30, db_client=db_client)
+        # 6. 提交任務到 ComfyUI (提交前已取消則不再送出)
+        if cancelled.is_set():
+            job_logger.warning("🛑 任務已被取消，不提交到 ComfyUI")
+            return
         
-        prompt_id = client.queue_prompt(workflow)
+        # 依歷史執行時間決定本任務的執行逾時，並寫入預估時間供 /api/status 計算 ETA
+        runtime = runtime_stats.estimate(r, job_data)
+        execution_timeout = runtime_stats.adaptive_timeout(
+            runtime, WORKER_TIMEOUT, ADAPTIVE_TIMEOUT_FACTOR, ADAPTIVE_TIMEOUT_MIN
+        )
+        expected_seconds = runtime["mean"] if runtime else job_data.get("expected_seconds")
+        job_logger.info(
+            f"⏱️ 預估執行 {expected_seconds or '?'}s，執行逾時 {int(execution_timeout)}s"
+            + (f" (樣本 {runtime['samples']}: {runtime['key']})" if runtime else " (無歷史樣本)")
+        )
+        update_job_status(
+            r, job_id, "processing", progress=30, db_client=db_client, timer=timer,
+            fields={"started_at": time.time(), "expected_seconds": expected_seconds}
+        )
+        
+        with timer.span("queue_prompt"):
+            prompt_id = client.queue_prompt(workflow)
+        submitted_at = time.time()
         if not prompt_id:
             raise Exception("任務提交失敗")
         
         job_logger.info(f"任務已提交，prompt_id: {prompt_id}")
         
-        # 7. 定義進度更新回調函數
+        # 7. 定義進度更新回調函數 (節流：取樣器每一步都會觸發；取消改由 cancelled 訊號處理)
+        progress_throttle = ProgressThrottle(PROGRESS_UPDATE_INTERVAL, PROGRESS_UPDATE_MIN_DELTA)
+        
         def on_progress(progress):
-            # 檢查任務是否被取消
-            status_key = f"job:status:{job_id}"
-            current_status = r.hget(status_key, "status")
-            if current_status == "cancelled":
-                job_logger.warning("🛑 任務已被取消，發送中斷指令...")
-                client.interrupt()
-                raise Exception("Task cancelled by user")
-            
             # 將進度從 30% 開始映射到 30-95%
             mapped_progress = 30 + int(progress * 0.65)
-            update_job_status(r, job_id, "processing", progress=mapped_progress, db_client=db_client)
+            if progress_throttle.should_send(mapped_progress):
+                update_job_status(r, job_id, "processing", progress=mapped_progress, db_client=db_client, timer=timer)
 
         # 8. 等待 ComfyUI 執行完成
         result = client.wait_for_completion(
             prompt_id=prompt_id,
             timeout=WORKER_TIMEOUT,  # 使用配置值 (預設 2400 秒 = 40 分鐘)
-            on_progress=on_progress
+            on_progress=on_progress,
+            cancelled=cancelled,
+            execution_timeout=execution_timeout
         )
+        execution_seconds = record_comfy_timing(timer, submitted_at, result.get("timing"))
+        if result.get("success") and execution_seconds is not None:
+            runtime_stats.record(r, job_data, execution_seconds)
+        
+        if result.get("cancelled"):
+            job_logger.warning("🛑 任務已被取消，已發送中斷指令")
+            return
 
         # 9. 根據執行結果處理輸出
         if result.get("success"):
-            videos = result.get("videos", [])
-            gifs = result.get("gifs", [])  # VHS_VideoCombine 輸出影片也在這裡
-            images = result.get("images", [])
-            
-            # 合併所有視訊類輸出 (videos + gifs)，統一處理
-            all_video_outputs = []
-            for v in videos:
-                v["_source"] = "videos"
-                all_video_outputs.append(v)
-            for g in gifs:
-                g["_source"] = "gifs"
-                all_video_outputs.append(g)
-            
-            job_logger.info(f"📊 輸出統計: videos={len(videos)}, gifs={len(gifs)}, images={len(images)}")
-            
-            output_list = []
-            output_type = "unknown"
-            
-            # 優先順序: 視訊類 (videos + gifs) > 圖片
-            if all_video_outputs:
-                output_list = all_video_outputs
-                output_type = "video"
-                job_logger.info(f"🎥 收到 {len(all_video_outputs)} 個視訊輸出")
-            elif images:
-                output_list = images
-                output_type = "image"
-                job_logger.info(f"📷 收到 {len(images)} 張輸出圖片")
-            
-            if output_list:
-                # 過濾掉臨時預覽圖（type: 'temp'），只保留真實輸出
-                real_outputs = [item for item in output_list if item.get("type") != "temp"]
-                
-                if not real_outputs:
-                    job_logger.warning("⚠️ 只有臨時預覽圖，沒有真實輸出")
-                    job_logger.info("📋 臨時預覽圖列表:")
-                    for item in output_list:
-                        job_logger.info(f"   - {item.get('filename')} (type: {item.get('type')})")
-                    # 如果完全沒有輸出，使用臨時預覽圖作為後備
-                    real_outputs = output_list
-                else:
-                    job_logger.info(f"✓ 過濾後剩餘 {len(real_outputs)} 個真實輸出")
-                
-                # 優先選擇完整合併的影片 (filename 包含 Combined 或 Full)
-                selected_file = None
-                
-                # 1. 第一輪篩選：找 "Combined" 或 "Full" (Veo3 Long Video 最終輸出)
-                for item in real_outputs:
-                    filename = item.get("filename", "")
-                    if "Combined" in filename or "Full" in filename:
-                        selected_file = item
-                        job_logger.info(f"✨ 優先選擇合併影片: {filename}")
-                        break
-                
-                # 2. 第二輪篩選：如果有 subfolder (備選)
-                if not selected_file:
-                    for item in real_outputs:
-                        if item.get("subfolder"):
-                            selected_file = item
-                            job_logger.info(f"選擇有子目錄的檔案: {item.get('filename')} (subfolder: {item.get('subfolder')})")
-                            break
-                
-                # 3. 最後手段：使用最後一個（通常最終輸出在最後）
-                if not selected_file:
-                    selected_file = real_outputs[-1]
-                    job_logger.info(f"使用最後一個檔案: {selected_file.get('filename')}")
-                
-                # 嘗試複製選中的檔案（傳遞 file_type）
-                file_type = selected_file.get("type", "output")
-                new_filename = client.copy_output_file(
-                    filename=selected_file.get("filename"),
-                    subfolder=selected_file.get("subfolder", ""),
-                    file_type=file_type,
-                    job_id=job_id
-                )
-                
-                # 如果選中的檔案複製失敗，嘗試其他檔案
-                if not new_filename and len(real_outputs) > 1:
-                    job_logger.warning("⚠️ 第一選擇失敗，嘗試其他檔案...")
-                    for item in real_outputs:
-                        if item == selected_file:
-                            continue
-                        file_type = item.get("type", "output")
-                        new_filename = client.copy_output_file(
-                            filename=item.get("filename"),
-                            subfolder=item.get("subfolder", ""),
-                            file_type=file_type,
-                            job_id=job_id
-                        )
-                        if new_filename:
-                            job_logger.info(f"✓ 成功複製備選檔案: {item.get('filename')}")
-                            break
-                
-                if new_filename:
-                    # 無論是圖片還是影片，都通過 image_url 欄位回傳 (前端會根據副檔名判斷)
-                    file_url = f"/outputs/{new_filename}"
-                    update_job_status(r, job_id, "finished", progress=100, image_url=file_url, db_client=db_client)
-                    job_logger.info(f"✅ 任務完成，輸出 ({output_type}): {file_url}")
-                else:
-                    update_job_status(r, job_id, "finished", progress=100, db_client=db_client)
-                    job_logger.warning("⚠️ 任務完成，但所有輸出檔案都無法複製")
-            else:
-                update_job_status(r, job_id, "finished", progress=100, db_client=db_client)
-                job_logger.info("✅ 任務完成，但沒有輸出檔案")
+            new_filename = deliver_outputs(r, client, job_id, result, db_client, timer, job_logger)
+            store_result_cache(cache_key, new_filename, job_id, job_logger)
         else:
             error = result.get("error", "未知錯誤")
             
@@ -581,32 +567,625 @@ def process_job(r: redis.Redis, client: ComfyClient, job_data: dict, db_client=N
                     all_partial = partial_outputs.get("videos", []) + partial_outputs.get("gifs", []) + partial_outputs.get("images", [])
                     if all_partial:
                         # 有部分輸出，也複製到 Gallery
-                        new_filename = client.copy_output_file(
-                            filename=all_partial[-1].get("filename"),
-                            subfolder=all_partial[-1].get("subfolder", ""),
-                            job_id=job_id
-                        )
+                        with timer.span("output_copy"):
+                            new_filename = client.copy_output_file(
+                                filename=all_partial[-1].get("filename"),
+                                subfolder=all_partial[-1].get("subfolder", ""),
+                                job_id=job_id
+                            )
                         if new_filename:
                             file_url = f"/outputs/{new_filename}"
-                            update_job_status(r, job_id, "failed", error=f"{error} (partial output saved)", image_url=file_url, db_client=db_client)
+                            update_job_status(r, job_id, "failed", error=f"{error} (partial output saved)", image_url=file_url, db_client=db_client, timer=timer)
                             job_logger.info(f"⚠️ 任務超時但已保存部分輸出: {file_url}")
                             return
                 except Exception as partial_err:
                     job_logger.warning(f"⚠️ 獲取部分輸出失敗: {partial_err}")
             
-            update_job_status(r, job_id, "failed", error=error, db_client=db_client)
+            update_job_status(r, job_id, "failed", error=error, db_client=db_client, timer=timer)
             job_logger.error(f"❌ 任務失敗: {error}")
             
     except Exception as e:
         error_msg = str(e)
         job_logger.error(f"❌ 處理錯誤: {error_msg}")
-        update_job_status(r, job_id, "failed", progress=0, error=error_msg, db_client=db_client)
+        update_job_status(r, job_id, "failed", progress=0, error=error_msg, db_client=db_client, timer=timer)
+    finally:
+        for filename in acquired_inputs:
+            input_cache.release(filename)
+        finalize_job(r, job_id, timer, job_logger)
+
+
+def finalize_job(r: redis.Redis, job_id: str, timer: JobTimer, job_logger):
+    """任務結束 (任何結果)：停止監看取消訊號，記錄完成數與各階段耗時"""
+    if cancel_watcher:
+        cancel_watcher.unwatch(job_id)
+    try:
+        final_status = r.hget(f"job:status:{job_id}", "status") or "unknown"
+        JOBS_COMPLETED.labels(workflow=timer.workflow, status=final_status).inc()
+        timer.flush(r, ttl=JOB_STATUS_EXPIRE_SECONDS, status=final_status)
+    except Exception as e:
+        job_logger.warning(f"⚠️ 任務計時記錄失敗: {e}")
+
+
+def batch_key(job_data: dict):
+    """
+    微批次相容鍵：同 workflow / 模型 / 比例，且沒有輸入圖片或音訊的任務可合併
+
+    Returns:
+        (workflow, model, aspect_ratio)；不可批次時返回 None
+    """
+    workflow_name = job_data.get("workflow", "text_to_image")
+    if BATCH_MAX_SIZE <= 1 or workflow_name not in BATCH_WORKFLOWS:
+        return None
+    if job_data.get("images") or job_data.get("audio") or job_data.get("prompts"):
+        return None
+    return (workflow_name, job_data.get("model", "turbo_fp8"), job_data.get("aspect_ratio", "1:1"))
+
+
+def split_batch_outputs(result: dict, count: int) -> list:
+    """依輸出節點 ID 前綴 (b<i>_) 把批次 prompt 的輸出分配回各任務"""
+    parts = [{"success": True, "images": [], "videos": [], "gifs": []} for _ in range(count)]
+    for key in ("images", "videos", "gifs"):
+        for item in result.get(key, []):
+            index = batch_index(item.get("node"))
+            if index is not None and index < count:
+                parts[index][key].append(item)
+    return parts
+
+
+def process_batch(r: redis.Redis, client: ComfyClient, jobs: list, db_client=None):
+    """
+    以單一 ComfyUI prompt 執行多個相容的任務 (微批次)
+    
+    各任務的 workflow 分別注入自己的 prompt / seed 後以 merge_workflows 合併：
+    模型載入、相同的負向提示與空 latent 只執行一次，各任務保有獨立的取樣分支與輸出節點；
+    完成後依輸出節點 ID 前綴把輸出分配回各任務。
+    批次總執行時間記錄在 runtime_stats 的 <參數組合>|mb<N> (與單獨執行的樣本分開)，
+    樣本足夠後用於同規模批次的執行逾時與各任務的預估時間。
+    """
+    members = []
+    for job_data in jobs:
+        job_id = job_data.get("job_id", "unknown")
+        members.append({
+            "job_id": job_id,
+            "data": job_data,
+            "logger": JobLogAdapter(logger, {"job_id": job_id}),
+            "cancelled": cancel_watcher.watch(job_id) if cancel_watcher else threading.Event(),
+            "timer": JobTimer(job_id, job_data.get("workflow", "text_to_image"), job_data.get("created_at")),
+            "done": False,
+        })
+    active = []
+    try:
+        for member in members:
+            if member["cancelled"].is_set():
+                member["logger"].warning("🛑 任務已在排隊中被取消，略過執行")
+            else:
+                active.append(member)
+        if not active:
+            return
+        
+        workflow_name, model, aspect_ratio = batch_key(active[0]["data"])
+        logger.info(
+            f"📦 微批次: {len(active)} 個任務合併為單一 ComfyUI prompt "
+            f"({workflow_name} / {model} / {aspect_ratio}): {', '.join(m['job_id'] for m in active)}"
+        )
+        for member in active:
+            update_job_status(r, member["job_id"], "processing", progress=10, db_client=db_client, timer=member["timer"])
+        
+        # 1. 各任務分別注入參數 (固定 seed 且結果快取命中者直接完成)，再合併為一張圖
+        for member in active:
+            parse_started = time.monotonic()
+            member["workflow"] = parse_workflow(
+                workflow_name=workflow_name,
+                prompt=member["data"].get("prompt", ""),
+                seed=member["data"].get("seed", -1),
+                aspect_ratio=aspect_ratio,
+                model=model,
+                batch_size=member["data"].get("batch_size", 1)
+            )
+            member["timer"].record("parse_workflow", time.monotonic() - parse_started)
+            member["cache_key"], member["done"] = check_result_cache(
+                r, member["job_id"], member["data"], member["workflow"],
+                db_client, member["timer"], member["logger"]
+            )
+        active = [member for member in active if not member["done"]]
+        if not active:
+            return
+        workflow = merge_workflows([member["workflow"] for member in active])
+        logger.info(f"📦 批次 workflow 合併完成: {len(active)} 個任務 / {len(workflow)} 個節點")
+        
+        # 2. 檢查 ComfyUI 連接
+        if not client.check_connection():
+            raise Exception("無法連接 ComfyUI，請確認是否已啟動")
+        
+        # 3. 執行逾時：同規模微批次的樣本足夠時依其 p95 (樣本即批次總時間)，
+        #    否則為各任務單獨執行自適應逾時的總和 (上限 WORKER_TIMEOUT)
+        runtimes = [runtime_stats.estimate(r, member["data"], micro_batch=len(active)) for member in active]
+        if all(runtimes):
+            execution_timeout = max(
+                runtime_stats.adaptive_timeout(runtime, WORKER_TIMEOUT, ADAPTIVE_TIMEOUT_FACTOR, ADAPTIVE_TIMEOUT_MIN)
+                for runtime in runtimes
+            )
+        else:
+            runtimes = [runtime_stats.estimate(r, member["data"]) for member in active]
+            execution_timeout = min(WORKER_TIMEOUT, sum(
+                runtime_stats.adaptive_timeout(runtime, WORKER_TIMEOUT, ADAPTIVE_TIMEOUT_FACTOR, ADAPTIVE_TIMEOUT_MIN)
+                for runtime in runtimes
+            ))
+        logger.info(f"⏱️ 批次執行逾時 {int(execution_timeout)}s")
+        for member, runtime in zip(active, runtimes):
+            update_job_status(
+                r, member["job_id"], "processing", progress=30, db_client=db_client, timer=member["timer"],
+                fields={
+                    "started_at": time.time(),
+                    "expected_seconds": runtime["mean"] if runtime else member["data"].get("expected_seconds")
+                }
+            )
+        
+        # 4. 提交 (全部任務都已取消則不再送出)
+        cancelled = AllEvents([member["cancelled"] for member in active])
+        if cancelled.is_set():
+            logger.warning("🛑 批次中的任務皆已取消，不提交到 ComfyUI")
+            return
+        queue_started = time.monotonic()
+        prompt_id = client.queue_prompt(workflow)
+        submitted_at = time.time()
+        for member in active:
+            member["timer"].record("queue_prompt", time.monotonic() - queue_started)
+        if not prompt_id:
+            raise Exception("任務提交失敗")
+        logger.info(f"📦 批次已提交，prompt_id: {prompt_id}")
+        
+        # 5. 進度：各分支的取樣器依序執行，進度歸零即代表進入下一個分支
+        progress_throttle = ProgressThrottle(PROGRESS_UPDATE_INTERVAL, PROGRESS_UPDATE_MIN_DELTA)
+        branch = {"index": 0, "last": 0}
+        
+        def on_progress(progress):
+            if progress < branch["last"]:
+                branch["index"] = min(len(active) - 1, branch["index"] + 1)
+            branch["last"] = progress
+            overall = (branch["index"] * 100 + progress) / len(active)
+            mapped_progress = 30 + int(overall * 0.65)
+            if progress_throttle.should_send(mapped_progress):
+                for member in active:
+                    if not member["cancelled"].is_set():
+                        update_job_status(
+                            r, member["job_id"], "processing", progress=mapped_progress,
+                            db_client=db_client, timer=member["timer"]
+                        )
+        
+        result = client.wait_for_completion(
+            prompt_id=prompt_id,
+            timeout=WORKER_TIMEOUT,
+            on_progress=on_progress,
+            cancelled=cancelled,
+            execution_timeout=execution_timeout
+        )
+        for member in active:
+            execution_seconds = record_comfy_timing(member["timer"], submitted_at, result.get("timing"))
+        if result.get("success") and execution_seconds is not None:
+            # 每種參數組合記一筆批次總時間
+            for job_data in {runtime_stats.signature(m["data"]): m["data"] for m in active}.values():
+                runtime_stats.record(r, job_data, execution_seconds, micro_batch=len(active))
+        
+        if result.get("cancelled"):
+            logger.warning("🛑 批次中的任務皆已取消，已發送中斷指令")
+            return
+        
+        # 6. 依輸出節點分配回各任務
+        if result.get("success"):
+            for member, part in zip(active, split_batch_outputs(result, len(active))):
+                if member["cancelled"].is_set():
+                    member["logger"].warning("🛑 任務已被取消，捨棄批次輸出")
+                    continue
+                try:
+                    new_filename = deliver_outputs(r, client, member["job_id"], part, db_client, member["timer"], member["logger"])
+                    store_result_cache(member["cache_key"], new_filename, member["job_id"], member["logger"])
+                except Exception as e:
+                    member["logger"].error(f"❌ 批次輸出處理錯誤: {e}")
+                    update_job_status(r, member["job_id"], "failed", error=str(e), db_client=db_client, timer=member["timer"])
+                member["done"] = True
+        else:
+            error = result.get("error", "未知錯誤")
+            for member in active:
+                update_job_status(r, member["job_id"], "failed", error=error, db_client=db_client, timer=member["timer"])
+                member["done"] = True
+            logger.error(f"❌ 批次任務失敗: {error}")
+    
+    except Exception as e:
+        error_msg = str(e)
+        logger.error(f"❌ 批次處理錯誤: {error_msg}")
+        for member in active:
+            if not member["done"]:
+                update_job_status(
+                    r, member["job_id"], "failed", progress=0, error=error_msg,
+                    db_client=db_client, timer=member["timer"]
+                )
+    finally:
+        for member in members:
+            finalize_job(r, member["job_id"], member["timer"], member["logger"])
+
+
+def deliver_outputs(r: redis.Redis, client: ComfyClient, job_id: str, result: dict, db_client, timer: JobTimer, job_logger):
+    """
+    從成功的執行結果挑選最終輸出 (視訊優先於圖片)，複製到 storage/outputs 並標記任務完成
+    
+    Args:
+        result: wait_for_completion 的結果 (批次任務為分配給本任務的部分)
+    
+    Returns:
+        複製到 storage/outputs 的檔名；沒有可用輸出時為 None
+    """
+    new_filename = None
+    videos = result.get("videos", [])
+    gifs = result.get("gifs", [])  # VHS_VideoCombine 輸出影片也在這裡
+    images = result.get("images", [])
+
+    # 合併所有視訊類輸出 (videos + gifs)，統一處理
+    all_video_outputs = []
+    for v in videos:
+        v["_source"] = "videos"
+        all_video_outputs.append(v)
+    for g in gifs:
+        g["_source"] = "gifs"
+        all_video_outputs.append(g)
+
+    job_logger.info(f"📊 輸出統計: videos={len(videos)}, gifs={len(gifs)}, images={len(images)}")
+
+    output_list = []
+    output_type = "unknown"
+
+    # 優先順序: 視訊類 (videos + gifs) > 圖片
+    if all_video_outputs:
+        output_list = all_video_outputs
+        output_type = "video"
+        job_logger.info(f"🎥 收到 {len(all_video_outputs)} 個視訊輸出")
+    elif images:
+        output_list = images
+        output_type = "image"
+        job_logger.info(f"📷 收到 {len(images)} 張輸出圖片")
+
+    if output_list:
+        # 過濾掉臨時預覽圖（type: 'temp'），只保留真實輸出
+        real_outputs = [item for item in output_list if item.get("type") != "temp"]
+
+        if not real_outputs:
+            job_logger.warning("⚠️ 只有臨時預覽圖，沒有真實輸出")
+            job_logger.info("📋 臨時預覽圖列表:")
+            for item in output_list:
+                job_logger.info(f"   - {item.get('filename')} (type: {item.get('type')})")
+            # 如果完全沒有輸出，使用臨時預覽圖作為後備
+            real_outputs = output_list
+        else:
+            job_logger.info(f"✓ 過濾後剩餘 {len(real_outputs)} 個真實輸出")
+
+        # 優先選擇完整合併的影片 (filename 包含 Combined 或 Full)
+        selected_file = None
+
+        # 1. 第一輪篩選：找 "Combined" 或 "Full" (Veo3 Long Video 最終輸出)
+        for item in real_outputs:
+            filename = item.get("filename", "")
+            if "Combined" in filename or "Full" in filename:
+                selected_file = item
+                job_logger.info(f"✨ 優先選擇合併影片: {filename}")
+                break
+
+        # 2. 第二輪篩選：如果有 subfolder (備選)
+        if not selected_file:
+            for item in real_outputs:
+                if item.get("subfolder"):
+                    selected_file = item
+                    job_logger.info(f"選擇有子目錄的檔案: {item.get('filename')} (subfolder: {item.get('subfolder')})")
+                    break
+
+        # 3. 最後手段：使用最後一個（通常最終輸出在最後）
+        if not selected_file:
+            selected_file = real_outputs[-1]
+            job_logger.info(f"使用最後一個檔案: {selected_file.get('filename')}")
+
+        with timer.span("output_copy"):
+            # 嘗試複製選中的檔案（傳遞 file_type）
+            file_type = selected_file.get("type", "output")
+            new_filename = client.copy_output_file(
+                filename=selected_file.get("filename"),
+                subfolder=selected_file.get("subfolder", ""),
+                file_type=file_type,
+                job_id=job_id
+            )
+
+            # 如果選中的檔案複製失敗，嘗試其他檔案
+            if not new_filename and len(real_outputs) > 1:
+                job_logger.warning("⚠️ 第一選擇失敗，嘗試其他檔案...")
+                for item in real_outputs:
+                    if item == selected_file:
+                        continue
+                    file_type = item.get("type", "output")
+                    new_filename = client.copy_output_file(
+                        filename=item.get("filename"),
+                        subfolder=item.get("subfolder", ""),
+                        file_type=file_type,
+                        job_id=job_id
+                    )
+                    if new_filename:
+                        job_logger.info(f"✓ 成功複製備選檔案: {item.get('filename')}")
+                        break
+
+        if new_filename:
+            # 無論是圖片還是影片，都通過 image_url 欄位回傳 (前端會根據副檔名判斷)
+            file_url = f"/outputs/{new_filename}"
+            update_job_status(r, job_id, "finished", progress=100, image_url=file_url, db_client=db_client, timer=timer)
+            job_logger.info(f"✅ 任務完成，輸出 ({output_type}): {file_url}")
+        else:
+            update_job_status(r, job_id, "finished", progress=100, db_client=db_client, timer=timer)
+            job_logger.warning("⚠️ 任務完成，但所有輸出檔案都無法複製")
+    else:
+        update_job_status(r, job_id, "finished", progress=100, db_client=db_client, timer=timer)
+        job_logger.info("✅ 任務完成，但沒有輸出檔案")
+    return new_filename
+
+
+def check_result_cache(
+    r: redis.Redis,
+    job_id: str,
+    job_data: dict,
+    workflow: dict,
+    db_client,
+    timer: JobTimer,
+    job_logger,
+    input_files: dict = None
+):
+    """
+    固定 seed 任務查詢結果快取，命中時直接以既有輸出完成任務
+
+    Args:
+        workflow: 已注入參數的 workflow (快取鍵的來源)
+        input_files: {以任務 ID 命名的輸入檔名: 本地路徑}，快取鍵改用其內容雜湊
+
+    Returns:
+        (cache_key, hit)；不可快取或查詢失敗時 cache_key 為 None
+    """
+    if result_cache is None or not result_cache.enabled:
+        return None, False
+    try:
+        if int(job_data.get("seed", -1)) < 0 or not has_seed_injection(job_data.get("workflow", "text_to_image")):
+            return None, False
+        file_hashes = {name: file_digest(path) for name, path in (input_files or {}).items()}
+        cache_key = workflow_key(workflow, file_hashes)
+        with timer.span("result_cache"):
+            cached = result_cache.lookup(cache_key, job_id)
+    except Exception as e:
+        job_logger.warning(f"⚠️ 結果快取查詢失敗 (照常執行): {e}")
+        return None, False
+    if not cached:
+        return cache_key, False
+    file_url = f"/outputs/{cached}"
+    update_job_status(r, job_id, "finished", progress=100, image_url=file_url, db_client=db_client, timer=timer)
+    job_logger.info(f"✅ 任務完成 (結果快取命中，未送交 ComfyUI): {file_url}")
+    return cache_key, True
+
+
+def store_result_cache(cache_key: str, filename: str, job_id: str, job_logger) -> None:
+    """登記固定 seed 任務的輸出 (cache_key 或 filename 為空時略過)"""
+    if not cache_key or not filename:
+        return
+    try:
+        result_cache.store(cache_key, filename, job_id)
+    except Exception as e:
+        job_logger.warning(f"⚠️ 結果快取登記失敗: {e}")
+
+
+def record_comfy_timing(timer: JobTimer, submitted_at: float, timing: dict = None):
+    """
+    由 ComfyUI 事件時間拆分排隊與執行耗時
+
+    Args:
+        timer: 任務計時器
+        submitted_at: queue_prompt 完成時間 (epoch 秒)
+        timing: wait_for_completion 回傳的 {"execution_start", "execution_end"}
+    
+    Returns:
+        ComfyUI 實際執行秒數；沒有收到執行事件時為 None
+    """
+    timing = timing or {}
+    started = timing.get("execution_start")
+    finished = timing.get("execution_end") or time.time()
+    if started is None:
+        # 沒有收到任何執行事件 (例如排隊中就超時)：整段視為 ComfyUI 排隊
+        timer.record("comfy_queue_wait", finished - submitted_at)
+        return None
+    execution_seconds = max(0.0, finished - started)
+    timer.record("comfy_queue_wait", max(0.0, started - submitted_at))
+    timer.record("comfy_execution", execution_seconds)
+    return execution_seconds
+
+
+class ProgressThrottle:
+    """
+    進度更新節流：距上次送出至少 interval 秒，且進度變化至少 min_delta 才送出
+
+    ComfyUI 每個取樣步驟都送一次 progress，長影片每段可達數百步；
+    每次送出即一次 set_job_status (單一 Lua 呼叫)。
+    """
+
+    def __init__(self, interval: float, min_delta: int):
+        self.interval = interval
+        self.min_delta = min_delta
+        self._last_value = None
+        self._last_sent = 0.0
+
+    def should_send(self, value: int) -> bool:
+        now = time.monotonic()
+        if self._last_value is not None:
+            # 多個取樣節點時進度會從頭開始，以絕對差計算
+            if abs(value - self._last_value) < self.min_delta or now - self._last_sent < self.interval:
+                return False
+        self._last_value = value
+        self._last_sent = now
+        return True
+
+
+class AllEvents:
+    """多個 threading.Event 全部 set 時才視為 set (批次中所有任務都取消才中斷 prompt)"""
+
+    def __init__(self, events: list):
+        self.events = events
+
+    def is_set(self) -> bool:
+        return all(event.is_set() for event in self.events)
+
+
+def admit_job(r: redis.Redis, rq: ReliableQueue, job_json: str, db_client):
+    """
+    解析取出的任務並記錄投遞次數
+
+    Returns:
+        任務資料；JSON 錯誤或超過最大投遞次數 (已標記失敗並 ack) 時返回 None
+    """
+    try:
+        job_data = json.loads(job_json)
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON 解析錯誤: {e}")
+        rq.ack(job_json)
+        return None
+    
+    # 重複投遞超過上限：視為毒任務，標記失敗不再重試
+    job_id = job_data.get("job_id", "unknown")
+    if not rq.record_delivery(job_id):
+        logger.error(f"❌ 任務已投遞超過 {JOB_MAX_DELIVERIES} 次，放棄執行: {job_id}")
+        update_job_status(
+            r, job_id, "failed",
+            error=f"Worker 多次中斷，已放棄執行 (投遞 {JOB_MAX_DELIVERIES} 次)",
+            db_client=db_client
+        )
+        JOBS_COMPLETED.labels(workflow=job_data.get("workflow", "text_to_image"), status="failed").inc()
+        rq.ack(job_json, job_id)
+        return None
+    return job_data
+
+
+def release_jobs(rq: ReliableQueue, jobs: list) -> list:
+    """
+    將已取出但未交給任務執行緒的任務放回佇列
+
+    Returns:
+        放回失敗 (Redis 無法使用) 的任務，由主迴圈稍後重試
+    """
+    failed = []
+    for job_json in jobs:
+        try:
+            if rq.release(job_json):
+                logger.warning("↩️ 任務未能開始執行，已放回佇列")
+        except Exception as e:
+            logger.warning(f"⚠️ 任務放回佇列失敗，稍後重試: {e}")
+            failed.append(job_json)
+    return failed
+
+
+def collect_batch(
+    r: redis.Redis,
+    rq: ReliableQueue,
+    job_json: str,
+    job_data: dict,
+    db_client,
+    stranded: list
+):
+    """
+    微批次收集：在 BATCH_WINDOW 秒內繼續取出與第一個任務相容的任務，最多 BATCH_MAX_SIZE 個
+
+    取到不相容的任務即結束收集，該任務在記錄投遞前放回佇列前端：
+    不留在本 Worker (槽位滿時由其他空閒 Worker 取走)，也不計入投遞次數。
+    不會拋出例外：新取出的任務解析失敗 (例如 Redis 中斷) 時放回佇列並返回已收集的部分，
+    放回失敗者加入 stranded 由主迴圈重試。
+
+    Returns:
+        [(job_json, job_data), ...]
+    """
+    batch = [(job_json, job_data)]
+    key = batch_key(job_data)
+    if key is None:
+        return batch
+    
+    deadline = time.monotonic() + BATCH_WINDOW
+    while len(batch) < BATCH_MAX_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            next_json = rq.reserve(timeout=remaining)
+        except Exception as e:
+            logger.warning(f"⚠️ 微批次收集中斷: {e}")
+            break
+        if not next_json:
+            break
+        try:
+            compatible = batch_key(json.loads(next_json)) == key
+        except json.JSONDecodeError:
+            compatible = True  # 交由 admit_job 標記並 ack
+        if not compatible:
+            stranded.extend(release_jobs(rq, [next_json]))
+            break
+        try:
+            next_data = admit_job(r, rq, next_json, db_client)
+        except Exception as e:
+            logger.warning(f"⚠️ 微批次收集中斷: {e}")
+            stranded.extend(release_jobs(rq, [next_json]))
+            break
+        if next_data is None:
+            continue
+        batch.append((next_json, next_data))
+    return batch
+
+
+def run_job_in_slot(
+    r: redis.Redis,
+    pool: EnginePool,
+    rq: ReliableQueue,
+    batch: list,
+    db_client,
+    inflight: threading.BoundedSemaphore
+):
+    """
+    在並行窗口的一個槽位中執行任務 (或一組微批次任務)，結束後 ack 並釋放槽位
+
+    batch 為 [(job_json, job_data), ...]，多於一個時以 process_batch 合併執行。
+    任務依所需模型分派到已載入該模型的 ComfyUI 實例 (見 engine_pool)；
+    同一實例的槽位共用一個 ComfyClient，事件由單一 WebSocket 依 prompt_id 分派。
+    任務只有在處理結束 (成功或失敗) 後才 ack；Worker 中途崩潰時，
+    任務仍留在 processing 清單，由其他 Worker 的 reaper 放回佇列。
+    """
+    job_data = batch[0][1]
+    engine = None
+    WORKER_INFLIGHT.inc(len(batch))
+    try:
+        try:
+            models = required_models(job_data.get("workflow", "text_to_image"), job_data.get("model", "turbo_fp8"))
+        except Exception as e:
+            logger.warning(f"⚠️ 無法解析任務所需模型 (不套用親和路由): {e}")
+            models = ()
+        engine = pool.acquire(models)
+        if len(batch) > 1:
+            process_batch(r, engine.client, [data for _, data in batch], db_client)
+        else:
+            process_job(r, engine.client, job_data, db_client)
+    except Exception as e:
+        logger.error(f"❌ 任務執行緒未預期錯誤: {e}", exc_info=True)
+    finally:
+        WORKER_INFLIGHT.dec(len(batch))
+        if engine is not None:
+            pool.release(engine)
+        for job_json, data in batch:
+            try:
+                rq.ack(job_json, data.get("job_id"))
+            except Exception as e:
+                logger.error(f"❌ 任務 ack 失敗 (將於重啟後重新投遞): {e}")
+        inflight.release()
 
 
 def main():
     """
     Worker 主迴圈
     """
+    global db_writer, cancel_watcher, result_cache
+    
     logger.info("="*50)
     logger.info("🚀 Worker 啟動中...")
     logger.info("="*50)
@@ -616,6 +1195,10 @@ def main():
         r = get_redis_client()
         r.ping()
         logger.info(f"✅ Redis 連接成功 ({REDIS_HOST}:{REDIS_PORT})")
+        cancel_watcher = CancelWatcher(r)
+        cancel_watcher.start()
+        result_cache = ResultCache(r, STORAGE_OUTPUT_DIR, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES)
+        RESULT_CACHE_ENTRIES.set_function(result_cache.size)
     except Exception as e:
         logger.error(f"❌ Redis 連接失敗: {e}")
         sys.exit(1)
@@ -634,39 +1217,89 @@ def main():
             database=DB_NAME
         )
         logger.info(f"✅ 資料庫連接成功 ({DB_HOST}:{DB_PORT}/{DB_NAME})")
+        
+        db_writer = JobStatusWriter(
+            db_client,
+            max_pending=DB_WRITER_MAX_PENDING,
+            flush_interval=DB_WRITER_FLUSH_INTERVAL,
+            batch_size=DB_WRITER_BATCH_SIZE
+        )
+        db_writer.start()
     except Exception as e:
         logger.warning(f"⚠️ 資料庫連接失敗 (功能降級): {e}")
     
-    # 3. 初始化 ComfyUI 客戶端
-    client = ComfyClient()
+    # 2.5 Prometheus /metrics (等待中任務數在抓取時以 LLEN + HLEN 取得，O(1))
+    QUEUE_DEPTH.set_function(lambda: pending_count(r, JOB_QUEUE))
+    if WORKER_METRICS_PORT:
+        try:
+            start_metrics_server(WORKER_METRICS_PORT)
+            logger.info(f"📈 Metrics 端點: http://0.0.0.0:{WORKER_METRICS_PORT}/metrics")
+        except OSError as e:
+            logger.warning(f"⚠️ Metrics 端點啟動失敗: {e}")
+    
+    # 3. 初始化 ComfyUI 實例池 (每個實例一個 ComfyClient，由該實例的並行槽位共用)
+    pool = EnginePool(
+        COMFY_ENGINES, r,
+        max_inflight=WORKER_MAX_INFLIGHT,
+        resident_slots=ENGINE_RESIDENT_MODELS,
+        local_endpoint=f"{COMFY_HOST}:{COMFY_PORT}"
+    )
     
-    # 4. 檢查 ComfyUI 連接
-    if client.check_connection():
+    # 4. 檢查 ComfyUI 連接並開啟各實例的 WebSocket 事件流 (斷線自動重連)
+    if pool.check_connection():
         logger.info("✅ ComfyUI 連接成功")
     else:
         logger.warning("⚠️ ComfyUI 尚未啟動，將持續等待...")
+    connected = pool.start(wait=5)
+    if connected == len(pool.engines):
+        logger.info(f"✅ ComfyUI 事件流已連接 ({connected} 個實例: {', '.join(COMFY_ENGINES)})")
+    else:
+        logger.warning(f"⚠️ ComfyUI 事件流已連接 {connected}/{len(pool.engines)} 個實例，背景持續重試中...")
     
-    # 5. 清理舊的暫存檔案
+    # 5. 重建輸入圖片快取索引，並清理舊的暫存檔案
     logger.info("🗑️ 清理過期暫存檔案...")
+    if INPUT_TRANSPORT == "filesystem":
+        input_cache.scan(legacy_max_age_hours=TEMP_FILE_MAX_AGE_HOURS)
     cleanup_old_temp_files()
     
     # 6. 清理超過 30 天的輸出圖片 (並同步資料庫)
     logger.info("🗑️ 清理超過 30 天的輸出圖片...")
     cleanup_old_output_files(db_client)
     
-    # 7. 啟動 Worker 心跳線程
-    logger.info("💓 啟動 Worker 心跳線程...")
-    heartbeat_thread = threading.Thread(target=worker_heartbeat, args=(r,), daemon=True)
+    # 7. 註冊可靠佇列並恢復上次遺留的任務，啟動心跳 / 回收線程
+    rq = ReliableQueue(
+        r, JOB_QUEUE, WORKER_ID,
+        heartbeat_ttl=WORKER_HEARTBEAT_TTL,
+        max_deliveries=JOB_MAX_DELIVERIES
+    )
+    rq.register()
+    rq.recover_own()
+    logger.info(f"💓 啟動 Worker 心跳線程... (worker_id: {WORKER_ID})")
+    heartbeat_thread = threading.Thread(target=worker_heartbeat, args=(rq,), daemon=True)
     heartbeat_thread.start()
     
     # 8. 開始處理佇列
     logger.info(f"\n監聽佇列: {JOB_QUEUE}")
-    logger.info(f"ComfyUI Input 目錄: {COMFYUI_INPUT_DIR}")
+    if INPUT_TRANSPORT == "http":
+        logger.info(f"輸入檔案傳送: HTTP 上傳 (各 ComfyUI 實例 /upload/image)")
+    else:
+        logger.info(f"ComfyUI Input 目錄: {COMFYUI_INPUT_DIR}")
+    if any(uses_http_transport(engine.client) for engine in pool.engines):
+        # ComfyUI 沒有刪除 input 檔案的 API
+        logger.warning("⚠️ 上傳到 ComfyUI 的輸入檔案不會由 Worker 清理，請在 ComfyUI 主機定期清理 input 目錄")
+    logger.info(f"並行窗口: 每個 ComfyUI 實例最多 {WORKER_MAX_INFLIGHT} 個任務 (共 {pool.capacity})")
+    if BATCH_MAX_SIZE > 1:
+        logger.info(f"微批次: {', '.join(sorted(BATCH_WORKFLOWS))} 在 {BATCH_WINDOW}s 內最多合併 {BATCH_MAX_SIZE} 個任務")
     logger.info("等待任務中...\n")
     
     last_cleanup_time = time.time()
     CLEANUP_INTERVAL = 3600  # 每小時清理一次
     
+    # 並行窗口：槽位滿時不再取新任務，讓任務留在 Redis 佇列給其他 Worker
+    inflight = threading.BoundedSemaphore(pool.capacity)
+    stranded = []  # 放回佇列失敗、待重試的任務 JSON
+    executor = ThreadPoolExecutor(max_workers=pool.capacity, thread_name_prefix="job")
+    
     while True:
         try:
             # 定期清理暫存檔案和輸出圖片
@@ -675,23 +1308,46 @@ def main():
                 cleanup_old_output_files(db_client)
                 last_cleanup_time = time.time()
             
-            # BLPOP: 阻塞式取出任務 (超時 5 秒)
-            result = r.blpop(JOB_QUEUE, timeout=5)
+            # 等待空閒槽位
+            # Redis 中斷期間未能放回佇列的任務 (仍在本 Worker 的 processing 清單)
+            if stranded:
+                stranded = release_jobs(rq, stranded)
             
-            if result:
-                queue_name, job_json = result
+            if not inflight.acquire(timeout=5):
+                continue
+            
+            held = []  # 已取出、尚未交給任務執行緒的任務 JSON
+            try:
+                # 阻塞式取出任務並移到本 Worker 的 processing 清單 (超時 5 秒)
+                job_json = rq.reserve(timeout=5)
+                if not job_json:
+                    inflight.release()
+                    continue
+                held.append(job_json)
                 
-                try:
-                    job_data = json.loads(job_json)
-                    process_job(r, client, job_data, db_client)
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON 解析錯誤: {e}")
+                job_data = admit_job(r, rq, job_json, db_client)
+                if job_data is None:
+                    inflight.release()
+                    continue
+                
+                # 微批次：短暫收集相容任務，與本任務合併為單一 ComfyUI prompt
+                batch = collect_batch(r, rq, job_json, job_data, db_client, stranded)
+                held = [item_json for item_json, _ in batch]
+                
+                # 槽位由任務執行緒負責 ack 與釋放
+                executor.submit(run_job_in_slot, r, pool, rq, batch, db_client, inflight)
+            except BaseException:
+                # 交出前失敗：釋放槽位，已取出的任務放回佇列 (本 Worker 心跳仍在，reaper 不會回收)
+                inflight.release()
+                stranded.extend(release_jobs(rq, held))
+                raise
             
         except redis.ConnectionError as e:
             logger.error(f"Redis 連接中斷，5 秒後重試: {e}")
             time.sleep(5)
             try:
                 r = get_redis_client()
+                rq.r = r
             except:
                 pass
                 
@@ -703,6 +1359,17 @@ def main():
             logger.error(f"未預期錯誤: {e}")
             time.sleep(1)
     
+    # 等待執行中的任務完成並 ack (期間心跳持續，任務不會被其他 Worker 回收)
+    logger.info("⏳ 等待執行中的任務完成... (再按一次 Ctrl+C 強制結束)")
+    try:
+        executor.shutdown(wait=True, cancel_futures=True)
+        rq.unregister()
+    except KeyboardInterrupt:
+        logger.warning("⚠️ 強制結束，未完成任務將由其他 Worker 在心跳逾時後回收")
+    if db_writer is not None:
+        logger.info(f"💾 寫回 MySQL 狀態... (待寫入 {db_writer.pending_count()} 筆)")
+        db_writer.close(timeout=10)
+    pool.close()
     logger.info("已關閉")
 
 
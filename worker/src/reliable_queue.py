@@ -0,0 +1,209 @@
+"""
+Reliable Job Queue
+==================
+Redis 可靠佇列協定 (取代單純的 BLPOP)：
+- 取出任務時由 shared.scheduler 依公平排程 (DRR) 選出，原子地搬到本 Worker 的 processing 清單
+- 任務結束 (成功或失敗) 後才 ack，從 processing 清單移除
+- 每個 Worker 各自的心跳鍵 (worker:heartbeat:<worker_id>) 即為可見性逾時：
+  心跳過期的 Worker 其 processing 清單會被其他 Worker 的 reaper 放回佇列前端
+- 同一任務被重複投遞超過上限時視為毒任務，直接標記失敗
+"""
+
+import logging
+from typing import Optional
+
+import redis
+
+from shared import scheduler
+
+logger = logging.getLogger("worker")
+
+# 所有 Worker 的註冊集合 (reaper 依此巡檢；Backend 的 ETA 估計亦使用)
+WORKER_REGISTRY_KEY = scheduler.WORKER_REGISTRY_KEY
+# Backend 用來判斷是否有 Worker 在線的全域心跳鍵
+GLOBAL_HEARTBEAT_KEY = "worker:heartbeat"
+# 任務投遞次數 {job_id: count}
+DELIVERY_COUNT_KEY = "job:deliveries"
+
+# 心跳已過期時，將 processing 清單整批放回佇列前端 (保持原順序)
+# KEYS[1]=心跳鍵 KEYS[2]=processing 清單 KEYS[3]=任務佇列 KEYS[4]=Worker 註冊集合
+# ARGV[1]=worker_id
+# 回傳: -1 表示 Worker 仍存活；否則為放回的任務數
+_REQUEUE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return -1
+end
+local moved = 0
+while redis.call('LMOVE', KEYS[2], KEYS[3], 'RIGHT', 'LEFT') do
+    moved = moved + 1
+end
+redis.call('SREM', KEYS[4], ARGV[1])
+return moved
+"""
+
+# 將單一任務從 processing 清單放回佇列前端 (已不在 processing 清單則不動作，避免重複投遞)
+# KEYS[1]=processing 清單 KEYS[2]=任務佇列 ARGV[1]=任務 JSON
+# 回傳: 放回的數量 (0 或 1)
+_RELEASE_SCRIPT = """
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 0 then
+    return 0
+end
+redis.call('LPUSH', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+class ReliableQueue:
+    """
+    單一 Worker 視角的可靠佇列
+
+    使用範例:
+        rq = ReliableQueue(r, "job_queue", "worker-1")
+        rq.register()
+        job_json = rq.reserve(timeout=5)
+        ...
+        rq.ack(job_json)
+    """
+
+    def __init__(
+        self,
+        r: redis.Redis,
+        queue_name: str,
+        worker_id: str,
+        heartbeat_ttl: int = 30,
+        max_deliveries: int = 3
+    ):
+        self.r = r
+        self.queue_name = queue_name
+        self.worker_id = worker_id
+        self.heartbeat_ttl = heartbeat_ttl
+        self.max_deliveries = max_deliveries
+        self.processing_key = self.processing_key_for(worker_id)
+        self.heartbeat_key = self.heartbeat_key_for(worker_id)
+        self._requeue = r.register_script(_REQUEUE_SCRIPT)
+        self._release = r.register_script(_RELEASE_SCRIPT)
+
+    def processing_key_for(self, worker_id: str) -> str:
+        return f"{self.queue_name}:processing:{worker_id}"
+
+    @staticmethod
+    def heartbeat_key_for(worker_id: str) -> str:
+        return f"worker:heartbeat:{worker_id}"
+
+    # ==========================================
+    # Worker 註冊與心跳
+    # ==========================================
+
+    def register(self) -> None:
+        """註冊 Worker 並送出第一次心跳"""
+        self.heartbeat()
+
+    def heartbeat(self) -> None:
+        """
+        刷新本 Worker 心跳 (同時維持 Backend 使用的全域心跳鍵)
+
+        每次心跳都重新加入註冊集合：Redis 中斷或行程暫停超過 heartbeat_ttl 時，
+        其他 Worker 的 reaper 會把本 Worker 移出集合，恢復後需重新註冊才會再被巡檢。
+        """
+        pipe = self.r.pipeline(transaction=False)
+        pipe.setex(self.heartbeat_key, self.heartbeat_ttl, "alive")
+        pipe.setex(GLOBAL_HEARTBEAT_KEY, self.heartbeat_ttl, "alive")
+        pipe.sadd(WORKER_REGISTRY_KEY, self.worker_id)
+        pipe.execute()
+
+    def unregister(self) -> None:
+        """正常關閉：處理中的任務放回佇列，移除心跳與註冊"""
+        self.r.delete(self.heartbeat_key)
+        moved = self._requeue(
+            keys=[self.heartbeat_key, self.processing_key, self.queue_name, WORKER_REGISTRY_KEY],
+            args=[self.worker_id],
+            client=self.r
+        )
+        if moved:
+            logger.info(f"↩️ 已將 {moved} 個未完成任務放回佇列")
+
+    # ==========================================
+    # 取出 / 確認
+    # ==========================================
+
+    def reserve(self, timeout: int = 5) -> Optional[str]:
+        """
+        阻塞式取出任務並原子地搬到 processing 清單
+        (回收放回 queue_name 的任務優先，其餘依各使用者子佇列公平輪詢)
+
+        Returns:
+            任務 JSON 字串；逾時返回 None
+        """
+        return scheduler.reserve(self.r, self.queue_name, self.processing_key, timeout)
+
+    def ack(self, job_json: str, job_id: str = None) -> None:
+        """任務處理結束，從 processing 清單移除"""
+        pipe = self.r.pipeline(transaction=False)
+        pipe.lrem(self.processing_key, 1, job_json)
+        if job_id:
+            pipe.hdel(DELIVERY_COUNT_KEY, job_id)
+        pipe.execute()
+
+    def release(self, job_json: str) -> bool:
+        """
+        未開始執行的任務放回佇列前端 (交給其他 Worker 或本 Worker 稍後重取)
+
+        Returns:
+            是否已放回 (任務已不在 processing 清單時為 False)
+        """
+        return bool(self._release(keys=[self.processing_key, self.queue_name], args=[job_json], client=self.r))
+
+    def record_delivery(self, job_id: str) -> bool:
+        """
+        記錄一次投遞
+
+        Returns:
+            False 表示已超過最大投遞次數 (毒任務)，呼叫端應標記失敗並 ack
+        """
+        deliveries = self.r.hincrby(DELIVERY_COUNT_KEY, job_id, 1)
+        if deliveries > 1:
+            logger.warning(f"↩️ 任務第 {deliveries} 次投遞 (前次 Worker 中斷): {job_id}")
+        return deliveries <= self.max_deliveries
+
+    # ==========================================
+    # 崩潰恢復
+    # ==========================================
+
+    def recover_own(self) -> int:
+        """
+        啟動時恢復本 Worker 上次遺留的 processing 清單
+        (固定 WORKER_ID 重啟時適用)
+        """
+        moved = 0
+        while self.r.lmove(self.processing_key, self.queue_name, "RIGHT", "LEFT"):
+            moved += 1
+        if moved:
+            logger.warning(f"↩️ 恢復上次未完成的 {moved} 個任務")
+        return moved
+
+    def reap(self) -> int:
+        """
+        巡檢所有已註冊 Worker，將心跳過期者的 processing 清單放回佇列前端
+
+        Returns:
+            放回的任務總數
+        """
+        total = 0
+        for worker_id in self.r.smembers(WORKER_REGISTRY_KEY):
+            if worker_id == self.worker_id:
+                continue
+            moved = self._requeue(
+                keys=[
+                    self.heartbeat_key_for(worker_id),
+                    self.processing_key_for(worker_id),
+                    self.queue_name,
+                    WORKER_REGISTRY_KEY,
+                ],
+                args=[worker_id],
+                client=self.r
+            )
+            if moved and moved > 0:
+                logger.warning(f"↩️ Worker {worker_id} 心跳逾時，已放回 {moved} 個任務")
+                total += moved
+        return total
+
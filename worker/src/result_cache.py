@@ -0,0 +1,145 @@
+"""
+Result Cache
+============
+固定 seed 的任務結果快取：相同的 workflow 圖 (prompt / 模型 / seed / 輸入檔案內容皆相同) 產生相同輸出，
+前端重試或重新開啟分享連結時不必重新算圖。
+
+- 鍵：完整解析後 workflow 的正規化 JSON (排序鍵、去除 _meta) 的 SHA-256；
+  輸入圖片檔名本身即內容雜湊 (in_<sha256>.png)，以任務 ID 命名的輸入檔 (音訊) 由呼叫端換成內容雜湊
+- 值：STORAGE_OUTPUT_DIR 中已存在的輸出檔；命中時以硬連結 (失敗時複製) 建立 <新任務 ID><副檔名>
+- Redis：
+    result:cache:<hash>   Hash {filename, job_id, created_at}，TTL 為 ttl 秒 (命中時續期)
+    result:cache:lru      ZSET hash -> 最後使用時間，超過 max_entries 時淘汰最久未使用者
+- 命中 / 未命中次數：studio_result_cache_lookups_total{result}
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+from pathlib import Path
+from typing import Optional
+
+from comfy_client import clone_file
+from shared.metrics import RESULT_CACHE_LOOKUPS, BYTES_COPIED
+
+logger = logging.getLogger("worker")
+
+ENTRY_KEY = "result:cache:{key}"
+LRU_KEY = "result:cache:lru"
+
+
+def workflow_key(workflow: dict, file_hashes: dict = None) -> str:
+    """
+    workflow 圖的正規化雜湊
+
+    Args:
+        workflow: 已注入參數的 API 格式 workflow
+        file_hashes: {檔名: 內容雜湊}，inputs 中出現這些檔名時以內容雜湊取代
+    """
+    file_hashes = file_hashes or {}
+    canonical = {}
+    for node_id, node_data in workflow.items():
+        inputs = {
+            key: f"sha256:{file_hashes[value]}" if isinstance(value, str) and value in file_hashes else value
+            for key, value in node_data.get("inputs", {}).items()
+        }
+        canonical[node_id] = {"class_type": node_data.get("class_type"), "inputs": inputs}
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    """檔案內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    使用範例:
+        cache = ResultCache(r, STORAGE_OUTPUT_DIR, ttl=7 * 86400, max_entries=10000)
+        key = workflow_key(workflow)
+        filename = cache.lookup(key, job_id)      # 命中時返回新任務的輸出檔名
+        ...
+        cache.store(key, new_filename, job_id)    # 任務成功後登記
+    """
+
+    def __init__(self, r, output_dir: Path, ttl: int = 604800, max_entries: int = 10000):
+        self.r = r
+        self.output_dir = Path(output_dir)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def size(self) -> int:
+        return self.r.zcard(LRU_KEY)
+
+    def lookup(self, key: str, job_id: str) -> Optional[str]:
+        """
+        查詢快取，命中時為 job_id 建立輸出檔
+
+        Returns:
+            新任務的輸出檔名 (相對 output_dir)；未命中返回 None
+        """
+        entry_key = ENTRY_KEY.format(key=key)
+        filename = self.r.hget(entry_key, "filename")
+        if not filename:
+            self.r.zrem(LRU_KEY, key)  # TTL 已到期的殘留 LRU 成員
+            RESULT_CACHE_LOOKUPS.labels(result="miss").inc()
+            return None
+
+        source = self.output_dir / filename
+        new_filename = f"{job_id}{source.suffix}"
+        try:
+            method = clone_file(source, self.output_dir / new_filename)
+        except OSError as e:
+            # 原輸出已被清理：移除快取項目
+            logger.warning(f"⚠️ 結果快取檔案已不存在，移除項目 {key[:12]}: {e}")
+            self.invalidate(key)
+            RESULT_CACHE_LOOKUPS.labels(result="stale").inc()
+            return None
+
+        # 硬連結共用 inode：更新 mtime 讓兩個檔案都不會被 30 天輸出清理提早刪除
+        os.utime(self.output_dir / new_filename)
+
+        now = time.time()
+        pipe = self.r.pipeline(transaction=False)
+        pipe.expire(entry_key, self.ttl)
+        pipe.zadd(LRU_KEY, {key: now})
+        pipe.execute()
+        BYTES_COPIED.labels(method=method).inc((self.output_dir / new_filename).stat().st_size)
+        RESULT_CACHE_LOOKUPS.labels(result="hit").inc()
+        logger.info(f"♻️ 結果快取命中 ({method}): {filename} -> {new_filename}")
+        return new_filename
+
+    def store(self, key: str, filename: str, job_id: str) -> None:
+        """登記任務輸出，超過 max_entries 時淘汰最久未使用的項目"""
+        now = time.time()
+        pipe = self.r.pipeline(transaction=False)
+        pipe.hset(ENTRY_KEY.format(key=key), mapping={"filename": filename, "job_id": job_id, "created_at": now})
+        pipe.expire(ENTRY_KEY.format(key=key), self.ttl)
+        pipe.zadd(LRU_KEY, {key: now})
+        pipe.zcard(LRU_KEY)
+        overflow = pipe.execute()[-1] - self.max_entries
+        if overflow > 0:
+            self._evict(overflow)
+
+    def invalidate(self, key: str) -> None:
+        pipe = self.r.pipeline(transaction=False)
+        pipe.delete(ENTRY_KEY.format(key=key))
+        pipe.zrem(LRU_KEY, key)
+        pipe.execute()
+
+    def _evict(self, count: int) -> None:
+        victims = [member for member, _ in self.r.zpopmin(LRU_KEY, count)]
+        if victims:
+            self.r.delete(*(ENTRY_KEY.format(key=key) for key in victims))
+            logger.info(f"🗑️ 結果快取淘汰 {len(victims)} 個最久未使用的項目")
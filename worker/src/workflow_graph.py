@@ -0,0 +1,126 @@
+"""
+Workflow Graph Index
+====================
+ComfyUI API 格式 workflow 的唯讀索引 (每個模板建立一次、重複使用)：
+- class_type / _meta.title / input 名稱 → 節點 ID 清單 (保持模板順序)
+- 邊索引：上游 (此節點的輸入來自哪裡) 與下游 (此節點的輸出被誰使用)
+
+節點間的連線在 API 格式中表示為 inputs 值 [來源節點 ID, 輸出槽位]。
+"""
+
+from collections import deque
+from typing import Iterable, Optional
+
+
+def is_link(value) -> bool:
+    """判斷 inputs 值是否為節點連線 [node_id, slot]"""
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+    )
+
+
+class WorkflowGraph:
+    """
+    workflow 節點與連線的索引
+
+    使用範例:
+        graph = WorkflowGraph(workflow)
+        graph.nodes_of_class("KSampler")          # ["3", ...]
+        graph.first_of_class("UNETLoader")        # "16" 或 None
+        graph.upstream["3"]                       # [("model", "16", 0), ...]
+        graph.ancestors(["110"])                  # 輸出節點依賴的所有節點
+    """
+
+    def __init__(self, workflow: dict):
+        self.nodes = workflow
+
+        self.by_class = {}     # class_type -> [node_id]
+        self.by_title = {}     # _meta.title -> [node_id]
+        self.by_input = {}     # input 名稱 -> [node_id]
+        self.upstream = {}     # node_id -> [(input 名稱, 來源 node_id, 槽位)]
+        self.downstream = {}   # node_id -> [(目標 node_id, input 名稱, 槽位)]
+
+        for node_id, node in workflow.items():
+            if not isinstance(node, dict):
+                continue
+
+            class_type = node.get("class_type")
+            if class_type:
+                self.by_class.setdefault(class_type, []).append(node_id)
+
+            title = node.get("_meta", {}).get("title")
+            if title:
+                self.by_title.setdefault(title, []).append(node_id)
+
+            edges = []
+            inputs = node.get("inputs")
+            if isinstance(inputs, dict):
+                for name, value in inputs.items():
+                    self.by_input.setdefault(name, []).append(node_id)
+                    if is_link(value):
+                        source_id, slot = value
+                        edges.append((name, source_id, slot))
+                        self.downstream.setdefault(source_id, []).append((node_id, name, slot))
+            self.upstream[node_id] = edges
+
+    # ==========================================
+    # 節點查詢
+    # ==========================================
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self.upstream
+
+    def nodes_of_class(self, class_type: str) -> list:
+        return self.by_class.get(class_type, [])
+
+    def first_of_class(self, class_type: str) -> Optional[str]:
+        nodes = self.by_class.get(class_type)
+        return nodes[0] if nodes else None
+
+    def nodes_with_title(self, title: str) -> list:
+        return self.by_title.get(title, [])
+
+    def nodes_with_input(self, name: str) -> list:
+        return self.by_input.get(name, [])
+
+    def class_of(self, node_id: str) -> Optional[str]:
+        node = self.nodes.get(node_id)
+        return node.get("class_type") if isinstance(node, dict) else None
+
+    def title_of(self, node_id: str) -> str:
+        node = self.nodes.get(node_id)
+        return node.get("_meta", {}).get("title", "") if isinstance(node, dict) else ""
+
+    # ==========================================
+    # 連線查詢
+    # ==========================================
+
+    def inputs_of(self, node_id: str) -> list:
+        """[(input 名稱, 來源 node_id, 槽位)]"""
+        return self.upstream.get(node_id, [])
+
+    def consumers_of(self, node_id: str) -> list:
+        """[(目標 node_id, input 名稱, 槽位)]"""
+        return self.downstream.get(node_id, [])
+
+    def ancestors(self, node_ids: Iterable[str], include_self: bool = True) -> set:
+        """沿上游走訪，返回指定節點依賴的所有節點"""
+        return self._walk(node_ids, include_self, lambda n: (src for _, src, _ in self.inputs_of(n)))
+
+    def descendants(self, node_ids: Iterable[str], include_self: bool = True) -> set:
+        """沿下游走訪，返回所有 (直接或間接) 使用指定節點輸出的節點"""
+        return self._walk(node_ids, include_self, lambda n: (dst for dst, _, _ in self.consumers_of(n)))
+
+    def _walk(self, node_ids: Iterable[str], include_self: bool, neighbours) -> set:
+        start = [n for n in node_ids if n in self]
+        seen = set(start) if include_self else set()
+        pending = deque(start)
+        while pending:
+            for nxt in neighbours(pending.popleft()):
+                if nxt in self and nxt not in seen:
+                    seen.add(nxt)
+                    pending.append(nxt)
+        return seen
@@ -0,0 +1,256 @@
+"""
+Workflow Template Registry
+==========================
+workflow 模板與 config.json 的記憶體快取：
+- 每個模板與 config.json 只讀取、解析一次，之後以 mtime 檢查是否需要重新載入
+- 載入時建立節點索引 (WorkflowGraph) 並預先計算「注入計畫」(InjectionPlan)：
+  prompt / seed / latent / model / 台詞 / prompt_segments 等欄位對應的節點 ID，
+  每個任務不再掃描 class_type
+- 每個任務只做模板的淺複製，修改節點時才複製該節點 (copy-on-write)
+
+模板本身視為唯讀，任何修改都必須透過 WorkflowTemplate.writable_node()。
+"""
+
+import json
+import threading
+from pathlib import Path
+from typing import Optional
+
+from config import WORKFLOW_DIR, WORKFLOW_CONFIG_PATH
+from workflow_graph import WorkflowGraph
+
+
+def _has_input(node: dict, key: str) -> bool:
+    return "inputs" in node and key in node["inputs"]
+
+
+class InjectionPlan:
+    """
+    單一 workflow 的注入計畫
+
+    每個欄位都是依原本 parse_workflow 判斷順序排列的候選清單。
+    任務執行時取第一個仍存在於工作流中的候選 (Veo3 動態裁剪可能刪除節點)，
+    因此結果與逐次掃描 class_type 完全相同。
+    """
+
+    # 尋找 prompt 節點時依序嘗試的 Veo 類別
+    VEO_CLASSES = ("VeoVideoGenerator", "Veo3StartEndVideoGenerator")
+    # 解析度注入的 latent 類別 (依序，找到一類即停止)
+    LATENT_CLASSES = ("EmptySD3LatentImage", "EmptyLatentImage")
+
+    def __init__(self, graph: WorkflowGraph, workflow_config: dict):
+        workflow = graph.nodes
+        mapping = workflow_config.get("mapping", {})
+
+        # virtual_human 台詞 (IndexTTS2BaseNode): (node_id, 說明) 或 None
+        self.tts_text = None
+        self.tts_warning = None
+        text_node_id = mapping.get("text_node_id")
+        if text_node_id and text_node_id in workflow:
+            if _has_input(workflow[text_node_id], "text"):
+                self.tts_text = (text_node_id, "config")
+            else:
+                self.tts_warning = f"Node {text_node_id} 沒有 inputs.text 欄位"
+        else:
+            tts_nodes = graph.nodes_of_class("IndexTTS2BaseNode")
+            if tts_nodes and _has_input(workflow[tts_nodes[0]], "text"):
+                self.tts_text = (tts_nodes[0], "fallback")
+
+        # Prompt 候選: [(node_id, input_key, 說明)]，依策略優先順序串接
+        self.prompt = []
+
+        # 1. CLIPTextEncode：標題含 Positive 者優先，否則第一個
+        clip_nodes = graph.nodes_of_class("CLIPTextEncode")
+        for node_id in clip_nodes:
+            title = graph.title_of(node_id)
+            if "Positive" in title or "positive" in title.lower():
+                self.prompt.append((node_id, "text", "CLIPTextEncode"))
+        for node_id in clip_nodes:
+            self.prompt.append((node_id, "text", "CLIPTextEncode"))
+
+        # 2. StringConstantMultiline：跳過標題含 trigger 的預設內容節點
+        for node_id in graph.nodes_of_class("StringConstantMultiline"):
+            node = workflow[node_id]
+            if "trigger" not in graph.title_of(node_id).lower() and _has_input(node, "string"):
+                self.prompt.append((node_id, "string", "StringConstantMultiline"))
+
+        # 3. TextEncodeQwenImageEditPlus：非 Negative 者優先，否則第一個有 prompt 的節點
+        qwen_nodes = graph.nodes_of_class("TextEncodeQwenImageEditPlus")
+        for node_id in qwen_nodes:
+            node = workflow[node_id]
+            if "negative" not in graph.title_of(node_id).lower() and _has_input(node, "prompt"):
+                self.prompt.append((node_id, "prompt", "TextEncodeQwenImageEditPlus"))
+        for node_id in qwen_nodes:
+            node = workflow[node_id]
+            if _has_input(node, "prompt") and (node["inputs"]["prompt"] or node["inputs"]["prompt"] == ""):
+                self.prompt.append((node_id, "prompt", "TextEncodeQwenImageEditPlus (fallback)"))
+
+        # 4. Veo3 影片生成節點
+        for veo_class in self.VEO_CLASSES:
+            for node_id in graph.nodes_of_class(veo_class):
+                if _has_input(workflow[node_id], "prompt"):
+                    self.prompt.append((node_id, "prompt", veo_class))
+
+        # 5. config.json 的 prompt_node_id (T2V/FLF 專用)
+        prompt_node_id = mapping.get("prompt_node_id")
+        if prompt_node_id and prompt_node_id in workflow and _has_input(workflow[prompt_node_id], "prompt"):
+            self.prompt.append((prompt_node_id, "prompt", "config"))
+
+        # Veo3 Long Video 多段 prompts: [(segment_index, node_id)]
+        self.prompt_segments = [
+            (int(index), node_id)
+            for index, node_id in mapping.get("prompt_segments", {}).items()
+        ]
+
+        # Seed / 解析度 / 模型候選 (依模板順序)
+        self.seed = graph.nodes_of_class("KSampler")
+        self.latent = [
+            (node_id, class_type)
+            for class_type in self.LATENT_CLASSES
+            for node_id in graph.nodes_of_class(class_type)
+        ]
+        self.unet = graph.nodes_of_class("UNETLoader")
+        self.checkpoint = graph.nodes_of_class("CheckpointLoaderSimple")
+
+        # 圖片 / 音訊直接以節點 ID 對應
+        self.image_map = workflow_config.get("image_map", {})
+        self.audio_node_id = mapping.get("audio_node_id")
+
+
+class WorkflowTemplate:
+    """已載入的 workflow 模板 (唯讀)、節點索引與注入計畫"""
+
+    def __init__(self, name: str, path: Path, mtime: float, workflow: dict, workflow_config: dict):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.workflow = workflow
+        self.config = workflow_config
+        self.graph = WorkflowGraph(workflow)
+        self.plan = InjectionPlan(self.graph, workflow_config)
+
+    def instantiate(self) -> dict:
+        """產生任務用的工作流：頂層淺複製，節點仍與模板共用"""
+        return dict(self.workflow)
+
+    def writable_node(self, job_workflow: dict, node_id: str) -> dict:
+        """
+        取得任務工作流中可修改的節點 (copy-on-write)
+
+        節點仍與模板共用時，複製節點本身、inputs 與 widgets_values 後放回任務工作流。
+        """
+        node = job_workflow[node_id]
+        if node is self.workflow.get(node_id):
+            node = dict(node)
+            if isinstance(node.get("inputs"), dict):
+                node["inputs"] = dict(node["inputs"])
+            widgets = node.get("widgets_values")
+            if isinstance(widgets, (list, dict)):
+                node["widgets_values"] = type(widgets)(widgets)
+            job_workflow[node_id] = node
+        return node
+
+
+class TemplateRegistry:
+    """
+    workflow 模板快取 (執行緒安全)
+
+    使用範例:
+        template = registry.get("text_to_image")
+        workflow = template.instantiate()
+        node = template.writable_node(workflow, node_id)
+    """
+
+    def __init__(self, workflow_dir: Path = WORKFLOW_DIR, config_path: Path = WORKFLOW_CONFIG_PATH):
+        self.workflow_dir = Path(workflow_dir)
+        self.config_path = Path(config_path)
+        self._lock = threading.Lock()
+        self._config = {}
+        self._config_mtime = None
+        self._templates = {}   # workflow_name -> WorkflowTemplate
+
+    # ==========================================
+    # config.json
+    # ==========================================
+
+    def get_config(self) -> dict:
+        """取得 config.json 內容 (mtime 變更時重新載入；讀取失敗返回空 dict)"""
+        with self._lock:
+            return self._load_config_locked()
+
+    def get_workflow_config(self, workflow_name: str) -> dict:
+        return self.get_config().get(workflow_name, {})
+
+    def _load_config_locked(self) -> dict:
+        try:
+            mtime = self.config_path.stat().st_mtime
+        except OSError:
+            if self._config_mtime is not None:
+                self._templates.clear()
+            self._config, self._config_mtime = {}, None
+            return self._config
+
+        if mtime != self._config_mtime:
+            try:
+                with open(self.config_path, "r", encoding="utf-8") as f:
+                    self._config = json.load(f)
+                print(f"[Registry] 已載入 config.json ({len(self._config)} 個 workflow)")
+            except Exception as e:
+                print(f"[Registry] ⚠️ 讀取 config.json 失敗，將使用 Fallback: {e}")
+                self._config = {}
+            self._config_mtime = mtime
+            # config 變更可能影響檔名與注入映射，所有模板重新建立
+            self._templates.clear()
+        return self._config
+
+    # ==========================================
+    # 模板
+    # ==========================================
+
+    def get_path(self, workflow_name: str, fallback_map: dict = None) -> Path:
+        """
+        取得 workflow JSON 檔案路徑
+        優先使用 config.json 的 file 欄位，否則使用 fallback_map (WORKFLOW_MAP)
+        """
+        with self._lock:
+            return self._resolve_path(self._load_config_locked(), workflow_name, fallback_map)
+
+    def _resolve_path(self, config: dict, workflow_name: str, fallback_map: Optional[dict]) -> Path:
+        workflow_config = config.get(workflow_name, {})
+        if "file" in workflow_config:
+            return self.workflow_dir / workflow_config["file"]
+        filename = (fallback_map or {}).get(workflow_name, f"{workflow_name}.json")
+        return self.workflow_dir / filename
+
+    def get(self, workflow_name: str, fallback_map: dict = None) -> WorkflowTemplate:
+        """
+        取得 workflow 模板 (檔案 mtime 變更時重新載入)
+
+        Raises:
+            FileNotFoundError: workflow 檔案不存在
+        """
+        with self._lock:
+            config = self._load_config_locked()
+            workflow_config = config.get(workflow_name, {})
+            path = self._resolve_path(config, workflow_name, fallback_map)
+
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                self._templates.pop(workflow_name, None)
+                raise FileNotFoundError(f"Workflow 檔案不存在: {path}")
+
+            template = self._templates.get(workflow_name)
+            if template is not None and template.path == path and template.mtime == mtime:
+                return template
+
+            with open(path, "r", encoding="utf-8") as f:
+                workflow = json.load(f)
+            template = WorkflowTemplate(workflow_name, path, mtime, workflow, workflow_config)
+            self._templates[workflow_name] = template
+            print(f"[Registry] 已載入 workflow 模板: {workflow_name} ({path.name}, {len(workflow)} 個節點)")
+            return template
+
+
+# Worker 共用的模板快取
+registry = TemplateRegistry()